@@ -1,11 +1,12 @@
 import logging
 import os
-import time
 import json
 from pathlib import Path
+from typing import AsyncGenerator
 
-import openai
-from azure.identity.aio import DefaultAzureCredential
+from azure.core.credentials import AzureKeyCredential
+from azure.identity.aio import DefaultAzureCredential, get_bearer_token_provider
+from openai import AsyncAzureOpenAI, AsyncOpenAI
 from quart import (
     Blueprint,
     Quart,
@@ -18,12 +19,26 @@ from quart import (
 from quart_cors import cors
 
 from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
+from core.answercache import SemanticAnswerCache
 from core.authentication import AuthenticationHelper
+from core.embeddingcache import EmbeddingCache
+from core.keywords import KeywordExtractor
+from core.metrics import REGISTRY, CallbackMetric, MetricsRegistry
+from core.modelhelper import get_encoding
+from core.ratelimit import RateLimitScheduler, parse_deployments
+from core.retrievers import AzureSearchRetriever, LocalVectorRetriever, parse_field_weights
+from core.searchclients import SearchClientRegistry
+from core.telemetry import configure_tracing
+from core.vectorsettings import VectorSettings
 
-CONFIG_OPENAI_TOKEN = "openai_token"
+CONFIG_OPENAI_CLIENT = "openai_client"
+CONFIG_SEARCH_CLIENTS = "search_clients"
+CONFIG_EMBEDDING_CACHE = "embedding_cache"
 CONFIG_CREDENTIAL = "azure_credential"
 CONFIG_CHAT_APPROACH = "chat_approach"
 CONFIG_AUTH_CLIENT = "auth_client"
+CONFIG_KEYWORD_EXTRACTOR = "keyword_extractor"
+CONFIG_LOCAL_RETRIEVER = "local_retriever"
 
 bp = Blueprint("routes", __name__, static_folder="static")
 
@@ -47,12 +62,14 @@ async def favicon():
 async def assets(path):
     return await send_from_directory(Path(__file__).resolve().parent / "static" / "assets", path)
 
-def format_as_ndjson(data):
-    """Convert a list of dictionaries to NDJSON format."""
-    if isinstance(data, list):
-        return "\n".join(json.dumps(record) for record in data)
-    else:
-        return json.dumps(data)
+async def format_as_ndjson(r: AsyncGenerator[dict, None]) -> AsyncGenerator[str, None]:
+    """Yield each event of the stream as one NDJSON line as soon as it is produced."""
+    try:
+        async for event in r:
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+    except Exception as e:
+        logging.exception("Exception while generating response stream")
+        yield json.dumps({"error": str(e)}, ensure_ascii=False) + "\n"
 
 @bp.route("/chat", methods=["POST"])
 async def chat():
@@ -70,17 +87,50 @@ async def chat():
             context=context,
             session_state=request_json.get("session_state"),
         )
-        if isinstance(result, dict):
+        if isinstance(result, (dict, str)):
             return jsonify(result)
         else:
             response = await make_response(format_as_ndjson(result))
             response.timeout = None  # type: ignore
+            response.mimetype = "application/json-lines"
             return response
     except Exception as e:
         logging.exception("Exception in /chat")
         return jsonify({"error": str(e)}), 500
 
 
+# Prometheus text format; the metrics are per worker process
+@bp.route("/metrics", methods=["GET"])
+async def metrics():
+    return REGISTRY.render(), 200, {"Content-Type": MetricsRegistry.CONTENT_TYPE}
+
+
+def register_cache_metrics(embedding_cache: EmbeddingCache, answer_cache) -> None:
+    """Exposes the hit counters of the caches, read when /metrics is scraped."""
+    caches = {"embedding": embedding_cache}
+    if answer_cache is not None:
+        caches["answer"] = answer_cache
+
+    def ratio(cache) -> float:
+        lookups = cache.hits + cache.misses
+        return cache.hits / lookups if lookups else 0.0
+
+    for name, kind, documentation, value in [
+        ("chat_cache_hits_total", "counter", "Lookups answered by the cache.", lambda cache: cache.hits),
+        ("chat_cache_misses_total", "counter", "Lookups not found in the cache.", lambda cache: cache.misses),
+        ("chat_cache_hit_ratio", "gauge", "Share of the lookups answered by the cache since the worker started.", ratio),
+    ]:
+        REGISTRY.register(
+            CallbackMetric(
+                name,
+                documentation,
+                kind,
+                lambda value=value: {(cache_name,): value(cache) for cache_name, cache in caches.items()},
+                ("cache",),
+            )
+        )
+
+
 # Send MSAL.js settings to the client UI
 @bp.route("/auth_setup", methods=["GET"])
 def auth_setup():
@@ -88,17 +138,34 @@ def auth_setup():
     return jsonify(auth_helper.get_auth_setup_for_client())
 
 
-@bp.before_request
-async def ensure_openai_token():
-    if openai.api_type != "azure_ad":
-        return
-    openai_token = current_app.config[CONFIG_OPENAI_TOKEN]
-    if openai_token.expires_on < time.time() + 60:
-        openai_token = await current_app.config[CONFIG_CREDENTIAL].get_token(
-            "https://cognitiveservices.azure.com/.default"
+def load_shared_state(app: Quart) -> None:
+    """
+    Loads the read-only state used by every request: the keyword idf table, the local vector store and the tiktoken
+    encoding. It runs in create_app, so with gunicorn's preload_app it runs once in the master and the workers share
+    this memory copy-on-write instead of each loading a copy. Anything a worker writes to or that holds connections
+    belongs in setup_clients instead.
+    """
+    # Retrieval backend: "azure" (Azure AI Search) or "local" (vector store filled by the indexing pipeline)
+    RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "azure")
+    LOCAL_VECTOR_STORE_DIR = os.getenv("LOCAL_VECTOR_STORE_DIR")
+    LOCAL_VECTOR_STORE_NPROBE = int(os.getenv("LOCAL_VECTOR_STORE_NPROBE", "0")) or None
+    LOCAL_HYBRID_FIELD_WEIGHTS = parse_field_weights(os.getenv("LOCAL_HYBRID_FIELD_WEIGHTS"))
+
+    # Corpus idf table built by indexing/build_idf.py
+    KEYWORD_IDF_PATH = os.getenv("KEYWORD_IDF_PATH")
+
+    app.config[CONFIG_KEYWORD_EXTRACTOR] = KeywordExtractor.from_path(KEYWORD_IDF_PATH)
+    app.config[CONFIG_LOCAL_RETRIEVER] = (
+        LocalVectorRetriever.from_path(
+            LOCAL_VECTOR_STORE_DIR,
+            nprobe=LOCAL_VECTOR_STORE_NPROBE,
+            field_weights=LOCAL_HYBRID_FIELD_WEIGHTS,
         )
-        current_app.config[CONFIG_OPENAI_TOKEN] = openai_token
-        openai.api_key = openai_token.token
+        if RETRIEVAL_BACKEND == "local"
+        else None
+    )
+    # Otherwise loaded by the first request of every worker
+    get_encoding("cl100k_base")
 
 
 @bp.before_app_serving
@@ -108,9 +175,14 @@ async def setup_clients():
     OPENAI_CHATGPT_MODEL = os.getenv("AZURE_OPENAI_CHATGPT_MODEL")
 
     # Used with Azure OpenAI deployments
-    AZURE_OPENAI_SERVICE = os.getenv("AZURE_OPENAI_SERVICE")
+    AZURE_OPENAI_ENDPOINT_URL = os.getenv("AZURE_OPENAI_ENDPOINT_URL")
+    AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
+    AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION")
     AZURE_OPENAI_CHATGPT_DEPLOYMENT = os.getenv("AZURE_OPENAI_CHATGPT_DEPLOYMENT")
     AZURE_OPENAI_EMBEDDING_DEPLOYMENT = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
+    # Optional "name:weight:requests/min:tokens/min,..." lists to spread requests over several deployments
+    AZURE_OPENAI_CHATGPT_DEPLOYMENTS = os.getenv("AZURE_OPENAI_CHATGPT_DEPLOYMENTS")
+    AZURE_OPENAI_EMBEDDING_DEPLOYMENTS = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENTS")
 
     # Used only with non-Azure OpenAI deployments
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -119,6 +191,21 @@ async def setup_clients():
     # Used for Azure AI Search
     AZURE_AI_SEARCH_ENDPOINT = os.getenv("AZURE_AI_SEARCH_ENDPOINT")
     AZURE_AI_SEARCH_INDEX_NAME = os.getenv("AZURE_AI_SEARCH_INDEX_NAME")
+    AZURE_AI_SEARCH_API_KEY = os.getenv("AZURE_AI_SEARCH_API_KEY")
+    AZURE_AI_SEARCH_POOL_SIZE = int(os.getenv("AZURE_AI_SEARCH_POOL_SIZE", "100"))
+    AZURE_AI_SEARCH_KEEPALIVE_SECONDS = float(os.getenv("AZURE_AI_SEARCH_KEEPALIVE_SECONDS", "30"))
+
+    # Semantic answer cache (ANSWER_CACHE_MAX_ENTRIES=0 disables it)
+    ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "10000"))
+    ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+    ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.97"))
+
+    # Exact-match embedding cache; EMBEDDING_CACHE_PATH adds an on-disk tier shared with the indexing pipeline
+    EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH")
+    EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "4096"))
+
+    # Share of the Azure AI Search queries written to the debug log (APP_LOG_LEVEL=DEBUG)
+    SEARCH_LOG_SAMPLE_RATE = float(os.getenv("SEARCH_LOG_SAMPLE_RATE", "0.01"))
 
     # Auth Infomation
     AZURE_USE_AUTHENTICATION = os.getenv("AZURE_USE_AUTHENTICATION", "").lower() == "true"
@@ -144,32 +231,91 @@ async def setup_clients():
         token_cache_path=TOKEN_CACHE_PATH,
     )
 
-    # Used by the OpenAI SDK
+    # Async clients are created once per worker and shared by all requests, so that concurrent requests
+    # overlap their I/O on the event loop instead of blocking it
     if OPENAI_HOST == "azure":
-        openai.api_type = "azure_ad"
-        openai.api_base = f"https://{AZURE_OPENAI_SERVICE}.openai.azure.com"
-        openai.api_version = "2023-07-01-preview"
-        openai_token = await azure_credential.get_token("https://cognitiveservices.azure.com/.default")
-        openai.api_key = openai_token.token
-        current_app.config[CONFIG_OPENAI_TOKEN] = openai_token
+        if AZURE_OPENAI_API_KEY:
+            # マネージド ID 認証が失敗する場合は AZURE_OPENAI_API_KEY を設定して API キー認証を使用する
+            openai_client = AsyncAzureOpenAI(
+                azure_endpoint=AZURE_OPENAI_ENDPOINT_URL,
+                api_key=AZURE_OPENAI_API_KEY,
+                api_version=AZURE_OPENAI_API_VERSION,
+            )
+        else:
+            token_provider = get_bearer_token_provider(azure_credential, "https://cognitiveservices.azure.com/.default")
+            openai_client = AsyncAzureOpenAI(
+                azure_endpoint=AZURE_OPENAI_ENDPOINT_URL,
+                azure_ad_token_provider=token_provider,
+                api_version=AZURE_OPENAI_API_VERSION,
+            )
     else:
-        openai.api_type = "openai"
-        openai.api_key = OPENAI_API_KEY
-        openai.organization = OPENAI_ORGANIZATION
+        openai_client = AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            organization=OPENAI_ORGANIZATION,
+        )
+
+    embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES)
+
+    # One pooled, keep-alive session per worker is shared by every search client and request
+    search_clients = SearchClientRegistry(
+        endpoint=AZURE_AI_SEARCH_ENDPOINT,
+        # マネージド ID 認証が失敗する場合は AZURE_AI_SEARCH_API_KEY を設定して API キー認証を使用する
+        credential=AzureKeyCredential(AZURE_AI_SEARCH_API_KEY) if AZURE_AI_SEARCH_API_KEY else azure_credential,
+        pool_size=AZURE_AI_SEARCH_POOL_SIZE,
+        keepalive_timeout=AZURE_AI_SEARCH_KEEPALIVE_SECONDS,
+    )
 
     current_app.config["TENANT_ID"] = AZURE_TENANT_ID
     current_app.config["CLIENT_ID"] = AZURE_SERVER_APP_ID
     current_app.config["APP_SECRET"] = AZURE_SERVER_APP_SECRET
     current_app.config[CONFIG_CREDENTIAL] = azure_credential
     current_app.config[CONFIG_AUTH_CLIENT] = auth_helper
-    current_app.config[CONFIG_CHAT_APPROACH] = ChatReadRetrieveReadApproach(
-        OPENAI_HOST,
-        AZURE_OPENAI_CHATGPT_DEPLOYMENT,
-        AZURE_OPENAI_EMBEDDING_DEPLOYMENT,
-        OPENAI_CHATGPT_MODEL,
-        AZURE_AI_SEARCH_ENDPOINT,
-        AZURE_AI_SEARCH_INDEX_NAME,
+    current_app.config[CONFIG_OPENAI_CLIENT] = openai_client
+    current_app.config[CONFIG_SEARCH_CLIENTS] = search_clients
+    retriever = current_app.config[CONFIG_LOCAL_RETRIEVER]
+    # The local backend runs without Azure AI Search, so its client is only created when the index is queried
+    search_client = None
+    if retriever is None:
+        search_client = search_clients.get(AZURE_AI_SEARCH_INDEX_NAME)
+        # Queries the vector fields and dimensions the index was created with (see indexing/modules/search.py)
+        retriever = AzureSearchRetriever(search_client, VectorSettings.from_env(), log_sample_rate=SEARCH_LOG_SAMPLE_RATE)
+    current_app.config[CONFIG_EMBEDDING_CACHE] = embedding_cache
+    chat_approach = ChatReadRetrieveReadApproach(
+        openai_client=openai_client,
+        search_client=search_client,
+        openai_host=OPENAI_HOST,
+        chatgpt_deployment=AZURE_OPENAI_CHATGPT_DEPLOYMENT,
+        embedding_deployment=AZURE_OPENAI_EMBEDDING_DEPLOYMENT,
+        chatgpt_model=OPENAI_CHATGPT_MODEL,
+        ai_search_endpoint=AZURE_AI_SEARCH_ENDPOINT,
+        ai_search_index_name=AZURE_AI_SEARCH_INDEX_NAME,
+        keyword_extractor=current_app.config[CONFIG_KEYWORD_EXTRACTOR],
+        answer_cache=SemanticAnswerCache(
+            max_entries=ANSWER_CACHE_MAX_ENTRIES,
+            ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+            similarity_threshold=ANSWER_CACHE_SIMILARITY_THRESHOLD,
+        )
+        if ANSWER_CACHE_MAX_ENTRIES > 0
+        else None,
+        embedding_cache=embedding_cache,
+        retriever=retriever,
+        chat_scheduler=RateLimitScheduler(parse_deployments(AZURE_OPENAI_CHATGPT_DEPLOYMENTS))
+        if AZURE_OPENAI_CHATGPT_DEPLOYMENTS
+        else None,
+        embedding_scheduler=RateLimitScheduler(parse_deployments(AZURE_OPENAI_EMBEDDING_DEPLOYMENTS))
+        if AZURE_OPENAI_EMBEDDING_DEPLOYMENTS
+        else None,
     )
+    current_app.config[CONFIG_CHAT_APPROACH] = chat_approach
+    register_cache_metrics(embedding_cache, chat_approach.answer_cache)
+
+
+@bp.after_app_serving
+async def close_clients():
+    await current_app.config[CONFIG_OPENAI_CLIENT].close()
+    await current_app.config[CONFIG_SEARCH_CLIENTS].close()
+    await current_app.config[CONFIG_CREDENTIAL].close()
+    current_app.config[CONFIG_EMBEDDING_CACHE].close()
 
 
 def create_app():
@@ -181,6 +327,9 @@ def create_app():
     if os.getenv("WEBSITE_HOSTNAME"):  # In production, don't log as heavily
         default_level = "WARNING"
     logging.basicConfig(level=os.getenv("APP_LOG_LEVEL", default_level))
+    # Spans of the chat stages are exported only when OTEL_TRACES_EXPORTER is set
+    configure_tracing()
+    load_shared_state(app)
 
     if allowed_origin := os.getenv("ALLOWED_ORIGIN"):
         app.logger.info("CORS enabled for %s", allowed_origin)
@@ -1,31 +1,22 @@
-import os
+import asyncio
 import json
 import logging
+import time
 from typing import Any, AsyncGenerator, Optional, Union
 
-from openai import AzureOpenAI
+from openai import AsyncOpenAI
+from opentelemetry import trace
 from approaches.approach import Approach
+from core.answercache import SemanticAnswerCache
+from core.embeddingcache import EmbeddingCache
+from core.keywords import KeywordExtractor
 from core.messagebuilder import MessageBuilder
-from core.modelhelper import get_token_limit
-from azure.search.documents import SearchClient
-from azure.search.documents.models import VectorizedQuery
-from azure.core.credentials import AzureKeyCredential
-import dotenv
-from sklearn.feature_extraction.text import TfidfVectorizer
-from azure.identity import DefaultAzureCredential, get_bearer_token_provider
-
-dotenv.load_dotenv()
-
-token_provider = get_bearer_token_provider(
-    DefaultAzureCredential(),
-    'https://cognitiveservices.azure.com/.default',
-)
-aoai_client = AzureOpenAI(
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT_URL"),
-    azure_ad_token_provider=token_provider,
-    # api_key=os.getenv("AZURE_OPENAI_API_KEY"), # マネージド ID 認証が失敗する場合はこちらのコメントアウトを解除して DefaultAzureCredentialを使用する引数をコメントアウト
-    api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-)
+from core.modelhelper import get_encoding, get_token_limit, num_tokens_from_messages_batch
+from core.ratelimit import RateLimitScheduler
+from core.retrievers import AzureSearchRetriever, Retriever
+from core.stagedexecutor import StagedExecutor
+from core.telemetry import REQUEST_SECONDS, STAGE_SECONDS, record_tokens, tracer
+from azure.search.documents.aio import SearchClient
 
 class ChatReadRetrieveReadApproach(Approach):
     # Chat roles
@@ -33,6 +24,8 @@ class ChatReadRetrieveReadApproach(Approach):
     USER = "user"
     ASSISTANT = "assistant"
     NO_RESPONSE = "0"
+    NOT_FOUND_MESSAGE = "検索結果が見つかりませんでした。"
+    RESPONSE_TOKEN_LIMIT = 4096
 
     """
     Simple retrieve-then-read implementation, using the Cognitive Search and OpenAI APIs directly. It first retrieves
@@ -60,13 +53,26 @@ class ChatReadRetrieveReadApproach(Approach):
 
     def __init__(
         self,
+        openai_client: AsyncOpenAI,
         openai_host: str,
         chatgpt_deployment: Optional[str],  # Not needed for non-Azure OpenAI
         embedding_deployment: Optional[str],  # Not needed for non-Azure OpenAI
         chatgpt_model: str,
-        ai_search_endpoint: str,
-        ai_search_index_name: str,
+        ai_search_endpoint: Optional[str],
+        ai_search_index_name: Optional[str],
+        search_client: Optional[SearchClient] = None,  # Not needed with another retriever
+        overlap_stages: bool = True,
+        keyword_extractor: Optional[KeywordExtractor] = None,
+        answer_cache: Optional[SemanticAnswerCache] = None,
+        embedding_cache: Optional[EmbeddingCache] = None,
+        retriever: Optional[Retriever] = None,
+        chat_scheduler: Optional[RateLimitScheduler] = None,
+        embedding_scheduler: Optional[RateLimitScheduler] = None,
     ):
+        # Both clients are owned by the app and shared by every request served by this worker,
+        # so their connection pools are reused instead of being rebuilt per request
+        self.openai_client = openai_client
+        self.search_client = search_client
         self.openai_host = openai_host
         self.chatgpt_deployment = chatgpt_deployment
         self.embedding_deployment = embedding_deployment
@@ -74,6 +80,21 @@ class ChatReadRetrieveReadApproach(Approach):
         self.chatgpt_token_limit = get_token_limit(chatgpt_model)
         self.ai_search_endpoint = ai_search_endpoint
         self.ai_search_index_name = ai_search_index_name
+        self.overlap_stages = overlap_stages
+        # Loaded once per worker; without a corpus idf table keywords are ranked by term frequency only
+        self.keyword_extractor = keyword_extractor or KeywordExtractor()
+        self.answer_cache = answer_cache
+        self.embedding_cache = embedding_cache
+        # Azure AI Search unless another retrieval backend (e.g. a local vector store) is given
+        self.retriever = retriever or AzureSearchRetriever(search_client)
+        # When set, requests are spread over several deployments within their rate limits instead of the single
+        # chatgpt_model / embedding_deployment
+        self.chat_scheduler = chat_scheduler
+        self.embedding_scheduler = embedding_scheduler
+        # Scheduled requests are retried by the scheduler, so this copy (sharing the connection pool) does not retry
+        self.scheduled_openai_client = (
+            openai_client.with_options(max_retries=0) if chat_scheduler is not None or embedding_scheduler is not None else None
+        )
 
     async def run_without_streaming(
         self,
@@ -82,10 +103,22 @@ class ChatReadRetrieveReadApproach(Approach):
         obo_token,
         session_state: Any = None,
     ) -> dict[str, Any]:
-        chat_resp = await self.run_ai_search_chat(
-            history, obo_token
-        )
-        return chat_resp
+        hit, completion = await self.run_ai_search_chat(history, obo_token)
+        if completion is None:
+            return {
+                "id": "0",
+                "choices": [
+                    {
+                        "message": {
+                            "role": self.ASSISTANT,
+                            "content": self.NOT_FOUND_MESSAGE
+                        }
+                    }
+                ]
+            }
+        if isinstance(completion, str):
+            return self.to_completion_json(completion)
+        return completion.to_json()
 
     async def run_with_streaming(
         self,
@@ -94,9 +127,11 @@ class ChatReadRetrieveReadApproach(Approach):
         obo_token,
         session_state: Any = None,
     ) -> AsyncGenerator[dict, None]:
-        extra_info, chat_coroutine = await self.run_simple_chat(
-            history, overrides, should_stream=True
-        )
+        hit, chat_stream = await self.run_ai_search_chat(history, obo_token, should_stream=True)
+        extra_info = {
+            "data_points": [self.to_data_point(hit)] if hit else [],
+            "thoughts": None,
+        }
         yield {
             "choices": [
                 {
@@ -110,10 +145,18 @@ class ChatReadRetrieveReadApproach(Approach):
             "object": "chat.completion.chunk",
         }
 
-        async for event in await chat_coroutine:
-            # "2023-07-01-preview" API version has a bug where first response has empty choices
-            if event["choices"]:
-                yield event
+        if chat_stream is None or isinstance(chat_stream, str):
+            content = self.NOT_FOUND_MESSAGE if chat_stream is None else chat_stream
+            yield {
+                "choices": [{"delta": {"content": content}, "finish_reason": "stop", "index": 0}],
+                "object": "chat.completion.chunk",
+            }
+            return
+
+        async for event in chat_stream:
+            # Azure OpenAI sends a first chunk with empty choices that only carries prompt filter results
+            if event.choices:
+                yield event.model_dump()
 
     async def run(
         self, messages: list[dict], stream: bool = False, session_state: Any = None, context: dict[str, Any] = {}
@@ -146,14 +189,7 @@ class ChatReadRetrieveReadApproach(Approach):
         message_builder.append_message(self.USER, user_content, index=append_index)
         total_token_count = message_builder.count_tokens_for_message(message_builder.messages[-1])
 
-        newest_to_oldest = list(reversed(history[:-1]))
-        for message in newest_to_oldest:
-            potential_message_count = message_builder.count_tokens_for_message(message)
-            if (total_token_count + potential_message_count) > max_tokens:
-                logging.debug("Reached max tokens of %d, history will be truncated", max_tokens)
-                break
-            message_builder.append_message(message["role"], message["content"], index=append_index)
-            total_token_count += potential_message_count
+        message_builder.append_history(history[:-1], max_tokens - total_token_count, index=append_index)
         return message_builder.messages
 
     def get_search_query(self, chat_completion: dict[str, Any], user_query: str):
@@ -174,100 +210,156 @@ class ChatReadRetrieveReadApproach(Approach):
         history: list[dict[str, str]],
         obo_token,
         should_stream: bool = False,
-    ) -> tuple:
-        # Step 1: Extract keywords from user input
+    ) -> tuple[Optional[dict[str, Any]], Any]:
+        """
+        Returns the top search hit and the chat completion generated from it, or (None, None) when search finds
+        nothing. With should_stream=True the completion is the async stream of chunks. When the answer cache has an
+        answer for a near-identical question with the same top hit, the completion is that answer text instead.
+        """
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            with tracer.start_as_current_span("chat") as span:
+                outcome, hit, completion = await self.__retrieve_and_answer(history, should_stream)
+                span.set_attribute("chat.outcome", outcome)
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, outcome=outcome)
+        return hit, completion
+
+    async def __retrieve_and_answer(self, history: list[dict[str, str]], should_stream: bool) -> tuple[str, Any, Any]:
+        """Runs the stages of run_ai_search_chat and returns how the request was answered, the hit and the completion."""
+        executor = StagedExecutor(overlap=self.overlap_stages)
         user_input = history[-1]["content"]
-        keywords = self.__extract_keywords(user_input)
 
-        # Step 2: Generate embedding from user input
-        input_embedding = await self.__embed_text(user_input)
+        # Step 1 and 2: Extract keywords from user input (CPU, in a worker thread) while its embedding is requested
+        keywords, input_embedding = await executor.gather(
+            executor.run_in_thread("extract_keywords", self.__extract_keywords, user_input),
+            executor.run("embed", self.__embed_text(user_input)),
+        )
 
         # Step 3: Hybrid search using the input embedding
-        search_results = self.__perform_hybrid_search(input_embedding, keywords)
+        search_results = await executor.run("search", self.__perform_hybrid_search(input_embedding, keywords))
         if len(search_results) == 0:
-            return {
-                "id": "0",
-                "choices": [
-                    {
-                        "message": {
-                            "role": self.ASSISTANT,
-                            "content": "検索結果が見つかりませんでした。"
-                        }
-                    }
-                ]
-            }
-        hit_existing_question = search_results[0]["question"]
-        hit_existing_answer = search_results[0]["answer"]
+            logging.debug("Stage timings: %s", executor.format_timings())
+            return "not_found", None, None
+        hit = search_results[0]
+
+        # Follow-up questions depend on the conversation, so only first questions are answered from the cache
+        use_cache = self.answer_cache is not None and len(history) == 1
+        if use_cache and (cached_answer := self.answer_cache.lookup(input_embedding, hit["id"])) is not None:
+            logging.debug("Stage timings: %s", executor.format_timings())
+            return "cached", hit, cached_answer
+
+        # Step 4: Build the prompt from the citation sources (token counting, in a worker thread) and generate the answer
+        answer_messages, prompt_tokens = await executor.run_in_thread(
+            "build_prompt", self.__build_answer_messages, hit["question"], hit["answer"], history
+        )
+        completion = await executor.run("completion", self.__complete(answer_messages, prompt_tokens, should_stream))
+        logging.debug("Stage timings: %s", executor.format_timings())
+        if should_stream:
+            completion = self.__measure_streamed_answer(completion, trace.get_current_span())
+        if use_cache:
+            if should_stream:
+                completion = self.__cache_streamed_answer(completion, input_embedding, hit["id"])
+            elif completion.choices and completion.choices[0].message.content:
+                self.answer_cache.store(input_embedding, hit["id"], completion.choices[0].message.content)
+        return "answered", hit, completion
+
+    async def __measure_streamed_answer(self, chat_stream, parent: trace.Span):
+        # The completion stage ends when the first chunk can be read; streaming the rest is measured here.
+        # Streamed chunks carry no usage, so the completion tokens are counted from the text.
+        span = tracer.start_span("stream_completion", context=trace.set_span_in_context(parent))
+        start = time.perf_counter()
+        contents = []
+        try:
+            async for event in chat_stream:
+                if event.choices:
+                    contents.append(event.choices[0].delta.content or "")
+                yield event
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - start, stage="stream_completion")
+            completion_tokens = len(get_encoding("cl100k_base").encode_ordinary("".join(contents)))
+            record_tokens("completion", completion_tokens, span=span, stage_name="stream_completion")
+            span.end()
 
-        # Step 4: Generate answer using citation sources
-        chat_coroutine = await self.__answer_using_document(
-            hit_existing_question, 
-            hit_existing_answer, 
-            history, 
-            should_stream)
-        return chat_coroutine.to_json()
+    async def __cache_streamed_answer(self, chat_stream, input_embedding: list[float], hit_id: str):
+        # Passes the chunks through unchanged and caches the answer once the stream finished normally
+        contents = []
+        finish_reason = None
+        async for event in chat_stream:
+            if event.choices:
+                contents.append(event.choices[0].delta.content or "")
+                finish_reason = event.choices[0].finish_reason or finish_reason
+            yield event
+        if finish_reason == "stop":
+            self.answer_cache.store(input_embedding, hit_id, "".join(contents))
+
+    def to_data_point(self, hit: dict[str, Any]) -> dict[str, str]:
+        return {"id": hit["id"], "name": hit["question"], "web_url": "", "hit_id": hit["id"]}
+
+    def to_completion_json(self, content: str) -> str:
+        # Same shape (and formatting) as ChatCompletion.to_json() for answers served from the cache
+        return json.dumps(
+            {
+                "id": "cached",
+                "choices": [
+                    {"finish_reason": "stop", "index": 0, "message": {"content": content, "role": self.ASSISTANT}}
+                ],
+                "object": "chat.completion",
+            },
+            indent=2,
+        )
 
     def __extract_keywords(self, text: str) -> str:
-        documents = [text]
-        vectorizer = TfidfVectorizer()
-        X = vectorizer.fit_transform(documents)
-        words = vectorizer.get_feature_names_out()
-        scores = X.toarray().flatten()
-        important_words = [words[i] for i in scores.argsort()[-5:]]  # Top 5 words
-        return " ".join(important_words)
+        keywords = self.keyword_extractor.extract(text)  # Top 5 words by corpus tf-idf
+        trace.get_current_span().set_attribute("keywords.count", len(keywords.split()))
+        return keywords
     
+    async def __call_embedding_cache(self, func, *args):
+        # A SQLite tier blocks on disk I/O (behind a lock shared with other threads), so it runs off the event loop
+        if self.embedding_cache.path:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
     async def __embed_text(self, text: str):
-        embedding_response = aoai_client.embeddings.create(
-            input=text,
-            model=self.embedding_deployment,
-        )
+        if self.embedding_cache is not None:
+            cached_vector = await self.__call_embedding_cache(self.embedding_cache.get, self.embedding_deployment, text)
+            trace.get_current_span().set_attribute("embedding.cache_hit", cached_vector is not None)
+            if cached_vector is not None:
+                return cached_vector
+        if self.embedding_scheduler is not None:
+            estimated_tokens = len(get_encoding("cl100k_base").encode_ordinary(text))
+            embedding_response = await self.embedding_scheduler.acall(
+                lambda model: self.scheduled_openai_client.embeddings.create(input=text, model=model),
+                estimated_tokens,
+            )
+        else:
+            embedding_response = await self.openai_client.embeddings.create(
+                input=text,
+                model=self.embedding_deployment,
+            )
+        if embedding_response.usage is not None:
+            record_tokens("prompt", embedding_response.usage.prompt_tokens)
         embedded_vector = embedding_response.data[0].embedding
+        if self.embedding_cache is not None:
+            await self.__call_embedding_cache(self.embedding_cache.put, self.embedding_deployment, text, embedded_vector)
         return embedded_vector
 
-    def __perform_hybrid_search(self, input_embedding: float, search_text: str = "*"):
-        AZURE_AI_SEARCH_API_KEY = os.getenv("AZURE_AI_SEARCH_API_KEY")
-        key_credential = AzureKeyCredential(AZURE_AI_SEARCH_API_KEY)
-        aisearch_client = SearchClient(
-            endpoint=self.ai_search_endpoint,
-            index_name=self.ai_search_index_name,
-            # credential=DefaultAzureCredential(),
-            credential=key_credential # マネージド ID 認証が失敗する場合はこちらのコメントアウトを解除して DefaultAzureCredentialを使用する引数をコメントアウト
-        )
-
+    async def __perform_hybrid_search(self, input_embedding: list[float], search_text: str = "*"):
         k = 10
-        question_vector = VectorizedQuery(
-            vector=input_embedding,
-            k_nearest_neighbors=k, 
-            fields="question_vector",
-        )
-        answer_vector = VectorizedQuery(
-            vector=input_embedding,
-            k_nearest_neighbors=k, 
-            fields="answer_vector",
-        )
-        # print("質問ベクトル:", question_vector)
-        # print("回答ベクトル:", answer_vector)
-        item_paged = aisearch_client.search(
-            vector_queries=[question_vector, answer_vector],
-            search_text=search_text,
-            top=k,
-        )
-        results: list[dict] = []
-        for item in item_paged:
-            results.append(item)
-        print("検索結果:", results)
+        results = await self.retriever.search(input_embedding, search_text, top=k)
+        trace.get_current_span().set_attribute("search.results", len(results))
         return results
     
-    async def __answer_using_document(
+    def __build_answer_messages(
             self,
             hit_existing_question: str,
             hit_existing_answer: str,
-            history: list[dict[str, str]], 
-            should_stream: bool = False):
+            history: list[dict[str, str]]) -> tuple[list[dict[str, str]], int]:
+        """Returns the messages of the answer prompt and their token count."""
         original_user_query = history[-1]["content"]
         user_content = "ユーザーの質問文: " + original_user_query + "\n\n類似した既存の質問: " + hit_existing_question + "\n\n類似した既存の質問に対する回答: " + hit_existing_answer
-        response_token_limit = 4096
-        messages_token_limit = self.chatgpt_token_limit - response_token_limit
+        messages_token_limit = self.chatgpt_token_limit - self.RESPONSE_TOKEN_LIMIT
         answer_messages = self.get_messages_from_history(
             system_prompt=self.system_message_chat_conversation,
             model_id=self.chatgpt_model,
@@ -275,14 +367,32 @@ class ChatReadRetrieveReadApproach(Approach):
             user_content=user_content,
             max_tokens=messages_token_limit,
         )
+        # Counted once the messages are built (the counts are cached), for the span and the rate limit estimate
+        prompt_tokens = sum(num_tokens_from_messages_batch(answer_messages, self.chatgpt_model))
+        record_tokens("prompt", prompt_tokens)
+        return answer_messages, prompt_tokens
 
-        completion = aoai_client.chat.completions.create(
-            model=self.chatgpt_model,
-            messages=answer_messages,
-            temperature=0,
-            max_tokens=response_token_limit,
-            n=1,
-            stream=should_stream
-        )
+    async def __complete(self, answer_messages: list[dict[str, str]], prompt_tokens: int, should_stream: bool = False):
+        def send(openai_client: AsyncOpenAI, model: str):
+            return openai_client.chat.completions.create(
+                model=model,
+                messages=answer_messages,
+                temperature=0,
+                max_tokens=self.RESPONSE_TOKEN_LIMIT,
+                n=1,
+                stream=should_stream
+            )
+
+        if self.chat_scheduler is not None:
+            # Rate limits count the prompt plus the most tokens the completion may use
+            estimated_tokens = prompt_tokens + self.RESPONSE_TOKEN_LIMIT
+            completion = await self.chat_scheduler.acall(
+                lambda model: send(self.scheduled_openai_client, model), estimated_tokens
+            )
+        else:
+            completion = await send(self.openai_client, self.chatgpt_model)
 
+        if not should_stream and completion.usage is not None:
+            record_tokens("prompt", completion.usage.prompt_tokens)
+            record_tokens("completion", completion.usage.completion_tokens)
         return completion
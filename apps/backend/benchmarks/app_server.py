@@ -0,0 +1,43 @@
+"""
+Run the Quart backend in-process on uvicorn, configured through environment variables to talk to the local stubs.
+"""
+import asyncio
+import os
+
+import uvicorn
+
+
+def stub_environment(base_url: str) -> dict[str, str]:
+    return {
+        "OPENAI_HOST": "azure",
+        "AZURE_OPENAI_ENDPOINT_URL": base_url,
+        "AZURE_OPENAI_API_KEY": "stub",
+        "AZURE_OPENAI_API_VERSION": "2025-01-01-preview",
+        "AZURE_OPENAI_CHATGPT_MODEL": "gpt-4o",
+        "AZURE_OPENAI_CHATGPT_DEPLOYMENT": "gpt-4o",
+        "AZURE_OPENAI_EMBEDDING_DEPLOYMENT": "text-embedding-3-large",
+        "AZURE_AI_SEARCH_ENDPOINT": base_url,
+        "AZURE_AI_SEARCH_INDEX_NAME": "documents",
+        "AZURE_AI_SEARCH_API_KEY": "stub",
+        "AZURE_USE_AUTHENTICATION": "false",
+        "APP_LOG_LEVEL": "WARNING",
+    }
+
+
+async def start_app_server(base_url: str, host: str = "127.0.0.1") -> tuple[uvicorn.Server, asyncio.Task, str]:
+    """
+    Start the backend against the stub services at base_url and return (server, task, app_url).
+    Stop it with `server.should_exit = True; await task`.
+    """
+    os.environ.update(stub_environment(base_url))
+    from app import create_app
+
+    config = uvicorn.Config(create_app(), host=host, port=0, log_level="warning", lifespan="on")
+    server = uvicorn.Server(config)
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, task, f"http://{host}:{port}"
@@ -0,0 +1,50 @@
+"""
+Measure SemanticAnswerCache lookup latency when filled with random embeddings spread over many top hit ids.
+
+Usage (from apps/backend):
+    python -m benchmarks.bench_answer_cache --entries 100000 --hit-ids 2000 --dimensions 3072
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from core.answercache import SemanticAnswerCache
+
+
+def main(args):
+    rng = np.random.default_rng(0)
+    cache = SemanticAnswerCache(max_entries=args.entries, ttl_seconds=3600)
+    vectors = rng.standard_normal((args.entries, args.dimensions), dtype=np.float32)
+    hit_ids = [f"doc-{i % args.hit_ids}" for i in range(args.entries)]
+    start = time.perf_counter()
+    for vector, hit_id, i in zip(vectors, hit_ids, range(args.entries)):
+        cache.store(vector, hit_id, f"answer {i}")
+    print(f"filled {len(cache)} entries in {time.perf_counter() - start:.1f}s")
+
+    samples = rng.integers(0, args.entries, args.lookups)
+    timings = {"hit": [], "miss": []}
+    for i in samples:
+        # A slightly perturbed copy of a stored question should hit, an unrelated vector should miss
+        near = vectors[i] + rng.standard_normal(args.dimensions, dtype=np.float32) * 0.05
+        far = rng.standard_normal(args.dimensions, dtype=np.float32)
+        for label, query in (("hit", near), ("miss", far)):
+            start = time.perf_counter()
+            cache.lookup(query, hit_ids[i])
+            timings[label].append(time.perf_counter() - start)
+
+    print(f"{'lookup':>6} {'p50[us]':>8} {'p99[us]':>8}")
+    for label, values in timings.items():
+        values.sort()
+        print(f"{label:>6} {statistics.median(values) * 1e6:>8.1f} {values[int(len(values) * 0.99) - 1] * 1e6:>8.1f}")
+    print(cache.stats())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--hit-ids", type=int, default=2000)
+    parser.add_argument("--dimensions", type=int, default=3072)
+    parser.add_argument("--lookups", type=int, default=1000)
+    main(parser.parse_args())
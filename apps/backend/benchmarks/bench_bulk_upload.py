@@ -0,0 +1,128 @@
+"""
+Upload documents with two 3072-dimension vectors to a local stub of the Azure AI Search index endpoint, in the batches
+the indexing pipeline forms, from its upload threads:
+  sdk   SearchClient.upload_documents per batch, as indexing did (per-document results not checked)
+  bulk  BulkUploader: exact-size requests, several in flight, documents rejected with a transient status sent again
+The stub rejects a share of the documents of each request with 503, and requests over its size limit with 413.
+
+Usage (from apps/backend):
+    python -m benchmarks.bench_bulk_upload --documents 2000 --failure-probability 0.02
+"""
+import argparse
+import concurrent.futures
+import os
+import random
+import sys
+import time
+
+from azure.core.credentials import AzureKeyCredential
+from azure.search.documents import SearchClient
+from azure.search.documents.aio import SearchClient as AsyncSearchClient
+
+from benchmarks.bench_embedding_batches import start_stub_in_thread
+from benchmarks.stub_services import StubConfig
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "indexing"))
+from modules.pipeline import estimate_document_bytes  # noqa: E402
+from modules.uploader import BulkUploader  # noqa: E402
+
+INDEX_NAME = "documents"
+
+
+def make_documents(count: int, dimensions: int) -> list[dict]:
+    rng = random.Random(0)
+    return [
+        {
+            "id": f"{i:032x}",
+            "question": f"プリンタから印刷できない。 {i}",
+            "answer": f"ドライバを更新し、再起動後に印刷できることを確認した。 {i}",
+            "services": ["printer", "", ""],
+            "tag": ["hardware"],
+            # Embeddings arrive as float32 values widened to Python floats, which serialize with up to 17 digits
+            "question_vector": [rng.uniform(-0.1, 0.1) for _ in range(dimensions)],
+            "answer_vector": [rng.uniform(-0.1, 0.1) for _ in range(dimensions)],
+        }
+        for i in range(count)
+    ]
+
+
+def make_batches(documents: list[dict], max_bytes: int) -> list[list[dict]]:
+    # The grouping of IndexingPipeline._batch_worker, by estimated size
+    batches, batch, size = [], [], 0
+    for document in documents:
+        document_bytes = estimate_document_bytes(document)
+        if batch and (size + document_bytes > max_bytes or len(batch) == 1000):
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(document)
+        size += document_bytes
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def run(upload, batches: list[list[dict]], concurrency: int) -> tuple[float, int]:
+    """Returns (seconds, batches that raised)."""
+    start = time.perf_counter()
+    errors = 0
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        for future in [executor.submit(upload, batch) for batch in batches]:
+            try:
+                future.result()
+            except Exception:
+                errors += 1
+    return time.perf_counter() - start, errors
+
+
+def main(args):
+    config = StubConfig(
+        index_latency=args.latency,
+        index_latency_per_mb=args.latency_per_mb,
+        index_max_request_bytes=args.max_request_mb * 1024 * 1024,
+        index_failure_probability=args.failure_probability,
+    )
+    base_url = start_stub_in_thread(config)
+    documents = make_documents(args.documents, args.dimensions)
+    batches = make_batches(documents, args.batch_mb * 1024 * 1024)
+    print(f"{len(documents)} documents in {len(batches)} batches of up to {args.batch_mb} MB (estimated), {args.concurrency} upload threads")
+    print(f"stub: {args.failure_probability:.0%} of documents rejected with 503, requests over {args.max_request_mb} MB rejected with 413")
+    print(f"{'uploader':>8} {'elapsed[s]':>10} {'docs/s':>8} {'requests':>8} {'failed batches':>14} {'missing docs':>12}")
+
+    client = SearchClient(endpoint=base_url, index_name=INDEX_NAME, credential=AzureKeyCredential("stub"))
+    config.indexed_keys.clear()
+    config.counters["requests"] = 0
+    elapsed, errors = run(client.upload_documents, batches, args.concurrency)
+    print(
+        f"{'sdk':>8} {elapsed:>10.2f} {len(documents) / elapsed:>8.1f} {config.counters['requests']:>8} "
+        f"{errors:>14} {len(documents) - len(config.indexed_keys):>12}"
+    )
+    client.close()
+
+    uploader = BulkUploader(
+        AsyncSearchClient(endpoint=base_url, index_name=INDEX_NAME, credential=AzureKeyCredential("stub")),
+        concurrency=args.concurrency,
+        max_request_bytes=args.max_request_mb * 1024 * 1024,
+        retry_delay=args.retry_delay,
+    )
+    config.indexed_keys.clear()
+    elapsed, errors = run(uploader.upload_from_thread, batches, args.concurrency)
+    print(
+        f"{'bulk':>8} {elapsed:>10.2f} {len(documents) / elapsed:>8.1f} {uploader.stats.requests:>8} "
+        f"{errors:>14} {len(documents) - len(config.indexed_keys):>12}"
+    )
+    print(uploader.stats.summary())
+    uploader.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=2000)
+    parser.add_argument("--dimensions", type=int, default=3072)
+    parser.add_argument("--batch-mb", type=float, default=8, help="INDEXING_UPLOAD_BATCH_MAX_BYTES of the pipeline, in MB")
+    parser.add_argument("--concurrency", type=int, default=2, help="INDEXING_UPLOAD_CONCURRENCY")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--latency-per-mb", type=float, default=0.15)
+    parser.add_argument("--max-request-mb", type=int, default=16)
+    parser.add_argument("--failure-probability", type=float, default=0.02)
+    parser.add_argument("--retry-delay", type=float, default=0.2)
+    main(parser.parse_args())
@@ -0,0 +1,64 @@
+"""
+Cleanse two monthly exports that overlap, as repeated runs over incident_all_*.csv do, and count the chat
+completions sent with the cleanse cache. Without it every record costs two completions.
+
+Usage (from apps/backend):
+    python -m benchmarks.bench_cleanse_cache --records 400 --overlap 0.7 --repeats 0.2
+"""
+import argparse
+import os
+import random
+import tempfile
+
+from openai import DefaultAsyncHttpxClient
+
+from benchmarks.bench_cleansing_concurrency import DEPLOYMENT, Row, run_pool
+from benchmarks.bench_embedding_batches import start_stub_in_thread
+from benchmarks.stub_services import StubConfig
+
+
+def make_export(rng: random.Random, first: int, records: int, repeats: float) -> list[Row]:
+    rows = []
+    for i in range(first, first + records):
+        # Some incidents repeat the text of an earlier one, e.g. the same password reset request
+        source = rng.randrange(first, i) if i > first and rng.random() < repeats else i
+        rows.append(Row(f"INC{i:05d}", f"説明 {source}", f"作業メモ {source}"))
+    return rows
+
+
+def main(args):
+    config = StubConfig(chat_latency=args.latency)
+    base_url = start_stub_in_thread(config)
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ.update(
+            AZURE_OPENAI_ENDPOINT_URL=base_url,
+            AZURE_OPENAI_API_KEY="stub",
+            AZURE_OPENAI_API_VERSION="2024-06-01",
+            AZURE_OPENAI_CHATGPT_DEPLOYMENT=DEPLOYMENT,
+            AZURE_OPENAI_CHATGPT_DEPLOYMENTS=DEPLOYMENT,
+            CLEANSE_CACHE_PATH=os.path.join(directory, "cleanse_cache.sqlite3"),
+        )
+        rng = random.Random(0)
+        first_month = make_export(rng, 1, args.records, args.repeats)
+        # The next export still contains most incidents of the previous one
+        second_month = make_export(rng, 1 + int(args.records * (1 - args.overlap)), args.records, args.repeats)
+        print(f"{args.records} records per export, {args.overlap:.0%} overlap, {args.repeats:.0%} repeated texts")
+        print(f"{'export':>8} {'elapsed[s]':>10} {'completions':>12} {'without cache':>14}")
+        for name, rows in (("month 1", first_month), ("month 2", second_month)):
+            config.counters.update(requests=0)
+            # Each run has an event loop of its own, and pooled connections cannot move between loops
+            import modules.prompt
+
+            modules.prompt.client = modules.prompt.client.with_options(http_client=DefaultAsyncHttpxClient())
+            elapsed = run_pool(rows, args.concurrency)
+            print(f"{name:>8} {elapsed:>10.2f} {config.counters['requests']:>12} {2 * len(rows):>14}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=400)
+    parser.add_argument("--overlap", type=float, default=0.7)
+    parser.add_argument("--repeats", type=float, default=0.2)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.2)
+    main(parser.parse_args())
@@ -0,0 +1,103 @@
+"""
+Compare the batch-of-100 cleansing loop (a thread pool per batch, the two completions of a record one after the
+other) with the async worker pool of cleansing.py, against a stub chat deployment where a few completions are slow.
+
+Usage (from apps/backend):
+    python -m benchmarks.bench_cleansing_concurrency --records 400 --concurrency 16
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import csv
+import io
+import os
+import sys
+import time
+
+from openai import AzureOpenAI
+
+from benchmarks.bench_embedding_batches import start_stub_in_thread
+from benchmarks.stub_services import StubConfig
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "indexing"))
+
+DEPLOYMENT = "gpt-4o"
+FIELDS = ["number", "description", "comments_and_work_notes"]
+
+
+class Row:
+    def __init__(self, number: str, description: str, comments_and_work_notes: str):
+        self.number = number
+        self.description = description
+        self.comments_and_work_notes = comments_and_work_notes
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in FIELDS}
+
+
+def run_batches(client: AzureOpenAI, rows: list[Row]) -> float:
+    # The loop cleansing.py used to run: 100 records at a time, completions of a record in sequence
+    def cleanse(row: Row) -> Row:
+        for text in (row.description, row.comments_and_work_notes):
+            client.chat.completions.create(model=DEPLOYMENT, messages=[{"role": "user", "content": text}])
+        return row
+
+    start = time.perf_counter()
+    for offset in range(0, len(rows), 100):
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            list(executor.map(cleanse, rows[offset : offset + 100]))
+    return time.perf_counter() - start
+
+
+def run_pool(rows: list[Row], concurrency: int) -> float:
+    import cleansing
+    from modules.checkpoint import CleansingCheckpoint
+
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=FIELDS)
+    checkpoint = CleansingCheckpoint(os.devnull, "bench", 0, 0)
+    # Checkpoint saves are file writes that would only add noise here
+    checkpoint.save = lambda: None
+    items = ((line, line, {field: getattr(row, field) for field in FIELDS}) for line, row in enumerate(rows, start=1))
+    cleansing.create_record_from_row = lambda row: Row(**row)
+    cleansing.PROGRESS_INTERVAL = len(rows) + 1
+    start = time.perf_counter()
+    asyncio.run(cleansing.cleanse_rows(items, FIELDS, writer, output, checkpoint, concurrency, None))
+    elapsed = time.perf_counter() - start
+    assert checkpoint.line == len(rows) + 1
+    return elapsed
+
+
+def main(args):
+    config = StubConfig(
+        chat_latency=args.latency,
+        chat_slow_probability=args.slow_probability,
+        chat_slow_factor=args.slow_factor,
+        rate_limit_requests_per_minute=args.rpm,
+    )
+    base_url = start_stub_in_thread(config)
+    os.environ.update(
+        AZURE_OPENAI_ENDPOINT_URL=base_url,
+        AZURE_OPENAI_API_KEY="stub",
+        AZURE_OPENAI_API_VERSION="2024-06-01",
+        AZURE_OPENAI_CHATGPT_DEPLOYMENT=DEPLOYMENT,
+        AZURE_OPENAI_CHATGPT_DEPLOYMENTS=f"{DEPLOYMENT}:1:{args.rpm * 0.95:g}" if args.rpm else DEPLOYMENT,
+    )
+    rows = [Row(f"INC{i:05d}", f"説明 {i}", f"作業メモ {i}") for i in range(1, args.records + 1)]
+    client = AzureOpenAI(azure_endpoint=base_url, api_key="stub", api_version="2024-06-01")
+    print(f"{args.records} records, {args.latency * 1000:.0f} ms per completion, {args.slow_probability:.0%} take {args.slow_factor:g}x")
+    print(f"batches of 100:        {run_batches(client, rows):6.2f} s")
+    print(f"pool ({args.concurrency:>2} records):     {run_pool(rows, args.concurrency):6.2f} s")
+    if args.rpm:
+        print(f"rate limit floor:      {2 * args.records / (args.rpm * 0.95 / 60):6.2f} s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--slow-probability", type=float, default=0.02)
+    parser.add_argument("--slow-factor", type=float, default=20)
+    parser.add_argument("--rpm", type=float, default=0, help="stub quota (0: none)")
+    main(parser.parse_args())
@@ -0,0 +1,75 @@
+"""
+Time from start to the first record to cleanse when resuming near the end of a large Shift-JIS CSV: the old
+`-s <start_line>` path re-parses every row before it, the checkpoint seeks to the saved byte offset.
+
+Usage (from apps/backend):
+    python -m benchmarks.bench_cleansing_resume --rows 500000
+"""
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "indexing"))
+from modules.checkpoint import iter_rows_with_offsets, read_csv_header  # noqa: E402
+
+FIELDS = ["number", "start_date", "short_description", "description", "comments_and_work_notes"]
+
+
+def write_csv(path: str, rows: int) -> None:
+    with open(path, "w", encoding="shift-jis", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(FIELDS)
+        for i in range(1, rows + 1):
+            description = f"プリンタが印刷できない {i}\n\"再起動\" 済み" if i % 5 == 0 else f"パスワードを忘れた {i}"
+            writer.writerow([f"INC{i:07d}", "2024-01-01 09:00:00", "問い合わせ", description, "対応済み" * 20])
+
+
+def rescan(path: str, start_line: int) -> float:
+    start = time.perf_counter()
+    with open(path, "r", encoding="shift-jis", errors="ignore") as file:
+        for line_number, row in enumerate(csv.DictReader(file), start=1):
+            if line_number >= start_line:
+                break
+    return time.perf_counter() - start
+
+
+def find_offset(path: str, start_line: int) -> int:
+    # What the checkpoint would have saved in the interrupted run
+    with open(path, "rb") as file:
+        fieldnames = read_csv_header(file, "shift-jis")
+        offset = file.tell()
+        for line_number, end_offset, _ in iter_rows_with_offsets(file, fieldnames, "shift-jis", 1):
+            if line_number == start_line - 1:
+                return end_offset
+    return offset
+
+
+def seek(path: str, offset: int, start_line: int) -> float:
+    start = time.perf_counter()
+    with open(path, "rb") as file:
+        fieldnames = read_csv_header(file, "shift-jis")
+        file.seek(offset)
+        line_number, _, row = next(iter_rows_with_offsets(file, fieldnames, "shift-jis", start_line))
+    elapsed = time.perf_counter() - start
+    assert row["number"] == f"INC{start_line:07d}", row["number"]
+    return elapsed
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "incidents.csv")
+        write_csv(path, args.rows)
+        start_line = args.rows - 99
+        offset = find_offset(path, start_line)
+        print(f"{args.rows} rows, {os.path.getsize(path) / 1e6:.0f} MB, resuming at line {start_line}")
+        print(f"rescan from the top: {rescan(path, start_line) * 1000:.1f} ms")
+        print(f"seek to checkpoint:  {seek(path, offset, start_line) * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=500000)
+    main(parser.parse_args())
@@ -0,0 +1,69 @@
+"""
+Read a cleansed export the way indexing.py does (the six indexing columns and the document key of every record)
+from CSV and from the Arrow files cleansing.py writes with CLEANSING_OUTPUT_FORMAT=arrow.
+
+Usage (from apps/backend):
+    python -m benchmarks.bench_columnar_ingest --rows 1000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_record_parsing import write_csv
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "indexing"))
+from modules.columnar import ColumnarDataset, ColumnarWriter  # noqa: E402
+from modules.record import INDEXING_FIELDS, compute_document_key, read_records  # noqa: E402
+
+
+def convert(csv_path: str, arrow_path: str, compression: str) -> float:
+    start = time.perf_counter()
+    writer = ColumnarWriter(arrow_path, compression=compression)
+    with open(csv_path, "r", encoding="utf-8", newline="") as file:
+        for line_number, record in read_records(file):
+            writer.write(line_number, record)
+    writer.close()
+    return time.perf_counter() - start
+
+
+def read_csv(path: str) -> float:
+    start = time.perf_counter()
+    with open(path, "r", encoding="utf-8", newline="") as file:
+        for _, record in read_records(file, INDEXING_FIELDS):
+            compute_document_key(record)
+    return time.perf_counter() - start
+
+
+def read_arrow(path: str) -> float:
+    start = time.perf_counter()
+    dataset = ColumnarDataset(path)
+    for _, record in dataset.iter_records(INDEXING_FIELDS):
+        record.document_key
+    dataset.close()
+    return time.perf_counter() - start
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, "updated_incidents.csv")
+        write_csv(csv_path, args.rows)
+        print(f"{args.rows} rows")
+        print(f"{'input':>14} {'size[MB]':>9} {'read[s]':>8} {'rows/s':>9} {'convert[s]':>11}")
+        elapsed = read_csv(csv_path)
+        print(f"{'csv':>14} {os.path.getsize(csv_path) / 1e6:>9.0f} {elapsed:>8.2f} {args.rows / elapsed:>9.0f} {'':>11}")
+        for compression in ("none", "lz4", "zstd"):
+            arrow_path = os.path.join(directory, f"updated_incidents.{compression}.arrow")
+            conversion = convert(csv_path, arrow_path, compression)
+            elapsed = read_arrow(arrow_path)
+            print(
+                f"{'arrow ' + compression:>14} {os.path.getsize(arrow_path) / 1e6:>9.0f} {elapsed:>8.2f} "
+                f"{args.rows / elapsed:>9.0f} {conversion:>11.2f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    main(parser.parse_args())
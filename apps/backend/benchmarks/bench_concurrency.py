@@ -0,0 +1,76 @@
+"""
+Measure /chat approach throughput at increasing concurrency against the local stub services.
+
+Usage (from apps/backend):
+    python -m benchmarks.bench_concurrency --requests 64 --concurrency 1 2 4 8 16 32
+"""
+import argparse
+import asyncio
+import time
+
+from azure.core.credentials import AzureKeyCredential
+from azure.search.documents.aio import SearchClient
+from openai import AsyncAzureOpenAI
+
+from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
+from benchmarks.stub_services import StubConfig, start_stub_server
+
+
+def build_approach(base_url: str, **kwargs) -> ChatReadRetrieveReadApproach:
+    openai_client = AsyncAzureOpenAI(azure_endpoint=base_url, api_key="stub", api_version="2025-01-01-preview")
+    search_client = SearchClient(endpoint=base_url, index_name="documents", credential=AzureKeyCredential("stub"))
+    return ChatReadRetrieveReadApproach(
+        openai_client=openai_client,
+        search_client=search_client,
+        openai_host="azure",
+        chatgpt_deployment="gpt-4o",
+        embedding_deployment="text-embedding-3-large",
+        chatgpt_model="gpt-4o",
+        ai_search_endpoint=base_url,
+        ai_search_index_name="documents",
+        **kwargs,
+    )
+
+
+async def run_level(approach: ChatReadRetrieveReadApproach, total: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+    messages = [{"role": "user", "content": "パスワードをリセットする方法を教えてください"}]
+
+    async def one():
+        async with semaphore:
+            await approach.run(messages, context={})
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    return time.perf_counter() - start
+
+
+async def main(args):
+    config = StubConfig(
+        embedding_latency=args.embedding_latency,
+        search_latency=args.search_latency,
+        chat_latency=args.chat_latency,
+    )
+    runner, base_url = await start_stub_server(config)
+    approach = build_approach(base_url)
+    try:
+        # Warm up connection pools before measuring
+        await run_level(approach, 2, 2)
+        print(f"{'concurrency':>11} {'elapsed[s]':>10} {'req/s':>8}")
+        for concurrency in args.concurrency:
+            elapsed = await run_level(approach, args.requests, concurrency)
+            print(f"{concurrency:>11} {elapsed:>10.2f} {args.requests / elapsed:>8.1f}")
+    finally:
+        await approach.openai_client.close()
+        await approach.search_client.close()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--search-latency", type=float, default=0.03)
+    parser.add_argument("--chat-latency", type=float, default=0.2)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,78 @@
+"""
+Compare per-text embedding requests (embed_text from a thread pool, as indexing did) with batched requests
+(embed_texts) from the indexing pipeline against the local stub services.
+
+Usage (from apps/backend):
+    python -m benchmarks.bench_embedding_batches --records 100 --max-inputs 64
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import os
+import sys
+import threading
+import time
+
+from benchmarks.stub_services import StubConfig, start_stub_server
+
+
+def start_stub_in_thread(config: StubConfig) -> str:
+    # The indexing pipeline uses the synchronous OpenAI client, so the stub gets an event loop of its own
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    result = {}
+
+    async def start():
+        result["runner"], result["url"] = await start_stub_server(config)
+        started.set()
+
+    threading.Thread(target=lambda: (loop.run_until_complete(start()), loop.run_forever()), daemon=True).start()
+    started.wait()
+    return result["url"]
+
+
+def main(args):
+    config = StubConfig(
+        embedding_latency=args.latency,
+        embedding_latency_per_input=args.latency_per_input,
+        embedding_max_inputs=args.max_inputs,
+    )
+    os.environ["AZURE_OPENAI_ENDPOINT_URL"] = start_stub_in_thread(config)
+    os.environ["AZURE_OPENAI_API_KEY"] = "stub"
+    os.environ["AZURE_OPENAI_EMBEDDING_DEPLOYMENT"] = "text-embedding-3-large"
+    os.environ["AZURE_OPENAI_EMBEDDING_DEPLOYMENT2"] = "text-embedding-3-large-2"
+    # Memory-only embedding cache, so every run below really calls the stub
+    os.environ["EMBEDDING_CACHE_PATH"] = ""
+    os.environ["EMBEDDING_BATCH_MAX_INPUTS"] = str(args.batch_inputs)
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "indexing"))
+    from modules import embed
+
+    def texts(run: str) -> list[str]:
+        # A question and an answer per record, unique per run so that nothing is served from the cache
+        return [f"{run} 質問 {i} パスワードをリセットしたい" for i in range(args.records)] + [
+            f"{run} 回答 {i} 管理画面からパスワードをリセットしてください。" * 5 for i in range(args.records)
+        ]
+
+    embed.embed_texts(texts("warmup"))
+    print(f"{'mode':>10} {'texts':>6} {'elapsed[s]':>10} {'texts/s':>8}")
+    for mode in ("per-text", "batched"):
+        inputs = texts(mode)
+        start = time.perf_counter()
+        if mode == "per-text":
+            with concurrent.futures.ThreadPoolExecutor() as executor:
+                embeddings = list(executor.map(embed.embed_text, inputs))
+        else:
+            embeddings = embed.embed_texts(inputs)
+        elapsed = time.perf_counter() - start
+        assert all(embeddings)
+        print(f"{mode:>10} {len(inputs):>6} {elapsed:>10.2f} {len(inputs) / elapsed:>8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.2, help="service time of one embeddings request [s]")
+    parser.add_argument("--latency-per-input", type=float, default=0.002)
+    parser.add_argument("--max-inputs", type=int, default=0, help="stub rejects larger requests with 400 (0: no limit)")
+    parser.add_argument("--batch-inputs", type=int, default=2048, help="EMBEDDING_BATCH_MAX_INPUTS")
+    main(parser.parse_args())
@@ -0,0 +1,63 @@
+"""
+Compare building the prompt from long chat histories with the previous insert-at-index loop and with
+MessageBuilder.append_history, and check that both produce the same messages.
+
+Usage (from apps/backend):
+    python -m benchmarks.bench_history_truncation --messages 1000 5000 20000
+"""
+import argparse
+import logging
+import time
+
+from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
+from core.messagebuilder import MessageBuilder
+from core.modelhelper import token_count_cache
+
+
+def previous_get_messages_from_history(system_prompt, model_id, history, user_content, max_tokens):
+    message_builder = MessageBuilder(system_prompt, model_id)
+    append_index = 1
+    message_builder.append_message("user", user_content, index=append_index)
+    total_token_count = message_builder.count_tokens_for_message(message_builder.messages[-1])
+    for message in list(reversed(history[:-1])):
+        potential_message_count = message_builder.count_tokens_for_message(message)
+        if (total_token_count + potential_message_count) > max_tokens:
+            logging.debug("Reached max tokens of %d, history will be truncated", max_tokens)
+            break
+        message_builder.append_message(message["role"], message["content"], index=append_index)
+        total_token_count += potential_message_count
+    return message_builder.messages
+
+
+def make_history(length: int) -> list[dict[str, str]]:
+    # Decomposed kana (か + combining mark) so that NFC normalization has work to do
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"メッセージ {i} がいとう"}
+        for i in range(length)
+    ]
+
+
+def main(args):
+    approach = ChatReadRetrieveReadApproach(None, "azure", None, None, "gpt-4o", "", "")
+    print(f"{'messages':>9} {'previous[ms]':>13} {'builder[ms]':>12} {'identical':>10}")
+    for length in args.messages:
+        history = make_history(length)
+        kwargs = dict(system_prompt="system", model_id="gpt-4o", history=history, user_content="質問", max_tokens=10**9)
+        # Warm the token count cache so both sides measure message building rather than tokenization
+        previous_get_messages_from_history(**kwargs)
+
+        start = time.perf_counter()
+        expected = previous_get_messages_from_history(**kwargs)
+        previous = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = approach.get_messages_from_history(**kwargs)
+        current = time.perf_counter() - start
+        print(f"{length:>9} {previous * 1000:>13.1f} {current * 1000:>12.1f} {str(expected == actual):>10}")
+        token_count_cache.clear()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, nargs="+", default=[1000, 5000, 20000])
+    main(parser.parse_args())
@@ -0,0 +1,77 @@
+"""
+Compare the 100-record barrier loop indexing used to run with the pipelined indexer, using stage functions that sleep
+like the services they call (bulk key lookup, batched embedding with a slow tail, upload).
+
+Usage (from apps/backend):
+    python -m benchmarks.bench_indexing_pipeline --records 2000 --embed-concurrency 4
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "indexing"))
+from modules.pipeline import IndexingPipeline  # noqa: E402
+
+
+def make_stages(args, rng: random.Random):
+    def find_existing_keys(keys: list[str]) -> set[str]:
+        time.sleep(args.dedup_latency)
+        return set()
+
+    def create_documents(records: list[str]) -> list[dict]:
+        # Most embedding batches are quick, a few hit a slow replica or a retry
+        time.sleep(args.embed_latency * (args.tail_factor if rng.random() < args.tail_probability else 1))
+        return [{"id": record, "question": record, "answer": record, "question_vector": [0.0] * 3072, "answer_vector": [0.0] * 3072} for record in records]
+
+    def upload(documents: list[dict]) -> None:
+        time.sleep(args.upload_latency)
+
+    return find_existing_keys, create_documents, upload
+
+
+def run_barrier(args, rows) -> float:
+    find_existing_keys, create_documents, upload = make_stages(args, random.Random(0))
+    start = time.perf_counter()
+    for offset in range(0, len(rows), 100):
+        records = [record for _, record in rows[offset : offset + 100]]
+        existing = find_existing_keys(records)
+        upload(create_documents([record for record in records if record not in existing]))
+    return time.perf_counter() - start
+
+
+def run_pipeline(args, rows) -> float:
+    find_existing_keys, create_documents, upload = make_stages(args, random.Random(0))
+    pipeline = IndexingPipeline(
+        find_existing_keys=find_existing_keys,
+        create_documents=create_documents,
+        upload=upload,
+        document_key=lambda record: record,
+        embed_concurrency=args.embed_concurrency,
+        report_interval=args.report_interval,
+    )
+    start = time.perf_counter()
+    pipeline.run(iter(rows))
+    return time.perf_counter() - start
+
+
+def main(args):
+    rows = [(line, f"record-{line}") for line in range(1, args.records + 1)]
+    print(f"{'mode':>9} {'elapsed[s]':>10} {'records/s':>9}")
+    for mode, run in (("barrier", run_barrier), ("pipeline", run_pipeline)):
+        elapsed = run(args, rows)
+        print(f"{mode:>9} {elapsed:>10.2f} {args.records / elapsed:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--dedup-latency", type=float, default=0.05)
+    parser.add_argument("--embed-latency", type=float, default=0.6, help="one batched request for 100 records [s]")
+    parser.add_argument("--tail-probability", type=float, default=0.1)
+    parser.add_argument("--tail-factor", type=float, default=5.0)
+    parser.add_argument("--upload-latency", type=float, default=0.3)
+    parser.add_argument("--embed-concurrency", type=int, default=4)
+    parser.add_argument("--report-interval", type=float, default=2.0)
+    main(parser.parse_args())
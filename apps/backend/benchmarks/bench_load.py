@@ -0,0 +1,296 @@
+"""
+Load-test the backend as it is deployed: gunicorn with gunicorn.conf.py serving main:app, against the local stub
+services (Azure OpenAI embeddings and chat, Azure AI Search) running in a process of their own. /chat is driven by a
+fixed number of concurrent clients per level, each sending its next question as soon as the previous answer is
+complete, and for each worker count and concurrency level this reports:
+  req/s           completed requests per second, and per worker
+  p50/p95/p99     latency until the response was complete
+  ttft p50/p95    time to the first answer content (streamed requests; the whole response otherwise)
+  errors          non-200 responses and failed requests
+  pss[MB]         proportional set size of the gunicorn master and workers after the level: memory shared
+                  copy-on-write between them (e.g. state preloaded before forking) is counted once
+Each configuration is started with and/or without preloading the app in the gunicorn master (--preload on off).
+
+Every question is distinct and the answer cache is off, so each request runs the full pipeline. gunicorn's
+max_requests restarts are disabled for the run. Everything is local, so it runs offline.
+
+To catch regressions, save a run with --output and compare later runs against it with --baseline: the exit status is
+1 when the throughput of a level dropped, or its p95 grew, by more than --tolerance.
+
+Usage (from apps/backend):
+    python -m benchmarks.bench_load
+    python -m benchmarks.bench_load --workers 1 2 4 --concurrency 8 32 128 --requests 400
+    python -m benchmarks.bench_load --workers 3 --preload off on
+    python -m benchmarks.bench_load --output load_baseline.json
+    python -m benchmarks.bench_load --baseline load_baseline.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+from benchmarks.app_server import stub_environment
+from benchmarks.stub_services import StubConfig, create_stub_app
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run_stub(config: StubConfig, port: int) -> None:
+    web.run_app(create_stub_app(config), host="127.0.0.1", port=port, print=None, access_log=None)
+
+
+def start_stub_process(config: StubConfig) -> tuple[multiprocessing.Process, str]:
+    # A process of its own, so the stubs and the load generator do not compete with each other for one event loop
+    port = free_port()
+    process = multiprocessing.get_context("spawn").Process(target=run_stub, args=(config, port), daemon=True)
+    process.start()
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            if not process.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError("Stub services did not start")
+            time.sleep(0.05)
+
+
+def app_environment(stub_url: str, preload: bool) -> dict[str, str]:
+    return {
+        **os.environ,
+        **stub_environment(stub_url),
+        "GUNICORN_PRELOAD": str(preload).lower(),
+        "RETRIEVAL_BACKEND": "azure",
+        "ANSWER_CACHE_MAX_ENTRIES": "0",
+        "EMBEDDING_CACHE_PATH": "",
+        "KEYWORD_IDF_PATH": "",
+        "OTEL_TRACES_EXPORTER": "none",
+    }
+
+
+async def start_gunicorn(stub_url: str, workers: int, preload: bool, extra_args: list[str]) -> tuple[subprocess.Popen, str]:
+    """Starts gunicorn with gunicorn.conf.py and `workers` workers, and waits until a worker answers."""
+    port = free_port()
+    command = [
+        sys.executable, "-m", "gunicorn", "main:app",
+        "--config", "gunicorn.conf.py",
+        "--workers", str(workers),
+        "--bind", f"127.0.0.1:{port}",
+        "--max-requests", "0",
+        "--log-level", "warning",
+        *extra_args,
+    ]
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=app_environment(stub_url, preload))
+    app_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 120
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(f"{app_url}/metrics") as response:
+                    if response.status == 200:
+                        return process, app_url
+            except aiohttp.ClientError:
+                pass
+            if process.poll() is not None or time.monotonic() > deadline:
+                stop_gunicorn(process)
+                raise RuntimeError(f"gunicorn with {workers} workers did not start")
+            await asyncio.sleep(0.1)
+
+
+def process_tree_pss(pid: int) -> float:
+    """Returns the proportional set size in MB of a process and its children (Linux only, NaN elsewhere)."""
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            pids = [pid] + [int(child) for child in f.read().split()]
+        total = 0
+        for process_id in pids:
+            with open(f"/proc/{process_id}/smaps_rollup") as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith("Pss:"))
+        return total / 1024
+    except (OSError, StopIteration):
+        return float("nan")
+
+
+def stop_gunicorn(process: subprocess.Popen) -> None:
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+async def timed_chat(session: aiohttp.ClientSession, app_url: str, question: str, stream: bool) -> tuple[float, float]:
+    """Returns (seconds until the first answer content arrived, seconds until the response was complete)."""
+    body = {"messages": [{"role": "user", "content": question}], "stream": stream}
+    start = time.perf_counter()
+    first_content = None
+    async with session.post(f"{app_url}/chat", json=body, headers={"Authorization": "Bearer stub"}) as response:
+        response.raise_for_status()
+        if stream:
+            async for line in response.content:
+                # Errors raised while streaming arrive as a last NDJSON line
+                if line.startswith(b'{"error"'):
+                    raise RuntimeError(json.loads(line)["error"])
+                if first_content is None and b'"content"' in line:
+                    first_content = time.perf_counter() - start
+        else:
+            await response.read()
+    elapsed = time.perf_counter() - start
+    return first_content if first_content is not None else elapsed, elapsed
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
+
+
+async def run_level(app_url: str, concurrency: int, requests: int, stream: bool, offset: int) -> dict:
+    """Sends `requests` questions from `concurrency` clients and returns the statistics of the level."""
+    latencies, first_contents = [], []
+    errors = 0
+    next_request = 0
+
+    async def client(session: aiohttp.ClientSession):
+        nonlocal next_request, errors
+        while next_request < requests:
+            n = offset + next_request
+            next_request += 1
+            try:
+                first_content, elapsed = await timed_chat(session, app_url, f"VPN に接続できない場合の対処方法を教えてください ({n})", stream)
+            except (aiohttp.ClientError, RuntimeError, asyncio.TimeoutError):
+                errors += 1
+                continue
+            latencies.append(elapsed)
+            first_contents.append(first_content)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=300)) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return {
+        "requests_per_second": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "ttft_p50_ms": percentile(first_contents, 0.50) * 1000,
+        "ttft_p95_ms": percentile(first_contents, 0.95) * 1000,
+        "errors": errors,
+    }
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float) -> list[str]:
+    """Returns a description of every level that got slower than the baseline by more than the tolerance."""
+    previous = {(row.get("preload", "on"), row["workers"], row["concurrency"]): row for row in baseline}
+    regressions = []
+    for row in results:
+        before = previous.get((row["preload"], row["workers"], row["concurrency"]))
+        if before is None:
+            continue
+        label = f"preload={row['preload']} workers={row['workers']} concurrency={row['concurrency']}"
+        if row["requests_per_second"] < before["requests_per_second"] * (1 - tolerance):
+            regressions.append(f"{label}: {row['requests_per_second']:.1f} req/s, baseline {before['requests_per_second']:.1f}")
+        if row["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{label}: p95 {row['p95_ms']:.0f} ms, baseline {before['p95_ms']:.0f}")
+        if row["errors"] > before["errors"]:
+            regressions.append(f"{label}: {row['errors']} errors, baseline {before['errors']}")
+    return regressions
+
+
+async def main(args) -> int:
+    config = StubConfig(
+        embedding_latency=args.embedding_latency,
+        search_latency=args.search_latency,
+        chat_latency=args.chat_latency,
+        chat_chunks=args.chunks,
+    )
+    stub_process, stub_url = start_stub_process(config)
+    mode = "streaming" if args.stream else "buffered"
+    print(
+        f"stub latency: embeddings {args.embedding_latency * 1000:.0f} ms, search {args.search_latency * 1000:.0f} ms, "
+        f"chat {args.chat_latency * 1000:.0f} ms in {args.chunks} chunks; {mode} responses, {args.requests} requests per level"
+    )
+    print(
+        f"{'preload':>7} {'workers':>7} {'conc':>5} {'req/s':>8} {'req/s/wkr':>9} {'p50[ms]':>8} {'p95[ms]':>8} "
+        f"{'p99[ms]':>8} {'ttft p50':>8} {'ttft p95':>8} {'errors':>6} {'pss[MB]':>8}"
+    )
+    results = []
+    offset = 0
+    try:
+        for preload in args.preload:
+            for workers in args.workers:
+                start = time.perf_counter()
+                app_process, app_url = await start_gunicorn(stub_url, workers, preload == "on", args.gunicorn_args)
+                startup = time.perf_counter() - start
+                print(f"preload {preload}, {workers} workers: ready in {startup:.1f} s")
+                try:
+                    # Warm up the connection pools and the lazily loaded encodings of every worker
+                    await run_level(app_url, workers * 4, workers * 8, args.stream, offset)
+                    offset += workers * 8
+                    for concurrency in args.concurrency:
+                        row = {"preload": preload, "workers": workers, "concurrency": concurrency}
+                        row.update(await run_level(app_url, concurrency, args.requests, args.stream, offset))
+                        row["pss_mb"] = process_tree_pss(app_process.pid)
+                        row["startup_seconds"] = startup
+                        offset += args.requests
+                        results.append(row)
+                        print(
+                            f"{preload:>7} {workers:>7} {concurrency:>5} {row['requests_per_second']:>8.1f} "
+                            f"{row['requests_per_second'] / workers:>9.1f} {row['p50_ms']:>8.0f} {row['p95_ms']:>8.0f} "
+                            f"{row['p99_ms']:>8.0f} {row['ttft_p50_ms']:>8.0f} {row['ttft_p95_ms']:>8.0f} "
+                            f"{row['errors']:>6} {row['pss_mb']:>8.0f}"
+                        )
+                finally:
+                    stop_gunicorn(app_process)
+    finally:
+        stub_process.terminate()
+        stub_process.join()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"arguments": vars(args), "results": results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"No level regressed by more than {args.tolerance:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2], help="gunicorn worker counts to compare")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--preload", nargs="+", choices=["on", "off"], default=["on"], help="load the app before forking the workers")
+    parser.add_argument("--requests", type=int, default=200, help="requests per concurrency level")
+    parser.add_argument("--no-stream", dest="stream", action="store_false", help="request buffered answers")
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--search-latency", type=float, default=0.03)
+    parser.add_argument("--chat-latency", type=float, default=0.5)
+    parser.add_argument("--chunks", type=int, default=20)
+    parser.add_argument("--gunicorn-args", nargs=argparse.REMAINDER, default=[], help="passed on to gunicorn, e.g. --worker-class ...")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed throughput drop and p95 growth")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,104 @@
+"""
+Measure LocalVectorRetriever latency and recall@k of IVF search against exact search on synthetic clustered vectors,
+and the cost of adding BM25 over synthetic question/answer text (hybrid fusion).
+
+Usage (from apps/backend):
+    python -m benchmarks.bench_local_retriever --documents 20000 --dimensions 3072 --nlist 512 --nprobe 4 8 16 32
+"""
+import argparse
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from core.retrievers import LocalVectorRetriever
+from core.vectorstore import LocalVectorStore
+
+
+def random_unit(rng, centers: np.ndarray, count: int, noise: float) -> np.ndarray:
+    # Documents are scattered around topic centers, like embeddings of a Q&A corpus
+    vectors = centers[rng.integers(0, len(centers), count)] + rng.standard_normal((count, centers.shape[1]), dtype=np.float32) * noise
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def random_text(rng, vocabulary: int, length: int) -> str:
+    return " ".join(f"w{term}" for term in rng.zipf(1.3, length) % vocabulary)
+
+
+def measure(retriever: LocalVectorRetriever, queries: np.ndarray, top: int, texts=None) -> tuple[list[float], list[list[str]]]:
+    timings, results = [], []
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        hits = retriever.search_sync(query, texts[i] if texts else "", top)
+        timings.append(time.perf_counter() - start)
+        results.append([hit["id"] for hit in hits])
+    return sorted(timings), results
+
+
+def main(args):
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((args.topics, args.dimensions), dtype=np.float32)
+    with tempfile.TemporaryDirectory() as directory:
+        store = LocalVectorStore(directory)
+        start = time.perf_counter()
+        for offset in range(0, args.documents, 1000):
+            count = min(1000, args.documents - offset)
+            questions = random_unit(rng, centers, count, args.noise)
+            answers = random_unit(rng, centers, count, args.noise)
+            store.append(
+                [
+                    {
+                        "id": f"doc-{offset + i}",
+                        "question": random_text(rng, args.vocabulary, 30),
+                        "answer": random_text(rng, args.vocabulary, 120),
+                        "question_vector": q,
+                        "answer_vector": a,
+                    }
+                    for i, (q, a) in enumerate(zip(questions.tolist(), answers.tolist()))
+                ]
+            )
+        print(f"stored {len(store)} documents in {time.perf_counter() - start:.1f}s")
+        start = time.perf_counter()
+        store.build_ivf(args.nlist)
+        print(f"built IVF ({args.nlist} lists) in {time.perf_counter() - start:.1f}s")
+        start = time.perf_counter()
+        store.build_bm25()
+        print(f"built BM25 ({len(store.bm25.terms)} terms) in {time.perf_counter() - start:.1f}s")
+
+        queries = random_unit(rng, centers, args.queries, args.noise)
+        exact_timings, exact_results = measure(LocalVectorRetriever(store), queries, args.top)
+        print(f"{'search':>12} {'p50[ms]':>8} {'p99[ms]':>8} {'recall@' + str(args.top):>10}")
+        rows = [("exact", exact_timings, 1.0)]
+        for nprobe in args.nprobe:
+            timings, results = measure(LocalVectorRetriever(store, nprobe=nprobe), queries, args.top)
+            recall = statistics.mean(len(set(a) & set(e)) / len(e) for a, e in zip(results, exact_results))
+            rows.append((f"ivf/{nprobe}", timings, recall))
+        # Five keywords per query, as extracted by KeywordExtractor
+        texts = [random_text(rng, args.vocabulary, 5) for _ in range(args.queries)]
+        bm25_timings = []
+        for text in texts:
+            start = time.perf_counter()
+            store.bm25.search(text, "answer", 50)
+            bm25_timings.append(time.perf_counter() - start)
+        rows.append(("bm25/answer", sorted(bm25_timings), float("nan")))
+        for nprobe in (None, args.nprobe[0]):
+            timings, _ = measure(LocalVectorRetriever(store, nprobe=nprobe), queries, args.top, texts)
+            rows.append((f"hybrid/{nprobe or 'exact'}", timings, float("nan")))
+        for label, timings, recall in rows:
+            p99 = timings[max(0, int(len(timings) * 0.99) - 1)]
+            print(f"{label:>12} {statistics.median(timings) * 1e3:>8.2f} {p99 * 1e3:>8.2f} {recall:>10.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=20000)
+    parser.add_argument("--dimensions", type=int, default=3072)
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.05)
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--nlist", type=int, default=512)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top", type=int, default=10)
+    main(parser.parse_args())
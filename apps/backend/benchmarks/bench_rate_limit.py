@@ -0,0 +1,68 @@
+"""
+Drive embeddings requests from many threads against two stub deployments that return 429 beyond a per-deployment
+quota, and compare the old retry loop (flip deployments, no backoff) with the RateLimitScheduler.
+
+Usage (from apps/backend):
+    python -m benchmarks.bench_rate_limit --requests 300 --threads 16 --rpm 600
+"""
+import argparse
+import concurrent.futures
+import time
+
+from openai import AzureOpenAI, RateLimitError
+
+from benchmarks.bench_embedding_batches import start_stub_in_thread
+from benchmarks.stub_services import StubConfig
+from core.ratelimit import RateLimitScheduler, parse_deployments
+
+DEPLOYMENTS = ("text-embedding-3-large", "text-embedding-3-large-2")
+
+
+def flip_loop(client: AzureOpenAI, text: str):
+    # The retry loop indexing used before: switch deployment on every 429, immediately and forever
+    index = 0
+    while True:
+        try:
+            return client.embeddings.create(input=text, model=DEPLOYMENTS[index])
+        except RateLimitError:
+            index = (index + 1) % len(DEPLOYMENTS)
+
+
+def main(args):
+    config = StubConfig(embedding_latency=args.latency, rate_limit_requests_per_minute=args.rpm)
+    base_url = start_stub_in_thread(config)
+    modes = {
+        "flip": lambda client: lambda text: flip_loop(client, text),
+        "scheduler": lambda client: (
+            lambda scheduler: lambda text: scheduler.call(lambda model: client.embeddings.create(input=text, model=model))
+        )(RateLimitScheduler(parse_deployments(None, DEPLOYMENTS), base_delay=0.1)),
+        "scheduler+limits": lambda client: (
+            lambda scheduler: lambda text: scheduler.call(lambda model: client.embeddings.create(input=text, model=model))
+        )(RateLimitScheduler(parse_deployments(",".join(f"{name}:1:{args.rpm * args.headroom:g}" for name in DEPLOYMENTS)))),
+    }
+    print(f"{'mode':>16} {'elapsed[s]':>10} {'req/s':>7} {'sent':>6} {'429s':>6}")
+    for mode, build in modes.items():
+        # The old code kept the SDK's default retries (which sleep on Retry-After); the scheduler retries itself
+        client = AzureOpenAI(azure_endpoint=base_url, api_key="stub", api_version="2023-05-15", max_retries=2 if mode == "flip" else 0)
+        embed = build(client)
+        # Let the stub's buckets refill between modes
+        time.sleep(2)
+        config.counters.update(requests=0, throttled=0)
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(args.threads) as executor:
+            list(executor.map(embed, [f"{mode} {i}" for i in range(args.requests)]))
+        elapsed = time.perf_counter() - start
+        print(
+            f"{mode:>16} {elapsed:>10.2f} {args.requests / elapsed:>7.1f} "
+            f"{config.counters['requests']:>6} {config.counters['throttled']:>6}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--rpm", type=float, default=600, help="stub quota per deployment")
+    parser.add_argument("--headroom", type=float, default=0.95, help="client-side limit as a fraction of the quota")
+    parser.add_argument("--latency", type=float, default=0.05)
+    main(parser.parse_args())
@@ -0,0 +1,108 @@
+"""
+Parse a synthetic incident export into records three ways and compare time and memory:
+  legacy     csv.DictReader and the previous Record (a __dict__ per record, strptime on the five dates)
+  full       csv.DictReader and create_record_from_row (__slots__, dates parsed on access)
+  projected  read_records with only the columns indexing reads
+
+Usage (from apps/backend):
+    python -m benchmarks.bench_record_parsing --rows 1000000
+"""
+import argparse
+import csv
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "indexing"))
+from modules.record import DATE_FIELDS, INDEXING_FIELDS, RECORD_FIELDS, create_record_from_row, parse_date, read_records  # noqa: E402
+
+
+class LegacyRecord:
+    # The record before __slots__: every attribute in a __dict__, dates parsed with strptime when the row is read
+    def __init__(self, *values):
+        for field, value in zip(RECORD_FIELDS, values):
+            if field in DATE_FIELDS:
+                value = datetime.strptime(value, "%Y-%m-%d %H:%M:%S") if value else None
+            setattr(self, field, value)
+
+
+def write_csv(path: str, rows: int) -> None:
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(RECORD_FIELDS)
+        for i in range(rows):
+            values = {field: f"{field}-{i % 97}" for field in RECORD_FIELDS}
+            for field in DATE_FIELDS:
+                values[field] = f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d} {i % 24:02d}:{i % 60:02d}:{i % 59:02d}"
+            values["number"] = f"INC{i:07d}"
+            values["description"] = f"プリンタから印刷できない。ドライバを再インストールした。 {i}"
+            values["comments_and_work_notes"] = f"ドライバを更新し、再起動後に印刷できることを確認した。 {i}"
+            writer.writerow([values[field] for field in RECORD_FIELDS])
+
+
+def parse_legacy(file):
+    reader = csv.DictReader(file)
+    for line_number, row in enumerate(reader, start=1):
+        yield line_number, LegacyRecord(*(row[key] for key in reader.fieldnames))
+
+
+def parse_full(file):
+    for line_number, row in enumerate(csv.DictReader(file), start=1):
+        yield line_number, create_record_from_row(row)
+
+
+def parse_projected(file):
+    return read_records(file, INDEXING_FIELDS)
+
+
+def measure(path: str, parse, keep: int) -> tuple[float, float]:
+    """Returns (seconds to parse every row, bytes per record when `keep` records are held)."""
+    with open(path, "r", encoding="utf-8", newline="") as file:
+        start = time.perf_counter()
+        for _ in parse(file):
+            pass
+        elapsed = time.perf_counter() - start
+    gc.collect()
+    with open(path, "r", encoding="utf-8", newline="") as file:
+        tracemalloc.start()
+        records = []
+        for line_number, record in parse(file):
+            records.append(record)
+            if line_number == keep:
+                break
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return elapsed, current / len(records)
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "incidents.csv")
+        write_csv(path, args.rows)
+        print(f"{args.rows} rows, {os.path.getsize(path) / 1e6:.0f} MB")
+        print(f"{'reader':>10} {'parse[s]':>9} {'rows/s':>9} {'bytes/record':>13}")
+        for name, parse in (("legacy", parse_legacy), ("full", parse_full), ("projected", parse_projected)):
+            elapsed, bytes_per_record = measure(path, parse, args.keep)
+            print(f"{name:>10} {elapsed:>9.2f} {args.rows / elapsed:>9.0f} {bytes_per_record:>13.0f}")
+
+    dates = [f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d} 12:34:56" for i in range(200000)]
+    start = time.perf_counter()
+    for date in dates:
+        datetime.strptime(date, "%Y-%m-%d %H:%M:%S")
+    strptime_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for date in dates:
+        parse_date(date)
+    parse_date_seconds = time.perf_counter() - start
+    print(f"date parsing: strptime {strptime_seconds / len(dates) * 1e9:.0f} ns, parse_date {parse_date_seconds / len(dates) * 1e9:.0f} ns")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--keep", type=int, default=100000, help="records held to measure memory")
+    main(parser.parse_args())
@@ -0,0 +1,103 @@
+"""
+Compare per-query latency of a SearchClient built for every query (new session and TLS handshake each time) with a
+client from the pooled SearchClientRegistry, against a local HTTPS stub of Azure AI Search.
+
+Usage (from apps/backend):
+    python -m benchmarks.bench_search_pool --queries 200
+"""
+import argparse
+import asyncio
+import datetime
+import ipaddress
+import os
+import ssl
+import statistics
+import tempfile
+import time
+
+from azure.core.credentials import AzureKeyCredential
+from azure.search.documents.aio import SearchClient
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from benchmarks.stub_services import StubConfig, start_stub_server
+from core.searchclients import SearchClientRegistry
+
+
+def create_self_signed_cert(directory: str) -> tuple[str, str]:
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+    return cert_path, key_path
+
+
+async def search_once(client: SearchClient):
+    results = await client.search(search_text="VPN", top=10)
+    return [item async for item in results]
+
+
+async def per_query_clients(base_url: str, cert_path: str, queries: int) -> list[float]:
+    latencies = []
+    for _ in range(queries):
+        start = time.perf_counter()
+        async with SearchClient(
+            endpoint=base_url, index_name="documents", credential=AzureKeyCredential("stub"), connection_verify=cert_path
+        ) as client:
+            await search_once(client)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def pooled_client(base_url: str, cert_path: str, queries: int) -> list[float]:
+    registry = SearchClientRegistry(base_url, AzureKeyCredential("stub"), connection_verify=cert_path)
+    client = registry.get("documents")
+    latencies = []
+    try:
+        for _ in range(queries):
+            start = time.perf_counter()
+            await search_once(client)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        await registry.close()
+    return latencies
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        cert_path, key_path = create_self_signed_cert(directory)
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(cert_path, key_path)
+        runner, base_url = await start_stub_server(StubConfig(search_latency=0.0), ssl_context=ssl_context)
+        try:
+            print(f"{'client':>16} {'mean[ms]':>9} {'p50[ms]':>8}")
+            for label, bench in (("per-query", per_query_clients), ("pooled registry", pooled_client)):
+                latencies = await bench(base_url, cert_path, args.queries)
+                print(f"{label:>16} {statistics.mean(latencies) * 1000:>9.2f} {statistics.median(latencies) * 1000:>8.2f}")
+        finally:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,50 @@
+"""
+Compare per-request latency of the chat pipeline with and without overlapping its independent stages
+(keyword extraction and query embedding) against the local stub services.
+
+Usage (from apps/backend):
+    python -m benchmarks.bench_stages --requests 50
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from benchmarks.bench_concurrency import build_approach
+from benchmarks.stub_services import StubConfig, start_stub_server
+
+
+async def measure(approach, requests: int) -> list[float]:
+    latencies = []
+    for i in range(requests):
+        # A distinct question per request so nothing downstream can serve it from a cache
+        messages = [{"role": "user", "content": f"VPN に接続できない場合の対処方法を教えてください ({i})"}]
+        start = time.perf_counter()
+        await approach.run(messages, context={})
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def main(args):
+    config = StubConfig(embedding_latency=args.embedding_latency, search_latency=0.01, chat_latency=0.01)
+    runner, base_url = await start_stub_server(config)
+    try:
+        print(f"{'mode':>10} {'p50[ms]':>8} {'p95[ms]':>8}")
+        for label, overlap in (("sequential", False), ("staged", True)):
+            approach = build_approach(base_url, overlap_stages=overlap)
+            await measure(approach, 2)
+            latencies = sorted(await measure(approach, args.requests))
+            p50 = statistics.median(latencies) * 1000
+            p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+            print(f"{label:>10} {p50:>8.1f} {p95:>8.1f}")
+            await approach.openai_client.close()
+            await approach.search_client.close()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,63 @@
+"""
+Measure time-to-first-byte and total latency of /chat with and without streaming against a fake streaming chat
+backend. With streaming, the first answer chunk should arrive after roughly one chunk of generation time instead of
+after the whole answer.
+
+Usage (from apps/backend):
+    python -m benchmarks.bench_streaming_ttfb --requests 10 --chat-latency 1.0
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import aiohttp
+
+from benchmarks.app_server import start_app_server
+from benchmarks.stub_services import StubConfig, start_stub_server
+
+
+async def timed_chat(session: aiohttp.ClientSession, app_url: str, stream: bool) -> tuple[float, float]:
+    """Returns (seconds until the first answer content arrived, seconds until the response was complete)."""
+    body = {"messages": [{"role": "user", "content": "プリンターが印刷できません"}], "stream": stream}
+    start = time.perf_counter()
+    first_content = None
+    async with session.post(f"{app_url}/chat", json=body, headers={"Authorization": "Bearer stub"}) as response:
+        response.raise_for_status()
+        if stream:
+            async for line in response.content:
+                event = json.loads(line)
+                if first_content is None and event["choices"][0]["delta"].get("content"):
+                    first_content = time.perf_counter() - start
+        else:
+            await response.read()
+            first_content = time.perf_counter() - start
+    return first_content, time.perf_counter() - start
+
+
+async def main(args):
+    config = StubConfig(chat_latency=args.chat_latency, chat_chunks=args.chunks)
+    runner, base_url = await start_stub_server(config)
+    server, task, app_url = await start_app_server(base_url)
+    try:
+        async with aiohttp.ClientSession() as session:
+            await timed_chat(session, app_url, stream=True)
+            print(f"{'mode':>10} {'first content[ms]':>18} {'total[ms]':>10}")
+            for label, stream in (("buffered", False), ("streaming", True)):
+                samples = [await timed_chat(session, app_url, stream) for _ in range(args.requests)]
+                ttfb = statistics.median(s[0] for s in samples) * 1000
+                total = statistics.median(s[1] for s in samples) * 1000
+                print(f"{label:>10} {ttfb:>18.1f} {total:>10.1f}")
+    finally:
+        server.should_exit = True
+        await task
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--chat-latency", type=float, default=1.0)
+    parser.add_argument("--chunks", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,64 @@
+"""
+Compare token counting of a growing 50-turn conversation, as done by get_messages_from_history on every turn,
+between the previous per-call `tiktoken.get_encoding` implementation and the cached batch API.
+
+Usage (from apps/backend):
+    python -m benchmarks.bench_token_counting --turns 50 --conversations 5
+"""
+import argparse
+import random
+import time
+
+import tiktoken
+
+from core.modelhelper import num_tokens_from_messages_batch, token_count_cache
+
+
+def previous_num_tokens_from_messages(message: dict[str, str], model: str) -> int:
+    encoding = tiktoken.get_encoding("cl100k_base")
+    num_tokens = 2
+    for key, value in message.items():
+        num_tokens += len(encoding.encode(value))
+    return num_tokens
+
+
+def make_conversation(turns: int, seed: int) -> list[dict[str, str]]:
+    rng = random.Random(seed)
+    words = ["VPN", "接続", "パスワード", "リセット", "プリンター", "申請", "アカウント", "ロック", "エラー", "確認"]
+    history = []
+    for turn in range(turns):
+        question = " ".join(rng.choice(words) for _ in range(20)) + f" ({seed}-{turn})"
+        answer = "。".join(" ".join(rng.choice(words) for _ in range(30)) for _ in range(8))
+        history.append({"role": "user", "content": question})
+        history.append({"role": "assistant", "content": answer})
+    return history
+
+
+def run(conversations: list[list[dict[str, str]]], turns: int, count) -> float:
+    start = time.perf_counter()
+    for history in conversations:
+        for turn in range(1, turns + 1):
+            count(history[: turn * 2])
+    return time.perf_counter() - start
+
+
+def main(args):
+    conversations = [make_conversation(args.turns, seed) for seed in range(args.conversations)]
+    tiktoken.get_encoding("cl100k_base")
+
+    previous = run(conversations, args.turns, lambda h: [previous_num_tokens_from_messages(m, "gpt-4o") for m in h])
+    token_count_cache.clear()
+    cached = run(conversations, args.turns, lambda h: num_tokens_from_messages_batch(h, "gpt-4o"))
+
+    print(f"{'implementation':>15} {'total[ms]':>10} {'per turn[ms]':>13}")
+    turns_total = args.turns * args.conversations
+    for label, elapsed in (("per-call", previous), ("cached batch", cached)):
+        print(f"{label:>15} {elapsed * 1000:>10.1f} {elapsed * 1000 / turns_total:>13.3f}")
+    print(f"speedup: {previous / cached:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--conversations", type=int, default=5)
+    main(parser.parse_args())
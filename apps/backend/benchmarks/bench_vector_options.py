@@ -0,0 +1,137 @@
+"""
+Compare the vector options of the search index (AZURE_AI_SEARCH_VECTOR_DIMENSIONS, AZURE_AI_SEARCH_VECTOR_COMPRESSION,
+AZURE_AI_SEARCH_VECTOR_OVERSAMPLING) on a sample corpus by emulating them with NumPy:
+  recall@k    overlap of the top k with the exact top k of the full-precision 3072-dimension vectors
+  scan[ms]    exhaustive scan per query on this machine (float32 matrix product, or XOR and popcount for binary codes),
+              plus the rescoring of the oversampled candidates with the full-precision vectors
+  index[B]    bytes per vector in the vector index (the quantized vectors that count against the vector quota)
+  upload[B]   JSON bytes per vector in the upload request
+Storing one vector field instead of two halves both sizes.
+
+The corpus is the question vectors of an Arrow file written by indexing/embed_columnar.py, or a synthetic corpus
+with most of its variance in the leading dimensions like text-embedding-3 (whose recall under truncation it only
+approximates). Queries are held-out vectors of the same corpus.
+
+Usage (from apps/backend):
+    python -m benchmarks.bench_vector_options --documents 20000
+    python -m benchmarks.bench_vector_options --arrow indexing/output_csv/updated_incident_all_20240421.arrow
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "indexing"))
+
+CONFIGS = [
+    # (dimensions, compression, oversampling; 0 means no rescoring)
+    (3072, "none", 0),
+    (3072, "scalar", 10),
+    (3072, "binary", 0),
+    (3072, "binary", 10),
+    (1024, "none", 0),
+    (1024, "scalar", 10),
+    (1024, "binary", 10),
+    (512, "none", 0),
+    (512, "binary", 10),
+    (256, "none", 0),
+]
+
+
+def synthetic_corpus(count: int, dimensions: int, topics: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    scale = (1.0 + np.arange(dimensions)) ** -0.5
+    centroids = rng.standard_normal((topics, dimensions), dtype=np.float32) * scale
+    vectors = centroids[rng.integers(0, topics, count)] + 0.6 * rng.standard_normal((count, dimensions), dtype=np.float32) * scale
+    return vectors.astype(np.float32)
+
+
+def load_arrow(path: str) -> np.ndarray:
+    from modules.columnar import ColumnarDataset
+
+    dataset = ColumnarDataset(path)
+    if not dataset.has_vectors:
+        raise SystemExit(f"{path} has no vectors; run indexing/embed_columnar.py first")
+    vectors = [record.question_vector for _, record in dataset.iter_records(()) if record.question_vector is not None]
+    dataset.close()
+    return np.stack(vectors).astype(np.float32)
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+class Emulated:
+    """One configuration: the truncated vectors and their quantized codes, searched the way the service does."""
+
+    def __init__(self, corpus: np.ndarray, dimensions: int, compression: str, oversampling: float):
+        self.dimensions = dimensions
+        self.compression = compression
+        self.oversampling = oversampling
+        self.vectors = np.ascontiguousarray(normalize(corpus[:, :dimensions]))
+        if compression == "scalar":
+            # int8 codes over the range of each dimension, scored after dequantizing
+            self.low = self.vectors.min(axis=0)
+            self.step = np.maximum(self.vectors.max(axis=0) - self.low, 1e-12) / 255
+            codes = np.round((self.vectors - self.low) / self.step).astype(np.uint8)
+            self.dequantized = codes.astype(np.float32) * self.step + self.low
+        elif compression == "binary":
+            # One bit per dimension (its sign), scored by the Hamming distance
+            self.codes = np.packbits(self.vectors > 0, axis=1).view(np.uint8)
+
+    def index_bytes(self) -> int:
+        return {"none": 4 * self.dimensions, "scalar": self.dimensions, "binary": self.dimensions // 8}[self.compression]
+
+    def search(self, query: np.ndarray, k: int) -> np.ndarray:
+        q = query[: self.dimensions]
+        q = q / max(float(np.linalg.norm(q)), 1e-12)
+        if self.compression == "none":
+            return top_k(self.vectors @ q, k)
+        candidates = int(k * self.oversampling) if self.oversampling else k
+        if self.compression == "scalar":
+            rows = top_k(self.dequantized @ q, candidates)
+        else:
+            distances = np.bitwise_count(np.bitwise_xor(self.codes, np.packbits(q > 0))).sum(axis=1, dtype=np.int32)
+            rows = top_k(-distances.astype(np.float32), candidates)
+        if not self.oversampling:
+            return rows
+        return rows[top_k(self.vectors[rows] @ q, k)]
+
+
+def main(args):
+    corpus = load_arrow(args.arrow) if args.arrow else synthetic_corpus(args.documents + args.queries, 3072, args.topics)
+    queries, corpus = corpus[: args.queries], corpus[args.queries :]
+    full = normalize(corpus)
+    truth = [set(top_k(full @ (q / np.linalg.norm(q)), args.k).tolist()) for q in queries]
+    print(f"{len(corpus)} documents, {len(queries)} queries, recall@{args.k} against exact full-precision search")
+    print(f"{'dims':>5} {'compression':>11} {'rescore':>8} {'recall':>7} {'scan[ms]':>9} {'index[B]':>9} {'upload[B]':>10}")
+    for dimensions, compression, oversampling in CONFIGS:
+        emulated = Emulated(corpus, dimensions, compression, oversampling)
+        start = time.perf_counter()
+        results = [emulated.search(q, args.k) for q in queries]
+        elapsed = (time.perf_counter() - start) / len(queries)
+        recall = np.mean([len(truth_set & set(result.tolist())) / args.k for truth_set, result in zip(truth, results)])
+        upload_bytes = len(json.dumps(emulated.vectors[0].astype(np.float64).tolist()))
+        rescore = f"x{oversampling:g}" if oversampling else "-"
+        print(
+            f"{dimensions:>5} {compression:>11} {rescore:>8} {recall:>7.3f} {elapsed * 1000:>9.2f} "
+            f"{emulated.index_bytes():>9} {upload_bytes:>10}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--arrow", help="Arrow file with vectors (indexing/embed_columnar.py); synthetic corpus if omitted")
+    parser.add_argument("--documents", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--topics", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    main(parser.parse_args())
@@ -0,0 +1,258 @@
+"""
+Local stand-ins for the Azure OpenAI and Azure AI Search REST endpoints used by the backend.
+
+The stubs only implement the request/response shapes the backend actually touches, and answer after a configurable
+delay so that benchmarks can measure how well the backend overlaps its I/O without any network access.
+"""
+import array
+import asyncio
+import base64
+import json
+import random
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+from aiohttp import web
+
+
+@dataclass
+class StubConfig:
+    embedding_latency: float = 0.05
+    # Extra service time per input of a batched embeddings request, and the most inputs one request may carry (0: any)
+    embedding_latency_per_input: float = 0.0
+    embedding_max_inputs: int = 0
+    search_latency: float = 0.03
+    # Total generation time; streamed completions spread it evenly over `chat_chunks` chunks
+    chat_latency: float = 0.2
+    chat_chunks: int = 20
+    # Share of non-streamed completions that take `chat_slow_factor` times as long, like long generations
+    chat_slow_probability: float = 0.0
+    chat_slow_factor: float = 10.0
+    embedding_dimensions: int = 3072
+    search_hits: int = 10
+    answer_text: str = "申し訳ありませんが、このシステムではその質問には対応できません。"
+    # Index requests: service time per request and per MB of payload, the largest payload accepted (413 beyond it),
+    # and the share of documents rejected with a transient 503 in an otherwise successful (207) response
+    index_latency: float = 0.05
+    index_latency_per_mb: float = 0.02
+    index_max_request_bytes: int = 16 * 1024 * 1024
+    index_failure_probability: float = 0.0
+    # Keys of the documents indexed so far
+    indexed_keys: set = field(default_factory=set)
+    # Azure OpenAI quota per deployment; requests beyond it get a 429 with Retry-After (0: no limit)
+    rate_limit_requests_per_minute: float = 0
+    # Requests (Azure OpenAI and index) and 429 responses served, for benchmarks to read
+    counters: dict = field(default_factory=lambda: {"requests": 0, "throttled": 0})
+
+
+class _RequestBuckets:
+    """Per-deployment token buckets of the stub's 429 mode."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate)  # About one second of burst, like the service's short windows
+        self.buckets: dict[str, list[float]] = {}
+
+    def take(self, deployment: str) -> float:
+        """Returns 0 when the request is admitted, otherwise the seconds until it would be."""
+        now = time.monotonic()
+        level, updated = self.buckets.get(deployment, [self.capacity, now])
+        level = min(self.capacity, level + (now - updated) * self.rate)
+        if level >= 1:
+            self.buckets[deployment] = [level - 1, now]
+            return 0.0
+        self.buckets[deployment] = [level, now]
+        return (1 - level) / self.rate
+
+
+def _throttle(request: web.Request, config: StubConfig, buckets: "_RequestBuckets | None"):
+    config.counters["requests"] += 1
+    if buckets is None:
+        return None
+    # Azure OpenAI paths look like /openai/deployments/{deployment}/embeddings
+    parts = request.path.split("/")
+    deployment = parts[parts.index("deployments") + 1] if "deployments" in parts else ""
+    wait = buckets.take(deployment)
+    if not wait:
+        return None
+    config.counters["throttled"] += 1
+    return web.json_response(
+        {"error": {"code": "429", "message": "Requests to the deployment have exceeded the rate limit. Please retry after a while."}},
+        status=429,
+        headers={"retry-after": str(max(1, round(wait))), "retry-after-ms": str(int(wait * 1000))},
+    )
+
+
+@lru_cache(maxsize=4096)
+def _embedding(text: str, dimensions: int, encoding_format: str) -> object:
+    rng = random.Random(text)
+    vector = [rng.uniform(-1.0, 1.0) for _ in range(dimensions)]
+    if encoding_format == "base64":
+        # The OpenAI SDK asks for base64 whenever NumPy is installed, as does the real service
+        return base64.b64encode(array.array("f", vector).tobytes()).decode("ascii")
+    return vector
+
+
+async def _handle_embeddings(request: web.Request, config: StubConfig) -> web.Response:
+    body = await request.json()
+    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    encoding_format = body.get("encoding_format", "float")
+    if config.embedding_max_inputs and len(inputs) > config.embedding_max_inputs:
+        return web.json_response(
+            {"error": {"code": "InvalidRequest", "message": f"Too many inputs. The max number of inputs is {config.embedding_max_inputs}."}},
+            status=400,
+        )
+    await asyncio.sleep(config.embedding_latency + config.embedding_latency_per_input * len(inputs))
+    return web.json_response(
+        {
+            "object": "list",
+            "model": body.get("model", "stub"),
+            "data": [
+                {"object": "embedding", "index": i, "embedding": _embedding(text, config.embedding_dimensions, encoding_format)}
+                for i, text in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        }
+    )
+
+
+def _completion(model: str, content: str) -> dict:
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }
+        ],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+def _chunk(model: str, choices: list[dict]) -> bytes:
+    chunk = {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": choices,
+    }
+    return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode()
+
+
+async def _stream_chat(request: web.Request, config: StubConfig, model: str) -> web.StreamResponse:
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await response.prepare(request)
+    # Azure OpenAI sends a first chunk without choices that only carries prompt filter results
+    await response.write(_chunk(model, []))
+    text = config.answer_text
+    size = max(1, -(-len(text) // config.chat_chunks))
+    pieces = [text[i : i + size] for i in range(0, len(text), size)]
+    for i, piece in enumerate(pieces):
+        await asyncio.sleep(config.chat_latency / len(pieces))
+        delta = {"content": piece} if i else {"role": "assistant", "content": piece}
+        await response.write(_chunk(model, [{"index": 0, "delta": delta, "finish_reason": None}]))
+    await response.write(_chunk(model, [{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+    await response.write(b"data: [DONE]\n\n")
+    await response.write_eof()
+    return response
+
+
+async def _handle_chat(request: web.Request, config: StubConfig) -> web.StreamResponse:
+    body = await request.json()
+    model = body.get("model", "stub")
+    if body.get("stream"):
+        return await _stream_chat(request, config, model)
+    slow = config.chat_slow_probability and random.random() < config.chat_slow_probability
+    await asyncio.sleep(config.chat_latency * (config.chat_slow_factor if slow else 1))
+    return web.json_response(_completion(model, config.answer_text))
+
+
+async def _handle_search(request: web.Request, config: StubConfig) -> web.Response:
+    await request.read()
+    await asyncio.sleep(config.search_latency)
+    hits = [
+        {
+            "@search.score": 1.0 / (i + 1),
+            "id": f"doc-{i}",
+            "question": f"既存の質問 {i}",
+            "answer": f"既存の回答 {i}",
+            "services": [],
+            "tag": [],
+        }
+        for i in range(config.search_hits)
+    ]
+    return web.json_response({"value": hits})
+
+
+async def _handle_index(request: web.Request, config: StubConfig) -> web.Response:
+    config.counters["requests"] += 1
+    body = await request.read()
+    if len(body) > config.index_max_request_bytes:
+        return web.json_response({"error": {"code": "RequestEntityTooLarge", "message": "The request is too large."}}, status=413)
+    actions = json.loads(body)["value"]
+    # Like the service, a document it cannot take (here an empty vector) fails the whole request
+    if any(value == [] for action in actions for key, value in action.items() if key.endswith("_vector")):
+        return web.json_response({"error": {"code": "InvalidRequestParameter", "message": "The vector field is empty."}}, status=400)
+    await asyncio.sleep(config.index_latency + config.index_latency_per_mb * len(body) / 1e6)
+    results = []
+    for action in actions:
+        if config.index_failure_probability and random.random() < config.index_failure_probability:
+            results.append({"key": action["id"], "status": False, "errorMessage": "Service unavailable.", "statusCode": 503})
+        else:
+            config.indexed_keys.add(action["id"])
+            results.append({"key": action["id"], "status": True, "errorMessage": None, "statusCode": 201})
+    status = 207 if any(not result["status"] for result in results) else 200
+    return web.json_response({"value": results}, status=status)
+
+
+def create_stub_app(config: StubConfig) -> web.Application:
+    buckets = _RequestBuckets(config.rate_limit_requests_per_minute) if config.rate_limit_requests_per_minute else None
+
+    async def dispatch(request: web.Request) -> web.StreamResponse:
+        path = request.path
+        if path.endswith("/embeddings") or path.endswith("/chat/completions"):
+            # aiohttp responses are mappings and test false when empty, so compare with None
+            throttled = _throttle(request, config, buckets)
+            if throttled is not None:
+                return throttled
+        if path.endswith("/embeddings"):
+            return await _handle_embeddings(request, config)
+        if path.endswith("/chat/completions"):
+            return await _handle_chat(request, config)
+        if path.endswith("/docs/search.post.search"):
+            return await _handle_search(request, config)
+        if path.endswith("/docs/search.index"):
+            return await _handle_index(request, config)
+        return web.json_response({"error": {"code": "NotFound", "message": path}}, status=404)
+
+    # Index requests carry up to 16 MB of vectors, beyond the 1 MB aiohttp accepts by default
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_route("*", "/{tail:.*}", dispatch)
+    return app
+
+
+async def start_stub_server(config: StubConfig, host: str = "127.0.0.1", port: int = 0, ssl_context=None):
+    """
+    Start the stub server on the running event loop and return (runner, base_url).
+    Call `await runner.cleanup()` to stop it.
+    """
+    runner = web.AppRunner(create_stub_app(config))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port, ssl_context=ssl_context)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    scheme = "https" if ssl_context else "http"
+    return runner, f"{scheme}://{host}:{bound_port}"
+
+
+if __name__ == "__main__":
+    import sys
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    web.run_app(create_stub_app(StubConfig()), host="127.0.0.1", port=port, print=lambda _: print(json.dumps({"port": port})))
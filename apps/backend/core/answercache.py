@@ -0,0 +1,127 @@
+import time
+from typing import Any, Optional
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    An in-process cache of generated answers keyed by the question embedding.
+    A cached answer is reused when a new question has the same top search hit and its embedding is at least
+    `similarity_threshold` cosine-similar to a previously answered one. Entries expire after `ttl_seconds`, and the
+    least recently used entry is evicted when the cache is full.
+
+    Embeddings are kept as unit-length float32 rows of one preallocated matrix (about 12 KB per entry for 3072
+    dimensions). Entries are grouped by top hit id, so a lookup only scores the rows that share the hit, which keeps it
+    well under a millisecond at 100k entries.
+    Attributes:
+        max_entries (int): Capacity of the cache.
+        ttl_seconds (float): Lifetime of an entry.
+        similarity_threshold (float): Minimum cosine similarity for a hit.
+        hits, misses, evictions, expirations (int): Counters since start.
+    Methods:
+        lookup(self, embedding: list, hit_id: str): Returns the cached answer, or None.
+        store(self, embedding: list, hit_id: str, answer: str): Caches an answer.
+        stats(self): Returns the counters, current size and hit rate.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 3600.0, similarity_threshold: float = 0.97):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        # Allocated on the first store, once the embedding dimensions are known
+        self._vectors: Optional[np.ndarray] = None
+        self._expires_at = np.zeros(max_entries, dtype=np.float64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._hit_ids: list[Optional[str]] = [None] * max_entries
+        self._answers: list[Optional[str]] = [None] * max_entries
+        self._slots_by_hit_id: dict[str, list[int]] = {}
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return self.max_entries - len(self._free_slots)
+
+    @staticmethod
+    def _normalize(embedding: list[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding: list[float], hit_id: str) -> Optional[str]:
+        slots = self._slots_by_hit_id.get(hit_id)
+        if not slots or self._vectors is None:
+            self.misses += 1
+            return None
+        now = time.monotonic()
+        for slot in [slot for slot in slots if self._expires_at[slot] <= now]:
+            self._release(slot)
+            self.expirations += 1
+        slots = self._slots_by_hit_id.get(hit_id)
+        if not slots:
+            self.misses += 1
+            return None
+        rows = np.fromiter(slots, dtype=np.int64, count=len(slots))
+        similarities = self._vectors[rows] @ self._normalize(embedding)
+        best = int(np.argmax(similarities))
+        if float(similarities[best]) < self.similarity_threshold:
+            self.misses += 1
+            return None
+        slot = int(rows[best])
+        self._last_used[slot] = now
+        self.hits += 1
+        return self._answers[slot]
+
+    def store(self, embedding: list[float], hit_id: str, answer: str) -> None:
+        if self.max_entries == 0:
+            return
+        if self._vectors is None:
+            self._vectors = np.zeros((self.max_entries, len(embedding)), dtype=np.float32)
+        now = time.monotonic()
+        slot = self._free_slots.pop() if self._free_slots else self._evict(now)
+        self._vectors[slot] = self._normalize(embedding)
+        self._expires_at[slot] = now + self.ttl_seconds
+        self._last_used[slot] = now
+        self._hit_ids[slot] = hit_id
+        self._answers[slot] = answer
+        self._slots_by_hit_id.setdefault(hit_id, []).append(slot)
+
+    def _evict(self, now: float) -> int:
+        # Prefer an expired entry; otherwise drop the least recently used one
+        expired = np.flatnonzero(self._expires_at <= now)
+        if len(expired):
+            slot = int(expired[0])
+            self.expirations += 1
+        else:
+            slot = int(np.argmin(self._last_used))
+            self.evictions += 1
+        self._release(slot, free=False)
+        return slot
+
+    def _release(self, slot: int, free: bool = True) -> None:
+        hit_id = self._hit_ids[slot]
+        slots = self._slots_by_hit_id[hit_id]
+        slots.remove(slot)
+        if not slots:
+            del self._slots_by_hit_id[hit_id]
+        self._hit_ids[slot] = None
+        self._answers[slot] = None
+        # Released slots must never look live or recently used to _evict
+        self._expires_at[slot] = 0.0
+        self._last_used[slot] = 0.0
+        if free:
+            self._free_slots.append(slot)
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
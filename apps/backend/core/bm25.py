@@ -0,0 +1,115 @@
+from collections import Counter
+from typing import Iterable
+
+import numpy as np
+
+from core.keywords import tokenize
+
+TEXT_FIELDS = ("question", "answer")
+
+
+class Bm25Index:
+    """
+    An in-memory BM25 inverted index over the question and answer text of the local vector store.
+    Each field keeps its postings in CSR form: the documents and term frequencies of term t are
+    `doc_ids[offsets[t]:offsets[t + 1]]` and `tfs[...]`, so a query gathers a few slices and scores them in one
+    vectorized pass. Terms come from the same tokenizer as the keyword extraction.
+    Attributes:
+        terms (list): The vocabulary shared by both fields.
+        num_documents (int): Number of indexed documents.
+        k1, b (float): BM25 parameters, applied at query time.
+    Methods:
+        build(documents): Builds the index from document dicts in row order.
+        load(path) / save(self, path): Reads and writes the .npz format.
+        search(self, text: str, field: str, k: int): Top-k rows by BM25 score.
+    """
+
+    def __init__(self, terms: list[str], fields: dict[str, dict[str, np.ndarray]], num_documents: int):
+        self.terms = terms
+        self.index = {term: i for i, term in enumerate(terms)}
+        self.fields = fields
+        self.num_documents = num_documents
+        self.k1 = 1.2
+        self.b = 0.75
+        self._idf = {}
+        for field, postings in fields.items():
+            df = np.diff(postings["offsets"]).astype(np.float32)
+            # Lucene's BM25 idf, which stays positive for terms in most documents
+            self._idf[field] = np.log1p((num_documents - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+    @classmethod
+    def build(cls, documents: Iterable[dict]) -> "Bm25Index":
+        term_ids: dict[str, int] = {}
+        postings: dict[str, list[tuple[int, int, int]]] = {field: [] for field in TEXT_FIELDS}
+        lengths: dict[str, list[int]] = {field: [] for field in TEXT_FIELDS}
+        num_documents = 0
+        for row, document in enumerate(documents):
+            for field in TEXT_FIELDS:
+                terms = tokenize(document.get(field) or "")
+                lengths[field].append(len(terms))
+                for term, tf in Counter(terms).items():
+                    postings[field].append((term_ids.setdefault(term, len(term_ids)), row, tf))
+            num_documents += 1
+        fields = {}
+        for field in TEXT_FIELDS:
+            triples = np.array(postings[field], dtype=np.int64).reshape(-1, 3)
+            order = np.lexsort((triples[:, 1], triples[:, 0]))
+            triples = triples[order]
+            counts = np.bincount(triples[:, 0], minlength=len(term_ids))
+            fields[field] = {
+                "offsets": np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+                "doc_ids": triples[:, 1].astype(np.int32),
+                "tfs": triples[:, 2].astype(np.float32),
+                "lengths": np.array(lengths[field], dtype=np.float32),
+            }
+        terms = sorted(term_ids, key=term_ids.get)
+        return cls(terms, fields, num_documents)
+
+    def save(self, path: str) -> None:
+        blob = np.frombuffer("\n".join(self.terms).encode("utf-8"), dtype=np.uint8)
+        arrays = {f"{field}_{name}": array for field, postings in self.fields.items() for name, array in postings.items()}
+        np.savez(path, terms=blob, num_documents=np.int64(self.num_documents), **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "Bm25Index":
+        with np.load(path) as data:
+            blob = data["terms"].tobytes().decode("utf-8")
+            fields = {
+                field: {name: data[f"{field}_{name}"] for name in ("offsets", "doc_ids", "tfs", "lengths")}
+                for field in TEXT_FIELDS
+            }
+            return cls(blob.split("\n") if blob else [], fields, int(data["num_documents"]))
+
+    def scores(self, text: str, field: str) -> np.ndarray:
+        """Returns the BM25 score of every document for the query text."""
+        scores = np.zeros(self.num_documents, dtype=np.float32)
+        query_terms = Counter(term_id for term in tokenize(text) if (term_id := self.index.get(term)) is not None)
+        if not query_terms or self.num_documents == 0:
+            return scores
+        postings = self.fields[field]
+        offsets = postings["offsets"]
+        slices = [np.arange(offsets[t], offsets[t + 1]) for t in query_terms]
+        positions = np.concatenate(slices)
+        if len(positions) == 0:
+            return scores
+        # Query term frequency multiplies the weight of each posting of that term
+        weights = np.repeat(
+            np.fromiter((self._idf[field][t] * n for t, n in query_terms.items()), dtype=np.float32, count=len(query_terms)),
+            [len(s) for s in slices],
+        )
+        doc_ids = postings["doc_ids"][positions]
+        tfs = postings["tfs"][positions]
+        lengths = postings["lengths"]
+        average_length = max(float(lengths.mean()), 1.0)
+        norms = self.k1 * (1 - self.b + self.b * lengths[doc_ids] / average_length)
+        np.add.at(scores, doc_ids, weights * tfs * (self.k1 + 1) / (tfs + norms))
+        return scores
+
+    def search(self, text: str, field: str, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns (row indexes, BM25 scores) of the top k matching rows, best first."""
+        scores = self.scores(text, field)
+        matches = np.flatnonzero(scores)
+        if len(matches) > k:
+            matches = matches[np.argpartition(-scores[matches], k - 1)[:k]]
+        matches = matches[np.argsort(-scores[matches], kind="stable")]
+        return matches, scores[matches]
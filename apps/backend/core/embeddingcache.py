@@ -0,0 +1,101 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+class EmbeddingCache:
+    """
+    An exact-match cache of embeddings keyed by (deployment, normalized text hash), shared by the chat backend and the
+    indexing pipeline.
+    Lookups go to a bounded in-memory LRU first and then, when a path is given, to a SQLite file that keeps the
+    vectors as float32 blobs across runs. Safe to use from several threads; with a SQLite file, get and put block on
+    disk I/O, so async callers run them in a worker thread.
+    Attributes:
+        path (str): SQLite file of the on-disk tier, or None for a memory-only cache.
+        max_memory_entries (int): Capacity of the in-memory tier.
+        hits, misses (int): Counters since start.
+    Methods:
+        get(self, deployment: str, text: str): Returns the cached embedding, or None.
+        put(self, deployment: str, text: str, embedding: list): Stores an embedding in both tiers.
+        put_many(self, deployment: str, embeddings: dict): Stores embeddings by text in both tiers, in one transaction.
+        close(self): Closes the SQLite connection.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_memory_entries: int = 4096):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        if path:
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+            self._connection.commit()
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        return WHITESPACE_PATTERN.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+    @classmethod
+    def key(cls, deployment: str, text: str) -> str:
+        return hashlib.sha256(f"{deployment}\0{cls.normalize_text(text)}".encode()).hexdigest()
+
+    def get(self, deployment: str, text: str) -> Optional[list[float]]:
+        key = self.key(deployment, text)
+        with self._lock:
+            blob = self._memory.get(key)
+            if blob is not None:
+                self._memory.move_to_end(key)
+            elif self._connection is not None:
+                row = self._connection.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    blob = row[0]
+                    self._remember(key, blob)
+            if blob is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return np.frombuffer(blob, dtype=np.float32).tolist()
+
+    def put(self, deployment: str, text: str, embedding: list[float]) -> None:
+        self.put_many(deployment, {text: embedding})
+
+    def put_many(self, deployment: str, embeddings: dict[str, list[float]]) -> None:
+        rows = [
+            (self.key(deployment, text), np.asarray(embedding, dtype=np.float32).tobytes())
+            for text, embedding in embeddings.items()
+            if embedding
+        ]
+        if not rows:
+            return
+        with self._lock:
+            for key, blob in rows:
+                self._remember(key, blob)
+            if self._connection is not None:
+                # One transaction (and one commit) for all of them
+                self._connection.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+                self._connection.commit()
+
+    def _remember(self, key: str, blob: bytes) -> None:
+        self._memory[key] = blob
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,115 @@
+import logging
+import re
+from collections import Counter
+from typing import Iterable, Optional
+
+import numpy as np
+
+# ASCII words, katakana runs and kanji runs. Hiragana runs are mostly particles and inflections, so they are dropped.
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.\-]*|[゠-ヿｦ-ﾟ]{2,}|[一-鿿㐀-䶿々]+")
+KANJI_PATTERN = re.compile(r"[一-鿿㐀-䶿々]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Split Japanese/English text into index terms without a morphological analyzer.
+    ASCII words are lowercased, katakana words are kept whole and kanji compounds longer than two characters are
+    split into overlapping character bigrams, which is the usual n-gram fallback for Japanese retrieval.
+    """
+    terms = []
+    for match in TOKEN_PATTERN.finditer(text):
+        token = match.group()
+        if KANJI_PATTERN.fullmatch(token) and len(token) > 2:
+            terms.extend(token[i : i + 2] for i in range(len(token) - 1))
+        elif token.isascii():
+            if len(token) > 1:
+                terms.append(token.lower())
+        else:
+            terms.append(token)
+    return terms
+
+
+class IdfTable:
+    """
+    Inverse document frequencies of the Q&A corpus, built offline by indexing/build_idf.py.
+    Attributes:
+        terms (list): The vocabulary, in the order of the idf array.
+        idf (np.ndarray): float32 idf per term.
+        num_documents (int): Number of documents the table was built from.
+    Methods:
+        build(documents): Builds a table from an iterable of texts.
+        load(path) / save(self, path): Reads and writes the compact .npz format.
+        lookup(self, terms: list): Returns the idf of each term, 0 for terms that are not in the corpus.
+    """
+
+    def __init__(self, terms: list[str], idf: np.ndarray, num_documents: int):
+        self.terms = terms
+        self.idf = idf.astype(np.float32, copy=False)
+        self.num_documents = num_documents
+        self.index = {term: i for i, term in enumerate(terms)}
+
+    @classmethod
+    def build(cls, documents: Iterable[str], min_df: int = 1) -> "IdfTable":
+        document_frequencies: Counter = Counter()
+        num_documents = 0
+        for document in documents:
+            document_frequencies.update(set(tokenize(document)))
+            num_documents += 1
+        terms = sorted(term for term, df in document_frequencies.items() if df >= min_df)
+        df = np.array([document_frequencies[term] for term in terms], dtype=np.float64)
+        # Smoothed idf, as in scikit-learn's TfidfVectorizer
+        idf = np.log((1 + num_documents) / (1 + df)) + 1
+        return cls(terms, idf, num_documents)
+
+    def save(self, path: str) -> None:
+        # The vocabulary is stored as one newline-joined UTF-8 blob, which is far smaller than a fixed-width string array
+        blob = np.frombuffer("\n".join(self.terms).encode("utf-8"), dtype=np.uint8)
+        np.savez_compressed(path, terms=blob, idf=self.idf, num_documents=np.int64(self.num_documents))
+
+    @classmethod
+    def load(cls, path: str) -> "IdfTable":
+        with np.load(path) as data:
+            blob = data["terms"].tobytes().decode("utf-8")
+            terms = blob.split("\n") if blob else []
+            return cls(terms, data["idf"], int(data["num_documents"]))
+
+    def lookup(self, terms: list[str]) -> np.ndarray:
+        if not self.terms:
+            return np.zeros(len(terms), dtype=np.float32)
+        positions = np.fromiter((self.index.get(term, -1) for term in terms), dtype=np.int64, count=len(terms))
+        # A term the corpus never uses cannot match any document, so it gets no weight as a search keyword
+        return np.where(positions >= 0, self.idf[positions], np.float32(0))
+
+
+class KeywordExtractor:
+    """
+    Picks the highest tf-idf terms of a query as the keyword part of the hybrid search.
+    Without an idf table every term weighs the same, so the most frequent terms win.
+    """
+
+    def __init__(self, idf_table: Optional[IdfTable] = None, top_n: int = 5):
+        self.idf_table = idf_table
+        self.top_n = top_n
+
+    @classmethod
+    def from_path(cls, path: Optional[str], top_n: int = 5) -> "KeywordExtractor":
+        if path:
+            try:
+                return cls(IdfTable.load(path), top_n)
+            except FileNotFoundError:
+                logging.warning("Keyword idf table %s not found, keywords will be ranked by term frequency", path)
+        return cls(None, top_n)
+
+    def extract(self, text: str) -> str:
+        counts = Counter(tokenize(text))
+        if not counts:
+            return text
+        terms = list(counts)
+        scores = np.fromiter(counts.values(), dtype=np.float32, count=len(terms))
+        if self.idf_table is not None:
+            scores *= self.idf_table.lookup(terms)
+        # Stable sort on the negated scores keeps first-appearance order among ties
+        top = np.argsort(-scores, kind="stable")[: self.top_n]
+        if scores[top[0]] > 0:
+            top = top[scores[top] > 0]
+        return " ".join(terms[i] for i in top)
@@ -1,6 +1,7 @@
+import logging
 import unicodedata
 
-from .modelhelper import num_tokens_from_messages
+from .modelhelper import num_tokens_from_messages, num_tokens_from_messages_batch
 
 
 class MessageBuilder:
@@ -13,8 +14,14 @@ class MessageBuilder:
     Methods:
         __init__(self, system_content: str, chatgpt_model: str): Initializes the MessageBuilder instance.
         append_message(self, role: str, content: str, index: int = 1): Appends a new message to the conversation.
+        count_tokens_for_messages(self, messages: list): Counts the tokens of several messages in one call.
+        append_history(self, history: list, max_tokens: int, index: int = 1): Inserts the most recent history messages
+            that fit in a token budget, keeping their chronological order.
     """
 
+    # History messages are counted in batches of this size, so truncation stops after a few batches on long histories
+    HISTORY_COUNT_BATCH_SIZE = 64
+
     def __init__(self, system_content: str, chatgpt_model: str):
         self.messages = [{"role": "system", "content": self.normalize_content(system_content)}]
         self.model = chatgpt_model
@@ -22,8 +29,35 @@ class MessageBuilder:
     def append_message(self, role: str, content: str, index: int = 1):
         self.messages.insert(index, {"role": role, "content": self.normalize_content(content)})
 
+    def append_history(self, history: list[dict[str, str]], max_tokens: int, index: int = 1) -> int:
+        """
+        Walk the history from newest to oldest, keeping messages until the next one would exceed max_tokens.
+        Kept messages are collected newest first, reversed once and spliced in at index, so the cost is linear in the
+        number of kept messages and each one is normalized exactly once. Returns the number of tokens added.
+        """
+        kept = []
+        total_token_count = 0
+        newest_to_oldest = history[::-1]
+        for start in range(0, len(newest_to_oldest), self.HISTORY_COUNT_BATCH_SIZE):
+            batch = newest_to_oldest[start : start + self.HISTORY_COUNT_BATCH_SIZE]
+            for message, message_count in zip(batch, self.count_tokens_for_messages(batch)):
+                if (total_token_count + message_count) > max_tokens:
+                    logging.debug("Reached max tokens of %d, history will be truncated", max_tokens)
+                    break
+                kept.append({"role": message["role"], "content": self.normalize_content(message["content"])})
+                total_token_count += message_count
+            else:
+                continue
+            break
+        kept.reverse()
+        self.messages[index:index] = kept
+        return total_token_count
+
     def count_tokens_for_message(self, message: dict[str, str]):
         return num_tokens_from_messages(message, self.model)
 
+    def count_tokens_for_messages(self, messages: list[dict[str, str]]) -> list[int]:
+        return num_tokens_from_messages_batch(messages, self.model)
+
     def normalize_content(self, content: str):
         return unicodedata.normalize("NFC", content)
@@ -1,5 +1,10 @@
 from __future__ import annotations
 
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
 import tiktoken
 
 MODELS_2_TOKEN_LIMITS = {
@@ -16,6 +21,52 @@ MODELS_2_TOKEN_LIMITS = {
 AOAI_2_OAI = {"gpt-35-turbo": "gpt-3.5-turbo", "gpt-35-turbo-16k": "gpt-3.5-turbo-16k", "gpt-4": "gpt-4", "gpt-4-32k": "gpt-4-32k", "gpt-4o-mini": "gpt-4o-mini", "gpt-4o": "gpt-4o"}
 
 
+TOKEN_COUNT_CACHE_SIZE = 8192
+
+
+class TokenCountCache:
+    """
+    A thread-safe, bounded LRU of token counts keyed by a hash of the encoded text, so that the history resent on
+    every turn of a conversation is only tokenized once per process.
+    """
+
+    def __init__(self, maxsize: int = TOKEN_COUNT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._counts: OrderedDict[bytes, int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(encoding_name: str, text: str) -> bytes:
+        return hashlib.blake2b(f"{encoding_name}\0{text}".encode(), digest_size=16).digest()
+
+    def get(self, key: bytes) -> int | None:
+        with self._lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._counts.move_to_end(key)
+            return count
+
+    def put(self, key: bytes, count: int) -> None:
+        with self._lock:
+            self._counts[key] = count
+            self._counts.move_to_end(key)
+            while len(self._counts) > self.maxsize:
+                self._counts.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._counts.clear()
+
+
+token_count_cache = TokenCountCache()
+
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name: str = "cl100k_base") -> tiktoken.Encoding:
+    """Return the process-wide tiktoken encoding, loading it on first use."""
+    return tiktoken.get_encoding(encoding_name)
+
+
 def get_token_limit(model_id: str) -> int:
     if model_id not in MODELS_2_TOKEN_LIMITS:
         raise ValueError("Expected model gpt-35-turbo and above")
@@ -37,11 +88,41 @@ def num_tokens_from_messages(message: dict[str, str], model: str) -> int:
         output: 11
     """
     # encoding = tiktoken.encoding_for_model(get_oai_chatmodel_tiktok(model))
-    encoding = tiktoken.get_encoding("cl100k_base")
-    num_tokens = 2  # For "role" and "content" keys
-    for key, value in message.items():
-        num_tokens += len(encoding.encode(value))
-    return num_tokens
+    return num_tokens_from_messages_batch([message], model)[0]
+
+
+def num_tokens_from_messages_batch(messages: list[dict[str, str]], model: str) -> list[int]:
+    """
+    Calculate the number of tokens required to encode each message of a list in one call.
+    Only values that are not already in the token count cache are tokenized, each distinct value once.
+    Args:
+        messages (list): The messages to encode, each represented as a dictionary.
+        model (str): The name of the model to use for encoding.
+    Returns:
+        list: The number of tokens for each message, in the same order.
+    """
+    encoding = get_encoding("cl100k_base")
+    counts = [2] * len(messages)  # For "role" and "content" keys
+    missing: dict[bytes, list[int]] = {}
+    missing_texts: list[str] = []
+    for i, message in enumerate(messages):
+        for value in message.values():
+            key = token_count_cache.key(encoding.name, value)
+            cached = token_count_cache.get(key)
+            if cached is not None:
+                counts[i] += cached
+            elif key in missing:
+                missing[key].append(i)
+            else:
+                missing[key] = [i]
+                missing_texts.append(value)
+    # encode_batch spins up a thread pool per call, which costs more than it saves for chat-sized texts
+    for (key, indexes), text in zip(missing.items(), missing_texts):
+        count = len(encoding.encode(text))
+        token_count_cache.put(key, count)
+        for i in indexes:
+            counts[i] += count
+    return counts
 
 
 def get_oai_chatmodel_tiktok(aoaimodel: str) -> str:
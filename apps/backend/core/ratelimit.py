@@ -0,0 +1,267 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from openai import APIConnectionError, InternalServerError, RateLimitError
+
+# Failures worth retrying on another deployment after a backoff; connection errors include timeouts
+TRANSIENT_ERRORS = (APIConnectionError, InternalServerError)
+# Errors the scheduler retries; when one still escapes it the request may succeed later, so batch tools stop at their
+# checkpoint instead of recording the record as failed
+RETRYABLE_ERRORS = (RateLimitError,) + TRANSIENT_ERRORS
+
+T = TypeVar("T")
+
+
+# Azure OpenAI enforces per-minute quotas over short windows, so a full minute of quota must not go out in one burst
+BURST_SECONDS = 1.0
+# Window of recent successes from which the request rate of a deployment without a configured limit is learned
+LEARNING_WINDOW_SECONDS = 10.0
+
+
+class TokenBucket:
+    """
+    A bucket that refills continuously at `per_minute` and holds up to `burst_seconds` of it. Taking more than is
+    available puts the bucket in debt, and the caller is told how long to wait until the debt is paid back, so
+    concurrent callers queue up fairly.
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = BURST_SECONDS):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount: float, now: float) -> float:
+        """Takes `amount` and returns the seconds to wait before using it."""
+        wait = self.wait_time(amount, now)
+        self.level -= min(amount, self.capacity)
+        return wait
+
+
+@dataclass
+class DeploymentLimit:
+    """One deployment and its quota; a limit of 0 means unlimited."""
+
+    name: str
+    weight: float = 1.0
+    requests_per_minute: float = 0
+    tokens_per_minute: float = 0
+    requests: Optional[TokenBucket] = field(default=None, init=False, repr=False)
+    tokens: Optional[TokenBucket] = field(default=None, init=False, repr=False)
+    cooldown_until: float = field(default=0.0, init=False)
+    failures: int = field(default=0, init=False)
+    learned: bool = field(default=False, init=False)
+    learned_at: float = field(default=0.0, init=False)
+    successes: deque = field(default_factory=deque, init=False, repr=False)
+
+    def __post_init__(self):
+        self.requests = TokenBucket(self.requests_per_minute) if self.requests_per_minute else None
+        self.tokens = TokenBucket(self.tokens_per_minute) if self.tokens_per_minute else None
+
+    def ready_in(self, estimated_tokens: int, now: float) -> float:
+        waits = [self.cooldown_until - now]
+        if self.requests is not None:
+            waits.append(self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            waits.append(self.tokens.wait_time(estimated_tokens, now))
+        return max(0.0, *waits)
+
+    def learn_rate(self, now: float) -> None:
+        """
+        Without a configured request limit, a 429 sets one from the rate the deployment admitted recently, and later
+        successes raise it again little by little, so callers space their requests instead of retrying in a herd.
+        """
+        if self.requests_per_minute and not self.learned:
+            return
+        # The other requests of a herd were sent before the first 429 came back, so the rate is lowered once per burst
+        if self.learned and now - self.learned_at < BURST_SECONDS:
+            return
+        self._forget_successes(now)
+        if not self.successes:
+            # Nothing admitted yet to learn from; the cooldown alone spaces the retries
+            return
+        observed = len(self.successes) / max(BURST_SECONDS, now - self.successes[0]) * 60
+        current = self.requests.rate * 60 if self.requests is not None else observed
+        self.requests = TokenBucket(max(6.0, min(current, observed) * 0.9))
+        self.learned = True
+        self.learned_at = now
+
+    def _forget_successes(self, now: float) -> None:
+        while self.successes and self.successes[0] < now - LEARNING_WINDOW_SECONDS:
+            self.successes.popleft()
+
+    def record_success(self, now: float) -> None:
+        self.failures = 0
+        self.successes.append(now)
+        self._forget_successes(now)
+        if self.learned:
+            # Additive increase: one more request per minute for each success
+            self.requests.rate += 1 / 60
+            self.requests.capacity = max(1.0, self.requests.rate * BURST_SECONDS)
+
+
+def parse_deployments(spec: Optional[str], default_names: tuple[Optional[str], ...] = ()) -> list[DeploymentLimit]:
+    """
+    Parses "name[:weight[:requests/min[:tokens/min]]]" items separated by commas, e.g.
+    "gpt-4o:2:300:50000,gpt-4o-2:1:100:20000". Without a spec, the default names are used with equal weights and no
+    client-side limits.
+    """
+    deployments = []
+    for item in (spec or "").split(","):
+        if item.strip():
+            name, *numbers = item.strip().split(":")
+            deployments.append(DeploymentLimit(name, *(float(number) for number in numbers)))
+    return deployments or [DeploymentLimit(name) for name in default_names if name]
+
+
+def retry_after_seconds(error: RateLimitError) -> Optional[float]:
+    """Reads the wait the service asked for from a 429 response (retry-after-ms or retry-after headers)."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+class RateLimitScheduler:
+    """
+    Routes requests across several deployments of the same model within their rate limits.
+    Each deployment has token buckets for requests and tokens per minute. A request goes to a deployment that has
+    quota now, picked at random by weight; when none has, it waits for the one that frees up first instead of
+    sending a request that would be throttled. A 429 puts that deployment in cooldown for the Retry-After the
+    service sent, or for a jittered exponential backoff, and the request is retried on the next available deployment.
+    A deployment without a configured request limit learns one from its first 429 (see DeploymentLimit.learn_rate).
+    Connection errors and 5xx responses are retried the same way, so clients should be created with max_retries=0.
+    Shared by the indexing threads (call) and the chat backend's event loop (acall).
+    Attributes:
+        deployments (list): The deployments and their limits.
+        max_attempts (int): Attempts per request before the RateLimitError is raised.
+        base_delay, max_delay (float): Backoff bounds in seconds when the service gives no Retry-After.
+        throttled, requests (int): Counters since start.
+    Methods:
+        call(self, send, estimated_tokens): Runs send(deployment_name) in this thread, retrying on 429.
+        acall(self, send, estimated_tokens): The same for a coroutine function.
+    """
+
+    def __init__(
+        self,
+        deployments: list[DeploymentLimit],
+        max_attempts: int = 10,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        rng: Optional[random.Random] = None,
+    ):
+        if not deployments:
+            raise ValueError("At least one deployment is required")
+        self.deployments = deployments
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rng = rng or random.Random()
+        self.requests = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, estimated_tokens: int) -> tuple[DeploymentLimit, float]:
+        """Picks a deployment, takes quota from it and returns it with the seconds to wait before sending."""
+        with self._lock:
+            now = time.monotonic()
+            waits = [deployment.ready_in(estimated_tokens, now) for deployment in self.deployments]
+            ready = [deployment for deployment, wait in zip(self.deployments, waits) if wait == 0 and deployment.weight > 0]
+            if ready:
+                deployment = self.rng.choices(ready, weights=[d.weight for d in ready])[0]
+                wait = 0.0
+            else:
+                wait, index = min((wait, index) for index, wait in enumerate(waits))
+                deployment = self.deployments[index]
+            # Quota is taken now, so concurrent callers spread over the deployments instead of all picking the same
+            if deployment.requests is not None:
+                deployment.requests.take(1, now)
+            if deployment.tokens is not None:
+                deployment.tokens.take(estimated_tokens, now)
+            self.requests += 1
+            return deployment, wait
+
+    def backoff(self, deployment: DeploymentLimit, retry_after: Optional[float], throttled: bool = True) -> None:
+        with self._lock:
+            self.throttled += throttled
+            deployment.failures += 1
+            if throttled:
+                deployment.learn_rate(time.monotonic())
+            if retry_after is None:
+                # Full jitter keeps the retries of concurrent callers from arriving together
+                retry_after = self.rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** (deployment.failures - 1)))
+            deployment.cooldown_until = max(deployment.cooldown_until, time.monotonic() + retry_after)
+
+    def succeeded(self, deployment: DeploymentLimit) -> None:
+        with self._lock:
+            deployment.record_success(time.monotonic())
+
+    def call(self, send: Callable[[str], T], estimated_tokens: int = 0) -> T:
+        for attempt in range(self.max_attempts):
+            deployment, wait = self.reserve(estimated_tokens)
+            if wait:
+                time.sleep(wait)
+            try:
+                result = send(deployment.name)
+            except RateLimitError as e:
+                self.backoff(deployment, retry_after_seconds(e))
+                if attempt == self.max_attempts - 1:
+                    raise
+                logging.warning("Rate limit exceeded on model %s, retrying (attempt %d)", deployment.name, attempt + 1)
+                continue
+            except TRANSIENT_ERRORS as e:
+                self.backoff(deployment, None, throttled=False)
+                if attempt == self.max_attempts - 1:
+                    raise
+                logging.warning("Request to model %s failed, retrying (attempt %d): %s", deployment.name, attempt + 1, e)
+                continue
+            self.succeeded(deployment)
+            return result
+
+    async def acall(self, send: Callable[[str], Awaitable[T]], estimated_tokens: int = 0) -> T:
+        for attempt in range(self.max_attempts):
+            deployment, wait = self.reserve(estimated_tokens)
+            if wait:
+                await asyncio.sleep(wait)
+            try:
+                result = await send(deployment.name)
+            except RateLimitError as e:
+                self.backoff(deployment, retry_after_seconds(e))
+                if attempt == self.max_attempts - 1:
+                    raise
+                logging.warning("Rate limit exceeded on model %s, retrying (attempt %d)", deployment.name, attempt + 1)
+                continue
+            except TRANSIENT_ERRORS as e:
+                self.backoff(deployment, None, throttled=False)
+                if attempt == self.max_attempts - 1:
+                    raise
+                logging.warning("Request to model %s failed, retrying (attempt %d): %s", deployment.name, attempt + 1, e)
+                continue
+            self.succeeded(deployment)
+            return result
+
+    def stats(self) -> dict[str, object]:
+        return {
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "cooling_down": [d.name for d in self.deployments if d.cooldown_until > time.monotonic()],
+        }
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, Optional
+
+import numpy as np
+from azure.search.documents.aio import SearchClient
+from azure.search.documents.models import VectorizedQuery
+
+from core.bm25 import TEXT_FIELDS
+from core.telemetry import sampled
+from core.vectorsettings import VectorSettings
+from core.vectorstore import VECTOR_FIELDS, LocalVectorStore
+
+logger = logging.getLogger(__name__)
+
+RRF_K = 60
+# Fusion weight of each ranked list: BM25 over the question and answer text, and the two vector fields
+DEFAULT_FIELD_WEIGHTS = {"question": 1.0, "answer": 1.0, "question_vector": 1.0, "answer_vector": 1.0}
+
+
+def parse_field_weights(value: Optional[str]) -> dict[str, float]:
+    """Parses "question=1,answer=0.5,..." into fusion weights; fields that are not given keep their default."""
+    weights = dict(DEFAULT_FIELD_WEIGHTS)
+    for item in (value or "").split(","):
+        if item.strip():
+            field, weight = item.split("=")
+            if field.strip() not in weights:
+                raise ValueError(f"Unknown field in fusion weights: {field}")
+            weights[field.strip()] = float(weight)
+    return weights
+
+
+class Retriever(ABC):
+    """
+    The retrieval step of the chat approach: returns the top documents for a question embedding and its keywords.
+    Each hit is a document dict with at least id, question and answer, best first.
+    """
+
+    @abstractmethod
+    async def search(self, embedding: list[float], search_text: str, top: int) -> list[dict[str, Any]]:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+class AzureSearchRetriever(Retriever):
+    """
+    Hybrid search on Azure AI Search: the keywords plus one vector query per vector field of the index.
+    The query embedding is cut to the dimensions of the index; oversampling and rescoring of a quantized index are
+    applied by the service with the defaults set when the index was created.
+    At DEBUG level, log_sample_rate of the searches are logged as one JSON record with the ids and scores of the hits.
+    """
+
+    def __init__(
+        self,
+        search_client: SearchClient,
+        vector_settings: Optional[VectorSettings] = None,
+        log_sample_rate: float = 0.01,
+    ):
+        # The client is owned by the app's SearchClientRegistry, which closes it
+        self.search_client = search_client
+        self.vector_settings = vector_settings or VectorSettings()
+        self.log_sample_rate = log_sample_rate
+
+    async def search(self, embedding: list[float], search_text: str, top: int) -> list[dict[str, Any]]:
+        vector = self.vector_settings.truncate(embedding)
+        vector_queries = [
+            VectorizedQuery(vector=vector, k_nearest_neighbors=top, fields=field) for field in self.vector_settings.fields
+        ]
+        item_paged = await self.search_client.search(
+            vector_queries=vector_queries,
+            search_text=search_text,
+            top=top,
+        )
+        results: list[dict] = []
+        async for item in item_paged:
+            results.append(item)
+        if sampled(logger, self.log_sample_rate):
+            # 検索結果の本文はサイズが大きいため、ID とスコアだけをログに残す
+            hits = [{"id": item["id"], "score": item.get("@search.score")} for item in results]
+            logger.debug("search %s", json.dumps({"search_text": search_text, "top": top, "hits": hits}, ensure_ascii=False))
+        return results
+
+
+class LocalVectorRetriever(Retriever):
+    """
+    Hybrid search over a LocalVectorStore in this process, for offline runs and benchmarks.
+    BM25 over the question and answer text (when the store has a BM25 index) and cosine top-k over each vector field
+    give four ranked lists, which are fused by weighted reciprocal rank. Scoring runs in a worker thread so the event
+    loop is not blocked by the matrix product.
+    Attributes:
+        store (LocalVectorStore): The documents, their memory-mapped vectors and the BM25 index.
+        nprobe (int): IVF clusters scored per query, or None for exact search.
+        field_weights (dict): Fusion weight per ranked list; a weight of 0 skips that list.
+        candidates (int): Length of each ranked list before fusion.
+    """
+
+    def __init__(
+        self,
+        store: LocalVectorStore,
+        nprobe: Optional[int] = None,
+        field_weights: Optional[dict[str, float]] = None,
+        candidates: int = 50,
+    ):
+        self.store = store
+        self.nprobe = nprobe
+        self.field_weights = field_weights or dict(DEFAULT_FIELD_WEIGHTS)
+        self.candidates = candidates
+
+    @classmethod
+    def from_path(cls, directory: str, **kwargs) -> "LocalVectorRetriever":
+        return cls(LocalVectorStore(directory), **kwargs)
+
+    async def search(self, embedding: list[float], search_text: str, top: int) -> list[dict[str, Any]]:
+        return await asyncio.to_thread(self.search_sync, embedding, search_text, top)
+
+    def search_sync(self, embedding: list[float], search_text: str, top: int) -> list[dict[str, Any]]:
+        rows, scores = self.rank(self.ranked_lists(embedding, search_text, max(top, self.candidates)), top)
+        return [{**self.store.documents[row], "@search.score": score} for row, score in zip(rows.tolist(), scores.tolist())]
+
+    def ranked_lists(self, embedding: list[float], search_text: str, k: int) -> dict[str, np.ndarray]:
+        """Returns the top k rows of every list with a non-zero weight, best first."""
+        lists = {}
+        if self.store.bm25 is not None and search_text and search_text != "*":
+            for field in TEXT_FIELDS:
+                if self.field_weights.get(field):
+                    lists[field], _ = self.store.bm25.search(search_text, field, k)
+        for field in VECTOR_FIELDS:
+            if self.field_weights.get(field):
+                lists[field], _ = self.store.search(embedding, field, k, self.nprobe)
+        return lists
+
+    def rank(self, lists: dict[str, np.ndarray], top: int, field_weights: Optional[dict[str, float]] = None):
+        """Fuses ranked lists by weighted reciprocal rank and returns (rows, fused scores) of the top rows."""
+        field_weights = field_weights or self.field_weights
+        lists = {field: rows for field, rows in lists.items() if len(rows) and field_weights.get(field)}
+        if not lists:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        rows = np.concatenate(list(lists.values()))
+        contributions = np.concatenate(
+            [field_weights[field] / (RRF_K + 1 + np.arange(len(ranked))) for field, ranked in lists.items()]
+        )
+        unique_rows, inverse = np.unique(rows, return_inverse=True)
+        fused = np.bincount(inverse, weights=contributions)
+        # Ties keep the lower row first, so results are deterministic
+        best = np.argsort(-fused, kind="stable")[:top]
+        return unique_rows[best], fused[best]
@@ -0,0 +1,68 @@
+from typing import Optional, Union
+
+import aiohttp
+from azure.core.credentials import AzureKeyCredential
+from azure.core.credentials_async import AsyncTokenCredential
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.search.documents.aio import SearchClient
+
+
+class SearchClientRegistry:
+    """
+    A per-worker registry of long-lived Azure AI Search clients that share one pooled HTTP session.
+    Attributes:
+        endpoint (str): The Azure AI Search endpoint.
+        credential: The key or token credential used by every client.
+        pool_size (int): Maximum number of open connections kept by the shared connection pool.
+        keepalive_timeout (float): Seconds an idle connection is kept open for reuse.
+        transport_kwargs: Connection settings passed to each client's transport (e.g. connection_timeout).
+    Methods:
+        get(self, index_name: str): Returns the client for an index, creating it on first use.
+        close(self): Closes every client and the shared session. Call once on worker shutdown.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        credential: Union[AzureKeyCredential, AsyncTokenCredential],
+        pool_size: int = 100,
+        keepalive_timeout: float = 30.0,
+        **transport_kwargs,
+    ):
+        self.endpoint = endpoint
+        self.credential = credential
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.transport_kwargs = transport_kwargs
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._clients: dict[str, SearchClient] = {}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # The session binds to the running event loop, so it is created on first use rather than in __init__
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    def get(self, index_name: str) -> SearchClient:
+        if index_name not in self._clients:
+            transport = AioHttpTransport(session=self._get_session(), session_owner=False, **self.transport_kwargs)
+            self._clients[index_name] = SearchClient(
+                endpoint=self.endpoint,
+                index_name=index_name,
+                credential=self.credential,
+                transport=transport,
+            )
+        return self._clients[index_name]
+
+    async def close(self):
+        for client in self._clients.values():
+            await client.close()
+        self._clients.clear()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -0,0 +1,43 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable
+
+from core.telemetry import stage
+
+
+class StagedExecutor:
+    """
+    Runs the stages of a single request and records how long each one took.
+    Every stage also runs in its own span and is observed in the chat_stage_duration_seconds histogram.
+    Attributes:
+        overlap (bool): Whether independent stages passed to `gather` run concurrently. When False they run one after
+            another in the given order, which is useful for comparing against the overlapped pipeline.
+        timings (dict): Elapsed seconds per stage name, in completion order.
+    Methods:
+        run(self, name: str, awaitable: Awaitable): Awaits a single stage and records its duration.
+        run_in_thread(self, name: str, func: Callable, *args): Runs a CPU-bound stage in the default thread pool.
+        gather(self, *stages: Awaitable): Runs independent stages and returns their results in order.
+    """
+
+    def __init__(self, overlap: bool = True):
+        self.overlap = overlap
+        self.timings: dict[str, float] = {}
+
+    async def run(self, name: str, awaitable: Awaitable) -> Any:
+        start = time.perf_counter()
+        try:
+            with stage(name):
+                return await awaitable
+        finally:
+            self.timings[name] = time.perf_counter() - start
+
+    async def run_in_thread(self, name: str, func: Callable, *args) -> Any:
+        return await self.run(name, asyncio.to_thread(func, *args))
+
+    async def gather(self, *stages: Awaitable) -> list[Any]:
+        if self.overlap:
+            return list(await asyncio.gather(*stages))
+        return [await stage for stage in stages]
+
+    def format_timings(self) -> str:
+        return ", ".join(f"{name}={elapsed * 1000:.1f}ms" for name, elapsed in self.timings.items())
@@ -0,0 +1,74 @@
+import contextvars
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+from importlib.metadata import entry_points
+from typing import Iterator, Optional
+
+from opentelemetry import trace
+
+from core.metrics import REGISTRY, Counter, Histogram
+
+tracer = trace.get_tracer("chat")
+
+STAGE_SECONDS = REGISTRY.register(
+    Histogram("chat_stage_duration_seconds", "Duration of each stage of the chat requests.", ("stage",))
+)
+REQUEST_SECONDS = REGISTRY.register(
+    Histogram(
+        "chat_request_duration_seconds",
+        "Duration of the chat requests until the answer is returned or starts streaming, by how they were answered.",
+        ("outcome",),
+    )
+)
+TOKENS = REGISTRY.register(Counter("chat_tokens_total", "Tokens sent to and received from the models, per stage.", ("stage", "kind")))
+
+# Name of the stage the current task is running, so token counts are attributed to it
+_current_stage: contextvars.ContextVar[str] = contextvars.ContextVar("chat_stage", default="none")
+
+
+@contextmanager
+def stage(name: str) -> Iterator[trace.Span]:
+    """Runs one stage of a request in its own span and observes its duration in chat_stage_duration_seconds."""
+    token = _current_stage.set(name)
+    start = time.perf_counter()
+    try:
+        with tracer.start_as_current_span(name) as span:
+            yield span
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=name)
+        _current_stage.reset(token)
+
+
+def record_tokens(kind: str, count: int, span: Optional[trace.Span] = None, stage_name: Optional[str] = None) -> None:
+    """Tags the span (the current one by default) with a token count and adds it to chat_tokens_total."""
+    (span or trace.get_current_span()).set_attribute(f"tokens.{kind}", count)
+    TOKENS.inc(count, stage=stage_name or _current_stage.get(), kind=kind)
+
+
+def sampled(logger: logging.Logger, rate: float) -> bool:
+    """Whether to write a debug record: only when the logger is at DEBUG, and then for `rate` of the calls."""
+    return logger.isEnabledFor(logging.DEBUG) and random.random() < rate
+
+
+def configure_tracing() -> None:
+    """
+    Exports the spans with the exporter named by OTEL_TRACES_EXPORTER (e.g. console, or otlp when
+    opentelemetry-exporter-otlp is installed). The service name and sampler follow the standard OTEL_SERVICE_NAME,
+    OTEL_RESOURCE_ATTRIBUTES and OTEL_TRACES_SAMPLER settings. Without an exporter the spans are no-ops.
+    """
+    exporter_name = os.getenv("OTEL_TRACES_EXPORTER", "none")
+    if exporter_name == "none":
+        return
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+    exporters = {entry_point.name: entry_point for entry_point in entry_points(group="opentelemetry_traces_exporter")}
+    if exporter_name not in exporters:
+        raise ValueError(f"Unknown OTEL_TRACES_EXPORTER: {exporter_name}. Installed exporters: {', '.join(exporters)}")
+    provider = TracerProvider(resource=Resource.create())
+    provider.add_span_processor(BatchSpanProcessor(exporters[exporter_name].load()()))
+    trace.set_tracer_provider(provider)
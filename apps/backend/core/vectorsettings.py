@@ -0,0 +1,61 @@
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from core.vectorstore import VECTOR_FIELDS
+
+# Native length of text-embedding-3-large embeddings
+EMBEDDING_DIMENSIONS = 3072
+COMPRESSIONS = ("none", "scalar", "binary")
+
+
+@dataclass
+class VectorSettings:
+    """
+    How the question and answer embeddings are stored in the Azure AI Search index and queried.
+    The index schema (indexing/modules/search.py), the documents uploaded to it and the queries of AzureSearchRetriever
+    are built from the same settings, so an index has to be recreated when they change.
+    Attributes:
+        fields (tuple): Vector fields stored per document: both, or only one of them.
+        dimensions (int): Length of the stored vectors. Shorter vectors are prefixes of the embeddings, normalized to
+            unit length again, which keeps the ranking of models trained for it (text-embedding-3).
+        compression (str): Quantization of the vector index: none, scalar (int8) or binary (1 bit per dimension).
+        oversampling (float): Candidates fetched from the quantized index per requested result, before rescoring.
+        rescore (bool): Rescores the oversampled candidates with the full-precision vectors.
+    Methods:
+        from_env(cls): Reads the AZURE_AI_SEARCH_VECTOR_* settings.
+        truncate(self, embedding): Returns an embedding cut to `dimensions` and renormalized.
+    """
+
+    fields: tuple[str, ...] = VECTOR_FIELDS
+    dimensions: int = EMBEDDING_DIMENSIONS
+    compression: str = "none"
+    oversampling: float = 10.0
+    rescore: bool = True
+
+    def __post_init__(self):
+        unknown = [field for field in self.fields if field not in VECTOR_FIELDS]
+        if unknown or not self.fields:
+            raise ValueError(f"Vector fields must be one or both of {', '.join(VECTOR_FIELDS)}, got: {', '.join(self.fields)}")
+        if self.compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown vector compression: {self.compression}. Use one of {', '.join(COMPRESSIONS)}")
+        if not 0 < self.dimensions <= EMBEDDING_DIMENSIONS:
+            raise ValueError(f"Vector dimensions must be between 1 and {EMBEDDING_DIMENSIONS}, got {self.dimensions}")
+
+    @classmethod
+    def from_env(cls) -> "VectorSettings":
+        return cls(
+            fields=tuple(field.strip() for field in os.getenv("AZURE_AI_SEARCH_VECTOR_FIELDS", ",".join(VECTOR_FIELDS)).split(",") if field.strip()),
+            dimensions=int(os.getenv("AZURE_AI_SEARCH_VECTOR_DIMENSIONS", str(EMBEDDING_DIMENSIONS))),
+            compression=os.getenv("AZURE_AI_SEARCH_VECTOR_COMPRESSION", "none"),
+            oversampling=float(os.getenv("AZURE_AI_SEARCH_VECTOR_OVERSAMPLING", "10")),
+            rescore=os.getenv("AZURE_AI_SEARCH_VECTOR_RESCORE", "true").lower() == "true",
+        )
+
+    def truncate(self, embedding: Optional[list[float]]) -> Optional[list[float]]:
+        if not embedding or len(embedding) <= self.dimensions:
+            return embedding
+        vector = np.asarray(embedding[: self.dimensions], dtype=np.float64)
+        return (vector / max(float(np.linalg.norm(vector)), 1e-12)).tolist()
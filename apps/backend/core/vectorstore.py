@@ -0,0 +1,204 @@
+import json
+import os
+from typing import Optional
+
+import numpy as np
+
+from core.bm25 import Bm25Index
+
+VECTOR_FIELDS = ("question_vector", "answer_vector")
+
+
+class LocalVectorStore:
+    """
+    A file-backed store of the Q&A documents and their vectors for local retrieval.
+    The directory holds `documents.jsonl` (one document per line without vectors), one raw row-major float32 file per
+    vector field (`question_vector.f32`, `answer_vector.f32`) that is memory-mapped for search, `meta.json` with the
+    dimensions and document count, and optionally `ivf_<field>.npz` inverted-file indexes built by `build_ivf` and the
+    `bm25.npz` keyword index built by `build_bm25`. Both are dropped by `append` and have to be rebuilt.
+    Attributes:
+        directory (str): Location of the store.
+        dimensions (int): Vector dimensions.
+        documents (list): Documents in row order.
+        vectors (dict): Read-only memory-mapped matrix per vector field.
+        bm25 (Bm25Index): Keyword index over the question and answer text, or None.
+    Methods:
+        append(self, documents: list): Appends documents with their vectors (the indexing pipeline's upload path).
+        search(self, query: list, field: str, k: int, nprobe: int = None): Top-k rows by cosine similarity.
+        build_ivf(self, nlist: int): Builds and saves an IVF index per vector field.
+        build_bm25(self): Builds and saves the BM25 index.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.dimensions: Optional[int] = None
+        self.documents: list[dict] = []
+        self.vectors: dict[str, np.ndarray] = {}
+        self.ivf: dict[str, "IvfIndex"] = {}
+        self.bm25: Optional[Bm25Index] = None
+        self._norms: dict[str, np.ndarray] = {}
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def load(self) -> None:
+        if not os.path.exists(self._path("meta.json")):
+            return
+        with open(self._path("meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.dimensions = meta["dimensions"]
+        count = meta["count"]
+        with open(self._path("documents.jsonl"), encoding="utf-8") as f:
+            self.documents = [json.loads(line) for _, line in zip(range(count), f)]
+        self._map_vectors()
+        for field in VECTOR_FIELDS:
+            if os.path.exists(self._path(f"ivf_{field}.npz")):
+                self.ivf[field] = IvfIndex.load(self._path(f"ivf_{field}.npz"))
+        if os.path.exists(self._path("bm25.npz")):
+            self.bm25 = Bm25Index.load(self._path("bm25.npz"))
+
+    def _map_vectors(self) -> None:
+        for field in VECTOR_FIELDS:
+            matrix = np.memmap(
+                self._path(f"{field}.f32"), dtype=np.float32, mode="r", shape=(len(self.documents), self.dimensions)
+            )
+            self.vectors[field] = matrix
+            # Embedding models return unit vectors, but norms are kept so that any vector source scores as cosine
+            self._norms[field] = np.maximum(np.linalg.norm(matrix, axis=1), 1e-12)
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def append(self, documents: list[dict]) -> None:
+        documents = [document for document in documents if all(document.get(field) for field in VECTOR_FIELDS)]
+        if not documents:
+            return
+        dimensions = len(documents[0][VECTOR_FIELDS[0]])
+        if self.dimensions is not None and dimensions != self.dimensions:
+            raise ValueError(f"Expected {self.dimensions}-dim vectors, got {dimensions}")
+        stored = [{k: v for k, v in document.items() if k not in VECTOR_FIELDS} for document in documents]
+        # Rows left behind by an interrupted append are cut off first, so every file stays aligned with meta.json
+        self._truncate_to_meta()
+        for field in VECTOR_FIELDS:
+            with open(self._path(f"{field}.f32"), "ab") as f:
+                f.write(np.asarray([document[field] for document in documents], dtype=np.float32).tobytes())
+        with open(self._path("documents.jsonl"), "ab") as f:
+            f.write("".join(json.dumps(document, ensure_ascii=False) + "\n" for document in stored).encode("utf-8"))
+        self.documents.extend(stored)
+        self.dimensions = dimensions
+        # meta.json is written last, so a crash mid-append leaves the previous count
+        with open(self._path("meta.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "dimensions": dimensions,
+                    "count": len(self.documents),
+                    "documents_bytes": os.path.getsize(self._path("documents.jsonl")),
+                },
+                f,
+            )
+        # The vectors are remapped on the next search, so that batched appends while indexing stay linear.
+        # The IVF and BM25 indexes do not cover the new rows and have to be rebuilt.
+        self.vectors.clear()
+        self._norms.clear()
+        self.ivf.clear()
+        self.bm25 = None
+        for name in [f"ivf_{field}.npz" for field in VECTOR_FIELDS] + ["bm25.npz"]:
+            if os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+
+    def _truncate_to_meta(self) -> None:
+        count = len(self.documents)
+        documents_bytes = 0
+        if os.path.exists(self._path("meta.json")):
+            with open(self._path("meta.json"), encoding="utf-8") as f:
+                documents_bytes = json.load(f)["documents_bytes"]
+        for name, size in [(f"{field}.f32", count * (self.dimensions or 0) * 4) for field in VECTOR_FIELDS] + [
+            ("documents.jsonl", documents_bytes)
+        ]:
+            if os.path.exists(self._path(name)) and os.path.getsize(self._path(name)) > size:
+                os.truncate(self._path(name), size)
+
+    def search(self, query: list[float], field: str, k: int, nprobe: Optional[int] = None) -> tuple[np.ndarray, np.ndarray]:
+        """Returns (row indexes, cosine similarities) of the top k rows, best first."""
+        if not self.documents:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if not self.vectors:
+            self._map_vectors()
+        # Stores written with AZURE_AI_SEARCH_VECTOR_DIMENSIONS hold prefixes of the embeddings, so the query is cut alike
+        q = np.asarray(query, dtype=np.float32)[: self.dimensions]
+        q = q / max(float(np.linalg.norm(q)), 1e-12)
+        if nprobe and field in self.ivf:
+            rows = self.ivf[field].candidates(q, nprobe)
+            scores = (self.vectors[field][rows] @ q) / self._norms[field][rows]
+        else:
+            rows = None
+            scores = (self.vectors[field] @ q) / self._norms[field]
+        k = min(k, len(scores))
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return (top if rows is None else rows[top]), scores[top]
+
+    def build_ivf(self, nlist: int, iterations: int = 10, sample_size: int = 50000, seed: int = 0) -> None:
+        if not self.vectors:
+            self._map_vectors()
+        for field in VECTOR_FIELDS:
+            index = IvfIndex.train(self.vectors[field], self._norms[field], nlist, iterations, sample_size, seed)
+            index.save(self._path(f"ivf_{field}.npz"))
+            self.ivf[field] = index
+
+    def build_bm25(self) -> None:
+        self.bm25 = Bm25Index.build(self.documents)
+        self.bm25.save(self._path("bm25.npz"))
+
+
+class IvfIndex:
+    """
+    An inverted-file index: k-means centroids over the unit vectors, and the rows of each cluster stored contiguously
+    (`rows[offsets[c]:offsets[c + 1]]`). A query scores only the rows of its `nprobe` nearest clusters.
+    """
+
+    def __init__(self, centroids: np.ndarray, rows: np.ndarray, offsets: np.ndarray):
+        self.centroids = centroids
+        self.rows = rows
+        self.offsets = offsets
+
+    @classmethod
+    def train(cls, matrix: np.ndarray, norms: np.ndarray, nlist: int, iterations: int, sample_size: int, seed: int):
+        rng = np.random.default_rng(seed)
+        count = len(matrix)
+        nlist = max(1, min(nlist, count))
+        sample = np.sort(rng.choice(count, size=min(sample_size, count), replace=False))
+        data = matrix[sample] / norms[sample, None]
+        centroids = data[rng.choice(len(data), size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            # Spherical k-means: assign by cosine similarity, then renormalize the cluster means
+            assignments = np.argmax(data @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = data[assignments == c]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    centroids[c] = centroid / max(float(np.linalg.norm(centroid)), 1e-12)
+        assignments = np.empty(count, dtype=np.int64)
+        for start in range(0, count, 8192):
+            block = matrix[start : start + 8192] / norms[start : start + 8192, None]
+            assignments[start : start + 8192] = np.argmax(block @ centroids.T, axis=1)
+        rows = np.argsort(assignments, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=nlist))])
+        return cls(centroids.astype(np.float32), rows, offsets)
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        nprobe = min(nprobe, len(self.centroids))
+        nearest = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.sort(np.concatenate([self.rows[self.offsets[c] : self.offsets[c + 1]] for c in nearest]))
+
+    def save(self, path: str) -> None:
+        np.savez(path, centroids=self.centroids, rows=self.rows, offsets=self.offsets)
+
+    @classmethod
+    def load(cls, path: str) -> "IvfIndex":
+        with np.load(path) as data:
+            return cls(data["centroids"], data["rows"], data["offsets"])
@@ -1,4 +1,12 @@
+import gc
 import multiprocessing
+import os
+
+from dotenv import load_dotenv
+from uvicorn.workers import UvicornWorker
+
+# Same settings as main.py, which is imported only after this file
+load_dotenv()
 
 max_requests = 1000
 max_requests_jitter = 50
@@ -8,6 +16,33 @@ bind = "0.0.0.0"
 timeout = 230
 # https://learn.microsoft.com/en-us/troubleshoot/azure/app-service/web-apps-performance-faqs#why-does-my-request-time-out-after-230-seconds
 
+# Requests spend almost all their time waiting on Azure OpenAI and Azure AI Search, and every async worker serves
+# many of them at once, so one worker per CPU keeps the CPUs busy; more workers only add memory, startup time and
+# connection pools. Compare configurations with benchmarks/bench_load.py
 num_cpus = multiprocessing.cpu_count()
-workers = (num_cpus * 2) + 1
-worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.getenv("GUNICORN_WORKERS", str(num_cpus)))
+# Concurrent connections per worker; beyond it new requests get a 503 instead of queueing without bound
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+
+# Load the app in the master before forking, so the imported modules and the read-only state loaded by create_app
+# (keyword idf table, local vector store, tiktoken encoding) are shared copy-on-write by the workers.
+# Clients, caches and connection pools are still created per worker, when it starts serving (setup_clients).
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+
+class AsyncUvicornWorker(UvicornWorker):
+    """The Uvicorn worker with worker_connections as its concurrency limit, which UvicornWorker does not apply."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.config.limit_concurrency = self.cfg.worker_connections
+
+
+worker_class = AsyncUvicornWorker
+
+
+def when_ready(server):
+    # Called before the first workers are forked. Objects loaded in the master are never freed, so moving them out of
+    # the collector's reach keeps collections in the workers from writing to (and so copying) the shared pages
+    if preload_app:
+        gc.freeze()
@@ -0,0 +1,43 @@
+import os
+import sys
+import csv
+from datetime import datetime
+
+# The idf table is read by the chat backend, so the tokenizer is shared from apps/backend/core
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.keywords import IdfTable
+
+def iter_documents(file_path: str):
+    """
+    Yields one document per Q&A record (question and answer text) of a cleansed CSV file.
+    Records labeled with "SKIPPED" in data cleaning are left out, as in indexing.py.
+    """
+    with open(file_path, 'r', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            description = row['description']
+            comments_and_work_notes = row['comments_and_work_notes']
+            if description == "SKIPPED" or comments_and_work_notes == "SKIPPED":
+                continue
+            yield description + "\n" + comments_and_work_notes
+
+def main():
+    """
+    CLI Usage:
+    python indexing/build_idf.py -f <file_path> -o <output_path>
+    -f: Path to the cleansed CSV file (output of cleansing.py).
+    -o: Path of the idf table to write (default: keyword_idf.npz next to the input file).
+    """
+    start_time = datetime.now()
+
+    file_path = sys.argv[2].strip()
+    output_path = sys.argv[4].strip() if len(sys.argv) > 4 else os.path.join(os.path.dirname(file_path), 'keyword_idf.npz')
+
+    print(f"Building idf table from: {file_path}")
+    idf_table = IdfTable.build(iter_documents(file_path))
+    idf_table.save(output_path)
+    print(f"Documents: {idf_table.num_documents}, terms: {len(idf_table.terms)}")
+    print(f"Output file: {output_path} ({os.path.getsize(output_path)} bytes)")
+    print(f"Elapsed time: {datetime.now() - start_time}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+import os
+import sys
+from datetime import datetime
+
+# The local vector store is read by the chat backend, so it is shared from apps/backend/core
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.vectorstore import LocalVectorStore
+
+def main():
+    """
+    CLI Usage:
+    python indexing/build_local_index.py -d <store_dir> -n <nlist>
+    -d: Directory of the local vector store filled by indexing.py (LOCAL_VECTOR_STORE_DIR).
+    -n: Number of IVF clusters (default: about 4 * sqrt(number of documents)).
+    Builds the BM25 keyword index and the IVF vector index of the store.
+    Set LOCAL_VECTOR_STORE_NPROBE in .env to the number of clusters scored per query.
+    """
+    start_time = datetime.now()
+
+    store_dir = sys.argv[2].strip()
+    store = LocalVectorStore(store_dir)
+    if len(store) == 0:
+        print(f"Error: No documents in {store_dir}. Run indexing.py with LOCAL_VECTOR_STORE_DIR set first.")
+        sys.exit(1)
+    nlist = int(sys.argv[4].strip()) if len(sys.argv) > 4 else max(1, int(4 * len(store) ** 0.5))
+
+    print(f"Building BM25 index for {len(store)} documents in: {store_dir}")
+    store.build_bm25()
+    print(f"Vocabulary: {len(store.bm25.terms)} terms")
+    print(f"Building IVF index with {nlist} clusters for {len(store)} documents in: {store_dir}")
+    store.build_ivf(nlist)
+    print(f"Elapsed time: {datetime.now() - start_time}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import os
+import sys
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+# modules.cleansecache normalizes text like the embedding cache in apps/backend/core
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.cleansecache import CleanseCache, hash_text
+
+PROMPT_FILES = [
+    'indexing/prompts_txt/for_description.txt',
+    'indexing/prompts_txt/for_comments_and_work_notes.txt',
+]
+
+def print_stats(cache: CleanseCache, current_prompt_hashes: dict[str, str]):
+    stats = cache.stats()
+    print(f"Cache file: {cache.path} ({stats['file_bytes'] / 1e6:.1f} MB)")
+    print(f"Entries: {stats['entries']}")
+    for group in stats['groups']:
+        prompt = current_prompt_hashes.get(group['prompt_hash'], 'outdated prompt')
+        print(
+            f"  {group['prompt_hash'][:12]} ({prompt}) {group['deployment']}: {group['entries']} entries, "
+            f"{group['hits']} hits, {group['output_bytes'] / 1e6:.1f} MB of output, "
+            f"last used {datetime.fromtimestamp(group['newest_use']).strftime('%Y-%m-%d %H:%M:%S')}"
+        )
+
+def main():
+    """
+    CLI Usage:
+    python indexing/cleanse_cache.py -s
+    python indexing/cleanse_cache.py -c <max_age_days>
+    -s: Show the entries of the cleanse cache (CLEANSE_CACHE_PATH) per prompt and deployment.
+    -c: Compact the cache: delete the entries of prompts that are no longer in prompts_txt and, if max_age_days is
+        given, the entries not used for that many days, then shrink the file.
+    """
+    load_dotenv()
+    cache = CleanseCache(os.getenv("CLEANSE_CACHE_PATH", "indexing/output_csv/cleanse_cache.sqlite3"))
+    prompts = {}
+    for prompt_file in PROMPT_FILES:
+        with open(prompt_file, 'r') as f:
+            prompts[prompt_file] = f.read()
+    current_prompt_hashes = {hash_text(prompt): os.path.basename(prompt_file) for prompt_file, prompt in prompts.items()}
+
+    exec_type = sys.argv[1].strip() if len(sys.argv) > 1 else ""
+    if exec_type == "-s":
+        print_stats(cache, current_prompt_hashes)
+    elif exec_type == "-c":
+        max_age_days = float(sys.argv[2].strip()) if len(sys.argv) > 2 else None
+        bytes_before = cache.stats()['file_bytes']
+        deleted = cache.compact(keep_prompts=list(prompts.values()), max_age_days=max_age_days)
+        print(f"Deleted {deleted} entries. File size: {bytes_before / 1e6:.1f} MB -> {cache.stats()['file_bytes'] / 1e6:.1f} MB")
+    else:
+        print("Invalid option. Please specify one of the following options: -s, -c")
+        sys.exit(1)
+    cache.close()
+
+if __name__ == '__main__':
+    main()
@@ -1,48 +1,92 @@
 import os
 import csv
 import sys
+import asyncio
 from datetime import datetime
-import concurrent.futures
+from typing import Iterator, Optional
 
-from modules.record import create_record_from_row, Record
-from modules.prompt import cleanse_record
+# The rate-limit scheduler is shared with the chat backend from apps/backend/core
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.record import create_record_from_row, read_records, Record
+from modules.prompt import cleanse_record, cleanse_cache
+from modules.checkpoint import CleansingCheckpoint, iter_rows_with_offsets, read_csv_header
+from modules.columnar import ColumnarWriter
 
-def get_csv_headers(file_path, encoding='utf-8'):
+# The source CSV files are exported from the incident management system in Shift-JIS
+INPUT_ENCODING = 'shift-jis'
+# Records a worker may run ahead of the oldest unfinished one; bounds the reorder buffer
+REORDER_WINDOW_PER_WORKER = 8
+PROGRESS_INTERVAL = 100
+
+def skip_rows_before(rows: Iterator[tuple[int, int, dict]], start_line: int, checkpoint: CleansingCheckpoint):
     """
-    Reads a CSV file and returns the list of column names (headers).
-    
-    :param file_path: Path to the CSV file.
-    :param encoding: Encoding of the CSV file (default is 'utf-8').
-    :return: List of column names.
+    Leave out the rows before start_line (-s); they count as done, so the checkpoint starts after them.
     """
-    try:
-        with open(file_path, mode='r', encoding=encoding) as file:
-            csv_reader = csv.reader(file)
-            headers = next(csv_reader)  # Read the first row as headers
-            return headers
-    except Exception as e:
-        print(f"Error reading CSV file: {e}")
-        return []
-
-def batch_cleanse_records(records):
+    for line_number, end_offset, row in rows:
+        if line_number < start_line:
+            checkpoint.offset, checkpoint.line = end_offset, line_number + 1
+            continue
+        yield line_number, end_offset, row
+
+async def cleanse_rows(rows: Iterator[tuple[int, int, dict]], fieldnames: list[str], writer: csv.DictWriter, output_file, checkpoint: CleansingCheckpoint, concurrency: int, start_time: datetime):
     """
-    Cleanse each record in a given list of records in parallel using threads.
+    Cleanse records with a long-lived pool of async workers and write them in input order.
+    A worker takes the next record as soon as it is done with one, so a slow record only holds up its own worker
+    instead of a whole batch. Records that finish early wait in a reorder buffer until every record before them is
+    written, and the checkpoint moves past each record as it is written.
     """
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        future_to_index = {executor.submit(cleanse_record, record): index for index, record in enumerate(records)}
-        results: list[Record] = [None] * len(records)
-        for future in concurrent.futures.as_completed(future_to_index):
-            index = future_to_index[future]
-            results[index] = future.result()
-    return results
-
-def batch_write_records(records: list[Record], writer: csv.DictWriter):
+    pending: asyncio.Queue = asyncio.Queue(concurrency)
+    # Line number -> (byte offset after the row, cleansed record or None if it was already written)
+    finished: dict[int, tuple[int, Optional[Record]]] = {}
+    window = asyncio.Semaphore(concurrency * REORDER_WINDOW_PER_WORKER)
+
+    def write_in_order():
+        while checkpoint.line in finished:
+            end_offset, record = finished.pop(checkpoint.line)
+            if record is not None:
+                writer.writerow(record.to_dict())
+                output_file.flush()
+            checkpoint.advance(end_offset, checkpoint.line + 1, output_file.tell())
+            window.release()
+            if (checkpoint.line - 1) % PROGRESS_INTERVAL == 0:
+                print(f"Processed lines up to: {checkpoint.line - 1} (Elapsed time: {datetime.now() - start_time})")
+
+    async def read():
+        for line_number, end_offset, row in rows:
+            await window.acquire()
+            if line_number in checkpoint.completed:
+                finished[line_number] = (end_offset, None)
+                write_in_order()
+            else:
+                await pending.put((line_number, end_offset, create_record_from_row(row)))
+        for _ in range(concurrency):
+            await pending.put(None)
+
+    async def work():
+        while (item := await pending.get()) is not None:
+            line_number, end_offset, record = item
+            finished[line_number] = (end_offset, await cleanse_record(record))
+            write_in_order()
+
+    tasks = [asyncio.create_task(read())] + [asyncio.create_task(work()) for _ in range(concurrency)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def write_columnar_copy(csv_path: str, compression: str) -> str:
     """
-    Write a batch of records to the CSV file using the provided writer.
+    Writes the cleansed CSV again as an Arrow file with the document keys (modules/columnar.py), which indexing.py
+    reads without parsing CSV. The CSV stays the output that checkpoints resume.
     """
-    results = batch_cleanse_records(records)
-    for result in results:
-        writer.writerow(result.__dict__)
+    columnar_path = os.path.splitext(csv_path)[0] + '.arrow'
+    writer = ColumnarWriter(columnar_path, compression=compression)
+    with open(csv_path, mode='r', newline='', encoding='utf-8') as file:
+        for line_number, record in read_records(file):
+            writer.write(line_number, record)
+    writer.close()
+    return columnar_path
 
 def main():
     """
@@ -51,56 +95,72 @@ def main():
     -f: Path to the input CSV file.
     -o: Path to the directory to save the output CSV file.
     -s: Line number to start processing from (default is 1).
+    Progress is saved in <output file>.checkpoint.json after every record. Running the same command again after an
+    interruption resumes from the checkpoint: the input is read from the saved byte offset and records that are
+    already written are skipped. -s ignores the checkpoint and starts over from the given line.
+    CLEANSING_CONCURRENCY sets the number of records cleansed at once (default 16).
+    CLEANSING_OUTPUT_FORMAT=arrow also writes the finished output as updated_<name>.arrow for indexing.py, compressed
+    with COLUMNAR_COMPRESSION (zstd, lz4 or none; default zstd). Needs pyarrow.
     """
     start_time = datetime.now()
 
     file_path = sys.argv[2].strip()
     output_dir = sys.argv[4].strip() if len(sys.argv) > 4 else os.path.dirname(file_path)
-    start_line = int(sys.argv[6].strip()) if len(sys.argv) > 6 else 1
-    BATCH_SIZE_FOR_RECORDS = 100
+    start_line = int(sys.argv[6].strip()) if len(sys.argv) > 6 else None
+    concurrency = int(os.getenv("CLEANSING_CONCURRENCY", "16"))
+    output_format = os.getenv("CLEANSING_OUTPUT_FORMAT", "csv")
 
-    # Validate start_line
-    if (start_line - 1) % BATCH_SIZE_FOR_RECORDS != 0:
-        print(f"Error: start_line must be a multiple of {BATCH_SIZE_FOR_RECORDS} plus 1 (e.g., 1, 101, 201, ...).")
-        sys.exit(1)
     output_file_path = os.path.join(output_dir, 'updated_' + os.path.basename(file_path))
+    checkpoint_path = output_file_path + '.checkpoint.json'
+    checkpoint = CleansingCheckpoint.load(checkpoint_path) if start_line is None else None
+    if checkpoint is not None and (not checkpoint.matches(file_path) or not os.path.exists(output_file_path)):
+        print(f"Error: {checkpoint_path} belongs to another input file or its output is missing. Delete it to start over.")
+        sys.exit(1)
     print(f"Processing file: {file_path}")
     print(f"Output file: {output_file_path}")
-    print(f"Starting from line: {start_line}")
+    if checkpoint is not None:
+        print(f"Resuming from line: {checkpoint.line} ({len(checkpoint.completed)} records after it already done)")
+    else:
+        print(f"Starting from line: {start_line or 1}")
     print("=====================================")
 
     print(f"Processing started at: {start_time.strftime('%Y-%m-%d %H:%M:%S')}")
-    mode = 'a' if start_line > 1 else 'w'
-    with open(output_file_path, mode=mode, newline='', encoding='utf-8') as output_file:
-        writer = csv.DictWriter(output_file, fieldnames=get_csv_headers(file_path, encoding='shift-jis'))
-        if start_line == 1:
-            writer.writeheader()
-
-        with open(file_path, mode='r', encoding='shift-jis', errors='ignore') as file:
-            csv_reader = csv.DictReader(file)
-            records = []
+    with open(file_path, mode='rb') as file:
+        fieldnames = read_csv_header(file, INPUT_ENCODING)
+        if checkpoint is not None:
+            # Rows written after the last save are not in the checkpoint, so they are dropped and cleansed again
+            with open(output_file_path, mode='r+b') as output_file:
+                output_file.truncate(checkpoint.output_bytes)
+            file.seek(checkpoint.offset)
+        else:
+            checkpoint = CleansingCheckpoint(checkpoint_path, os.path.basename(file_path), os.path.getsize(file_path), file.tell())
+
+        mode = 'a' if checkpoint.output_bytes or (start_line or 1) > 1 else 'w'
+        with open(output_file_path, mode=mode, newline='', encoding='utf-8') as output_file:
+            writer = csv.DictWriter(output_file, fieldnames=fieldnames)
+            if mode == 'w':
+                writer.writeheader()
+                output_file.flush()
+            checkpoint.output_bytes = output_file.tell()
+            checkpoint.save()
+
+            rows = iter_rows_with_offsets(file, fieldnames, INPUT_ENCODING, checkpoint.line)
+            if start_line is not None:
+                rows = skip_rows_before(rows, start_line, checkpoint)
             try:
-                for line_number, row in enumerate(csv_reader, start=1):
-                    if line_number < start_line:
-                        continue
-                    record = create_record_from_row(row, csv_reader.fieldnames)
-                    records.append(record)
-                    if len(records) == BATCH_SIZE_FOR_RECORDS:
-                        elapsed_time = datetime.now() - start_time
-                        print(f"Processing records {line_number - BATCH_SIZE_FOR_RECORDS + 1} to {line_number}... (Elapsed time: {elapsed_time})")
-                        batch_write_records(records, writer)
-                        print(f"Processed lines up to: {line_number}")
-                        records = []
-                # Process any remaining records
-                if records:
-                    elapsed_time = datetime.now() - start_time
-                    print(f"Processing records {line_number - BATCH_SIZE_FOR_RECORDS + 1} to {line_number}... (Elapsed time: {elapsed_time})")
-                    batch_write_records(records, writer)
+                asyncio.run(cleanse_rows(rows, fieldnames, writer, output_file, checkpoint, concurrency, start_time))
             except Exception as e:
-                print(f"Exception occurred between lines {line_number - BATCH_SIZE_FOR_RECORDS + 1} and {line_number}: {e}")
-                next_start_line = (line_number // BATCH_SIZE_FOR_RECORDS) * BATCH_SIZE_FOR_RECORDS + 1
-                print(f"Processing interrupted. Next start line: {next_start_line}")
+                print(f"Exception occurred at line {checkpoint.line}: {e}")
+                print(f"Processing interrupted. Run the same command again to resume from line {checkpoint.line}.")
                 sys.exit(1)
+            finally:
+                # The last-use times of cache hits are written in batches
+                cleanse_cache.flush()
+    checkpoint.remove()
+    if output_format == "arrow":
+        print(f"Columnar output: {write_columnar_copy(output_file_path, os.getenv('COLUMNAR_COMPRESSION', 'zstd'))}")
+    print(f"Cleanse cache: {cleanse_cache.hits} hits, {cleanse_cache.misses} misses")
+    print(f"Processing finished. Elapsed time: {datetime.now() - start_time}")
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,50 @@
+import os
+import sys
+from datetime import datetime
+
+# The embedding cache is shared with the chat backend from apps/backend/core
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.columnar import ColumnarDataset, ColumnarWriter
+from modules.embed import embed_texts
+
+BATCH_SIZE_FOR_RECORDS = 1000
+
+def main():
+    """
+    CLI Usage:
+    python indexing/embed_columnar.py -f <file.arrow>
+    -f: Arrow file written by cleansing.py (CLEANSING_OUTPUT_FORMAT=arrow).
+    Embeds the question and answer of every record and rewrites the file with the vectors, so that indexing.py
+    uploads without embedding and a restarted upload does not embed again. Texts already embedded are taken from
+    the embedding cache, so an interrupted run resumes cheaply. COLUMNAR_COMPRESSION applies as in cleansing.py.
+    """
+    start_time = datetime.now()
+
+    file_path = sys.argv[2].strip()
+    dataset = ColumnarDataset(file_path)
+    print(f"Embedding {dataset.num_rows} records of: {file_path}")
+    writer = None
+    rows = dataset.iter_records()
+    while True:
+        records = [row for _, row in zip(range(BATCH_SIZE_FOR_RECORDS), rows)]
+        if not records:
+            break
+        embeddings = embed_texts([record.description for _, record in records] + [record.comments_and_work_notes for _, record in records])
+        if writer is None:
+            dimensions = next((len(embedding) for embedding in embeddings if embedding), 0)
+            if not dimensions:
+                print("Error: No text could be embedded.")
+                sys.exit(1)
+            # Written next to the file and renamed over it once complete
+            writer = ColumnarWriter(file_path + '.embedded', compression=os.getenv('COLUMNAR_COMPRESSION', 'zstd'), dimensions=dimensions)
+        for (line_number, record), question_vector, answer_vector in zip(records, embeddings[:len(records)], embeddings[len(records):]):
+            writer.write(line_number, record, question_vector, answer_vector)
+        print(f"Embedded lines up to: {records[-1][0]} (Elapsed time: {datetime.now() - start_time})")
+    dataset.close()
+    if writer is not None:
+        writer.close()
+        os.replace(writer.path, file_path)
+    print(f"Processing finished. Elapsed time: {datetime.now() - start_time}")
+
+if __name__ == '__main__':
+    main()
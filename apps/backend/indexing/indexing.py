@@ -1,32 +1,34 @@
+import os
 import sys
-import csv
 from datetime import datetime
-import concurrent.futures
 
-from modules.record import create_record_from_row, Record
-from modules.search import initialize_index, create_document_from_record, upload_documents, check_index_exists, check_document_exists, generate_document_key
+# The embedding cache is shared with the chat backend from apps/backend/core
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.columnar import ColumnarDataset
+from modules.pipeline import IndexingPipeline
+from modules.record import INDEXING_FIELDS, read_records
+from modules.search import initialize_index, create_documents_from_records, upload_documents, check_index_exists, find_existing_document_keys, generate_document_key, bulk_uploader
 
-def batch_upload_documents(records: list[Record]) -> None:
+def iter_csv_records(file_path: str):
+    with open(file_path, 'r', encoding='utf-8', newline='') as file:
+        yield from read_records(file, INDEXING_FIELDS)
+
+def iter_records(file_path: str, start_line: int):
     """
-    Uploads a list of records to the search index using a ThreadPoolExecutor"""
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        future_to_index = {executor.submit(create_document_from_record, record): index for index, record in enumerate(records)}
-        results: list[dict] = [None] * len(records)
-        for future in concurrent.futures.as_completed(future_to_index):
-            index = future_to_index[future]
-            record = records[index]
-            if not check_document_exists(record):
-                results[index] = future.result()
-            else:
-                print(f"Skipping upload for existing document with id: {generate_document_key(record)}")
-    results = [result for result in results if result is not None]
-    if results:
-        try:
-            upload_documents(results)
-        except Exception as e:
-            raise Exception(f"Error uploading documents: {e}")
+    Yields (line number, record) for every record of the CSV or Arrow file from start_line on.
+    Only the columns indexing uses are read (see modules/record.py); an Arrow file written by cleansing.py or
+    embed_columnar.py is memory-mapped and also provides the document keys and, if stored, the vectors.
+    Records labeled with "SKIPPED" for some reason in data cleaning are left out."""
+    if file_path.endswith('.arrow'):
+        rows = ColumnarDataset(file_path).iter_records(INDEXING_FIELDS, start_line)
     else:
-        print("No new records to upload")
+        rows = iter_csv_records(file_path)
+    for line_number, record in rows:
+        if line_number < start_line:
+            continue
+        if record.description == "SKIPPED" or record.comments_and_work_notes == "SKIPPED":
+            continue
+        yield line_number, record
 
 def main():
     """
@@ -34,7 +36,7 @@ def main():
     -c, --create-index: create a new search index if it does not exist
     -u, --upload-to-existing-index: upload documents to an existing search index
     -d, --delete-index: delete existing documents in the search index
-    -f, --file: path to the file to process
+    -f, --file: path to the file to process (a cleansed CSV, or the .arrow file written by cleansing.py)
     -s, --start-line: line number to start processing from, if not specified, starts from the first line
     Example usage: 
       python indexing.py -c -f data.csv
@@ -73,35 +75,30 @@ def main():
     print(f"Starting from line: {start_line}")
     print(f"Processing started at: {start_time.strftime('%Y-%m-%d %H:%M:%S')}")
 
-    with open(file_path, 'r', encoding='utf-8') as file:
-        csv_reader = csv.DictReader(file)
-        records: list[Record] = []
-        try:
-            for line_number, row in enumerate(csv_reader, start=1):
-                if line_number < start_line:
-                    continue
-                record = create_record_from_row(row, csv_reader.fieldnames)
-                # Skip records labeled with "SKIPPED" for some reason in data cleaning
-                if record.description == "SKIPPED" or record.comments_and_work_notes == "SKIPPED":
-                    continue
-                records.append(record)
-                if len(records) == BATCH_SIZE_FOR_RECORDS:
-                    elapsed_time = datetime.now() - start_time
-                    print(f"Processing records {line_number - BATCH_SIZE_FOR_RECORDS + 1} to {line_number}... (Elapsed time: {elapsed_time})")
-                    batch_upload_documents(records)
-                    print(f"Processed lines up to: {line_number}")
-                    records = []
-            # Process any remaining records
-            if records:
-                elapsed_time = datetime.now() - start_time
-                print(f"Processing records {line_number - len(records) + 1} to {line_number}... (Elapsed time: {elapsed_time})")
-                batch_upload_documents(records)
-                print(f"Processed lines up to: {line_number}")
-        except Exception as e:
-            print(f"Exception occurred at line {line_number}: {e}")
-            next_start_line = (line_number // BATCH_SIZE_FOR_RECORDS) * BATCH_SIZE_FOR_RECORDS + 1
-            print(f"Processing interrupted. Next start line: {next_start_line}")
-            sys.exit(1)
+    # Dedup, embedding and upload run as concurrent stages; see modules/pipeline.py
+    pipeline = IndexingPipeline(
+        find_existing_keys=find_existing_document_keys,
+        create_documents=create_documents_from_records,
+        upload=upload_documents,
+        document_key=generate_document_key,
+        chunk_lines=BATCH_SIZE_FOR_RECORDS,
+        dedup_concurrency=int(os.getenv("INDEXING_DEDUP_CONCURRENCY", "2")),
+        embed_concurrency=int(os.getenv("INDEXING_EMBED_CONCURRENCY", "4")),
+        upload_concurrency=int(os.getenv("INDEXING_UPLOAD_CONCURRENCY", "2")),
+        queue_size=int(os.getenv("INDEXING_QUEUE_SIZE", "8")),
+        upload_batch_max_bytes=int(os.getenv("INDEXING_UPLOAD_BATCH_MAX_BYTES", str(8 * 1024 * 1024))),
+        report_interval=float(os.getenv("INDEXING_REPORT_INTERVAL_SECONDS", "10")),
+    )
+    try:
+        pipeline.run(iter_records(file_path, start_line))
+    except Exception as e:
+        print(f"Exception occurred: {e}")
+        print(f"Processing interrupted. Next start line: {pipeline.stats.resume_line()}")
+        sys.exit(1)
+    finally:
+        print(bulk_uploader.stats.summary())
+        bulk_uploader.close()
+    print(f"Processing finished. Elapsed time: {datetime.now() - start_time}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,102 @@
+import csv
+import io
+import json
+import os
+from typing import BinaryIO, Iterator, Optional
+
+
+def read_csv_header(file: BinaryIO, encoding: str) -> list[str]:
+    """Reads the header row at the start of a CSV file opened in binary mode."""
+    file.seek(0)
+    return next(csv.reader([file.readline().decode(encoding, errors='ignore')]))
+
+
+def iter_rows_with_offsets(file: BinaryIO, fieldnames: list[str], encoding: str, first_line: int) -> Iterator[tuple[int, int, dict]]:
+    """
+    Yields (line number, byte offset just after the row, row dict) for every data row from the current position of
+    a CSV file opened in binary mode, so that a resumed run can seek straight to a row instead of re-parsing the file.
+    Rows are split on the raw bytes: a row ends at a newline outside quotes. This is safe for Shift-JIS and UTF-8,
+    where neither '"' nor '\\n' appear inside multibyte characters.
+    Line numbers count data rows like csv.DictReader does; the first row after the header is line 1.
+    """
+    line_number = first_line
+    raw = b''
+    for physical_line in file:
+        raw += physical_line
+        if raw.count(b'"') % 2:
+            # A quoted field continues on the next physical line
+            continue
+        text = raw.decode(encoding, errors='ignore')
+        raw = b''
+        values = next(csv.reader(io.StringIO(text, newline='')), None)
+        if not values:
+            continue
+        yield line_number, file.tell(), dict(zip(fieldnames, values + [''] * (len(fieldnames) - len(values))))
+        line_number += 1
+
+
+class CleansingCheckpoint:
+    """
+    Progress of a cleansing run, saved next to the output file after every record written.
+    Records are written in input order, so everything before `offset` in the input is cleansed and written and
+    nothing after it is. The output is truncated to `output_bytes` on resume, which drops a row written after the
+    last save, so each record ends up in the output exactly once.
+    Attributes:
+        path (str): Path of the checkpoint file.
+        input_file (str), input_size (int): The input the checkpoint belongs to.
+        offset (int): Byte offset in the input of the first row not written yet.
+        line (int): Line number of the row at `offset`.
+        completed (set): Line numbers of rows after `offset` that are already written; only checkpoints of runs that
+            wrote records out of order have any, and they are skipped on resume.
+        output_bytes (int): Size of the output file at the last save.
+    Methods:
+        load(path): Returns the saved checkpoint, or None.
+        advance(self, offset, line, output_bytes): Moves the offset past the rows written so far and saves.
+    """
+
+    def __init__(self, path: str, input_file: str, input_size: int, offset: int, line: int = 1, completed: Optional[set[int]] = None, output_bytes: int = 0):
+        self.path = path
+        self.input_file = input_file
+        self.input_size = input_size
+        self.offset = offset
+        self.line = line
+        self.completed = completed or set()
+        self.output_bytes = output_bytes
+
+    @classmethod
+    def load(cls, path: str) -> Optional["CleansingCheckpoint"]:
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        return cls(path, data["input_file"], data["input_size"], data["offset"], data["line"], set(data["completed"]), data["output_bytes"])
+
+    def matches(self, input_file: str) -> bool:
+        return os.path.basename(input_file) == self.input_file and os.path.getsize(input_file) == self.input_size
+
+    def save(self) -> None:
+        data = {
+            "input_file": self.input_file,
+            "input_size": self.input_size,
+            "offset": self.offset,
+            "line": self.line,
+            "completed": sorted(self.completed),
+            "output_bytes": self.output_bytes,
+        }
+        # Written to a temporary file and renamed, so a crash never leaves a half-written checkpoint
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            json.dump(data, file)
+        os.replace(temporary_path, self.path)
+
+    def advance(self, offset: int, line: int, output_bytes: Optional[int] = None) -> None:
+        self.offset = offset
+        self.line = line
+        self.completed = {completed_line for completed_line in self.completed if completed_line >= line}
+        if output_bytes is not None:
+            self.output_bytes = output_bytes
+        self.save()
+
+    def remove(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,148 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Optional
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class CleanseCache:
+    """
+    A persistent cache of cleansed texts keyed by (system prompt hash, deployment, input text hash), so that text
+    seen in another incident or in an earlier export is not sent to the chat model again.
+    Entries live in a SQLite file with the time they were last used; editing a prompt file changes its hash, so
+    entries of the old prompt are never hit again and are dropped by compact(). Safe to use from several threads; get
+    and put block on disk I/O, so async callers run them in a worker thread.
+    Attributes:
+        path (str): SQLite file of the cache.
+        max_pending_uses (int): Hits whose last-use time is kept in memory before it is written.
+        hits, misses (int): Counters since start.
+    Methods:
+        get(self, system_prompt, deployment, text): Returns the cached output, or None.
+        put(self, system_prompt, deployment, text, output): Stores an output.
+        flush(self): Writes the last-use times of the hits so far.
+        stats(self): Entry counts and sizes per prompt and deployment.
+        compact(self, keep_prompts, max_age_days): Evicts stale entries and shrinks the file.
+    """
+
+    def __init__(self, path: str, max_pending_uses: int = 256):
+        self.path = path
+        self.max_pending_uses = max_pending_uses
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Last use and hit count per key of the hits not written yet
+        self._pending_uses: dict[str, tuple[float, int]] = {}
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS cleansed ("
+            "key TEXT PRIMARY KEY, prompt_hash TEXT NOT NULL, deployment TEXT NOT NULL, output TEXT NOT NULL, "
+            "created_at REAL NOT NULL, used_at REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._connection.commit()
+
+    @staticmethod
+    def key(prompt_hash: str, deployment: str, text: str) -> str:
+        # The exact input: cleansing rewrites the layout, so texts that differ only in spacing or line breaks are
+        # cleansed separately
+        return hash_text(f"{prompt_hash}\0{deployment}\0{hash_text(unicodedata.normalize('NFC', text))}")
+
+    def get(self, system_prompt: str, deployment: str, text: str) -> Optional[str]:
+        key = self.key(hash_text(system_prompt), deployment, text)
+        with self._lock:
+            row = self._connection.execute("SELECT output FROM cleansed WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # Written with the next put, or once enough hits are pending, instead of a commit per hit
+            _, hits = self._pending_uses.get(key, (0.0, 0))
+            self._pending_uses[key] = (time.time(), hits + 1)
+            if len(self._pending_uses) >= self.max_pending_uses:
+                self._write_uses()
+                self._connection.commit()
+        return row[0]
+
+    def put(self, system_prompt: str, deployment: str, text: str, output: str) -> None:
+        prompt_hash = hash_text(system_prompt)
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO cleansed (key, prompt_hash, deployment, output, created_at, used_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.key(prompt_hash, deployment, text), prompt_hash, deployment, output, now, now),
+            )
+            self._write_uses()
+            self._connection.commit()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._write_uses()
+            self._connection.commit()
+
+    def _write_uses(self) -> None:
+        if self._pending_uses:
+            self._connection.executemany(
+                "UPDATE cleansed SET used_at = ?, hits = hits + ? WHERE key = ?",
+                [(used_at, hits, key) for key, (used_at, hits) in self._pending_uses.items()],
+            )
+            self._pending_uses.clear()
+
+    def stats(self) -> dict[str, object]:
+        self.flush()
+        with self._lock:
+            groups = self._connection.execute(
+                "SELECT prompt_hash, deployment, COUNT(*), SUM(hits), SUM(LENGTH(CAST(output AS BLOB))), MIN(used_at), MAX(used_at) "
+                "FROM cleansed GROUP BY prompt_hash, deployment ORDER BY COUNT(*) DESC"
+            ).fetchall()
+            page_count = self._connection.execute("PRAGMA page_count").fetchone()[0]
+            page_size = self._connection.execute("PRAGMA page_size").fetchone()[0]
+        return {
+            "entries": sum(group[2] for group in groups),
+            "file_bytes": page_count * page_size,
+            "groups": [
+                {
+                    "prompt_hash": prompt_hash,
+                    "deployment": deployment,
+                    "entries": entries,
+                    "hits": hits or 0,
+                    "output_bytes": output_bytes or 0,
+                    "oldest_use": oldest,
+                    "newest_use": newest,
+                }
+                for prompt_hash, deployment, entries, hits, output_bytes, oldest, newest in groups
+            ],
+        }
+
+    def compact(self, keep_prompts: Optional[list[str]] = None, max_age_days: Optional[float] = None) -> int:
+        """
+        Deletes entries of prompts other than keep_prompts and entries not used for max_age_days, then rewrites the
+        file to release the space. Returns the number of entries deleted.
+        """
+        deleted = 0
+        with self._lock:
+            self._write_uses()
+            if keep_prompts is not None:
+                prompt_hashes = [hash_text(prompt) for prompt in keep_prompts]
+                placeholders = ",".join("?" * len(prompt_hashes))
+                deleted += self._connection.execute(
+                    f"DELETE FROM cleansed WHERE prompt_hash NOT IN ({placeholders})", prompt_hashes
+                ).rowcount
+            if max_age_days is not None:
+                deleted += self._connection.execute(
+                    "DELETE FROM cleansed WHERE used_at < ?", (time.time() - max_age_days * 86400,)
+                ).rowcount
+            self._connection.commit()
+            self._connection.execute("VACUUM")
+        return deleted
+
+    def close(self) -> None:
+        with self._lock:
+            self._write_uses()
+            self._connection.commit()
+            self._connection.close()
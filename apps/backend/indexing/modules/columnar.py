@@ -0,0 +1,137 @@
+import os
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    # Only the columnar intermediate format needs pyarrow; CSV runs work without it
+    pa = None
+
+from modules.record import DATE_FIELDS, RECORD_FIELDS, Record, compute_document_key
+
+VECTOR_COLUMNS = ('question_vector', 'answer_vector')
+COMPRESSIONS = ('zstd', 'lz4', 'none')
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError("The columnar format needs pyarrow. Install it with: pip install pyarrow")
+
+class ColumnarRecord(Record):
+    """A record read from a columnar file, with the document key stored in it and its vectors, if the file has them."""
+    __slots__ = ('document_key', 'question_vector', 'answer_vector')
+
+class ColumnarWriter:
+    """
+    Writes records to an Arrow IPC file: one string column per CSV column, the line number, the precomputed document
+    key and, when `dimensions` is given, the question and answer vectors as float32 fixed-size lists.
+    Rows are buffered into record batches of `batch_size`. The file is written under a temporary name and renamed on
+    close(), since an Arrow file is only readable once its footer is written.
+    Attributes:
+        path (str): Path of the .arrow file.
+        compression (str): Buffer compression, one of zstd, lz4 or none. Only uncompressed files are read zero-copy.
+        dimensions (int): Length of the vectors, or None for a file without vectors.
+    Methods:
+        write(self, line_number, record, question_vector, answer_vector): Adds one row.
+        close(self): Writes the last batch and the footer.
+    """
+
+    def __init__(self, path: str, compression: str = 'zstd', dimensions: Optional[int] = None, batch_size: int = 10000):
+        require_pyarrow()
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression: {compression}. Use one of {', '.join(COMPRESSIONS)}")
+        self.path = path
+        self.compression = compression
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        fields = [pa.field('line', pa.int64()), pa.field('document_key', pa.string())]
+        fields += [pa.field(field, pa.string()) for field in RECORD_FIELDS]
+        if dimensions:
+            fields += [pa.field(column, pa.list_(pa.float32(), dimensions)) for column in VECTOR_COLUMNS]
+        self.schema = pa.schema(fields)
+        self._temporary_path = path + '.tmp'
+        self._sink = pa.OSFile(self._temporary_path, 'wb')
+        options = pa.ipc.IpcWriteOptions(compression=None if compression == 'none' else compression)
+        self._writer = pa.ipc.new_file(self._sink, self.schema, options=options)
+        self._columns: dict[str, list] = {field.name: [] for field in self.schema}
+
+    def write(self, line_number: int, record: Record, question_vector: Optional[list[float]] = None, answer_vector: Optional[list[float]] = None) -> None:
+        self._columns['line'].append(line_number)
+        self._columns['document_key'].append(compute_document_key(record))
+        for field, value in record.to_dict().items():
+            self._columns[field].append(value)
+        if self.dimensions:
+            # A text that could not be embedded is stored as null and embedded again by the indexer
+            self._columns['question_vector'].append(question_vector or None)
+            self._columns['answer_vector'].append(answer_vector or None)
+        if len(self._columns['line']) == self.batch_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._columns['line']:
+            self._writer.write_batch(pa.RecordBatch.from_pydict(self._columns, schema=self.schema))
+            self._columns = {name: [] for name in self._columns}
+
+    def close(self) -> None:
+        self._flush()
+        self._writer.close()
+        self._sink.close()
+        os.replace(self._temporary_path, self.path)
+
+class ColumnarDataset:
+    """
+    Reads a file written by ColumnarWriter through a memory map, one record batch at a time, so the indexer streams
+    records without parsing CSV and only materializes the columns it asks for.
+    Attributes:
+        path (str): Path of the .arrow file.
+        has_vectors (bool): Whether the file stores question and answer vectors.
+        num_rows (int): Number of rows in the file.
+    Methods:
+        iter_records(self, fields, start_line): Yields (line number, ColumnarRecord) from start_line on.
+    """
+
+    def __init__(self, path: str):
+        require_pyarrow()
+        self.path = path
+        self._source = pa.memory_map(path, 'r')
+        self._reader = pa.ipc.open_file(self._source)
+        self.schema = self._reader.schema
+        self.has_vectors = all(column in self.schema.names for column in VECTOR_COLUMNS)
+        self.num_rows = sum(self._reader.get_batch(i).num_rows for i in range(self._reader.num_record_batches))
+
+    def iter_records(self, fields: Iterable[str] = RECORD_FIELDS, start_line: int = 1) -> Iterator[tuple[int, ColumnarRecord]]:
+        fields = tuple(fields)
+        setters = [getattr(Record, '_' + field if field in DATE_FIELDS else field).__set__ for field in fields]
+        for i in range(self._reader.num_record_batches):
+            batch = self._reader.get_batch(i)
+            lines = batch.column('line').to_numpy()
+            if len(lines) == 0 or lines[-1] < start_line:
+                continue
+            columns = [batch.column(field).to_pylist() for field in fields]
+            document_keys = batch.column('document_key').to_pylist()
+            vectors = [self._vectors(batch, column) for column in VECTOR_COLUMNS] if self.has_vectors else None
+            for row, line_number in enumerate(lines.tolist()):
+                if line_number < start_line:
+                    continue
+                record = ColumnarRecord.__new__(ColumnarRecord)
+                for setter, column in zip(setters, columns):
+                    setter(record, column[row])
+                record.document_key = document_keys[row]
+                if vectors is not None:
+                    record.question_vector = vectors[0][row]
+                    record.answer_vector = vectors[1][row]
+                yield line_number, record
+
+    @staticmethod
+    def _vectors(batch, column: str) -> list[Optional[np.ndarray]]:
+        array = batch.column(column)
+        # The child array holds a slot for every row, null or not, so rows map to fixed offsets
+        size = array.type.list_size
+        values = array.values.slice(array.offset * size, len(array) * size)
+        matrix = values.to_numpy(zero_copy_only=False).reshape(len(array), size)
+        return [None if missing else matrix[row] for row, missing in enumerate(array.is_null().to_pylist())]
+
+    def close(self) -> None:
+        self._source.close()
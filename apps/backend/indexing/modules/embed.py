@@ -1,9 +1,14 @@
 import os
+import concurrent.futures
 
 from azure.identity import DefaultAzureCredential, get_bearer_token_provider
-from openai import AzureOpenAI, RateLimitError
+from openai import APIStatusError, AzureOpenAI
 from dotenv import load_dotenv
 
+from core.embeddingcache import EmbeddingCache
+from core.modelhelper import get_encoding
+from core.ratelimit import RETRYABLE_ERRORS, RateLimitScheduler, parse_deployments
+
 load_dotenv()
 
 endpoint = os.getenv("AZURE_OPENAI_ENDPOINT_URL")  
@@ -11,6 +16,10 @@ deployment = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
 deployment2 = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT2")
 api_key = os.getenv("AZURE_OPENAI_API_KEY", "REPLACE_WITH_YOUR_KEY_VALUE_HERE")  
 api_version = os.getenv("AZURE_OPENAI_EMBEDDING_API_VERSION", "2023-05-15")
+# Limits of one batched embeddings request: number of inputs and total tokens (text-embedding-3 uses cl100k_base)
+batch_max_inputs = int(os.getenv("EMBEDDING_BATCH_MAX_INPUTS", "2048"))
+batch_max_tokens = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "100000"))
+batch_concurrency = int(os.getenv("EMBEDDING_BATCH_CONCURRENCY", "4"))
 print(f"Using OpenAI endpoint: {endpoint}, deployment: {deployment}, deployment2: {deployment2}, api_version: {api_version}")
 
 token_provider = get_bearer_token_provider(
@@ -23,24 +32,102 @@ openai_client = AzureOpenAI(
     api_key=api_key, # マネージド ID 認証が失敗する場合はこちらのコメントアウトを解除して DefaultAzureCredentialを使用する引数をコメントアウト
     api_version=api_version,
     # azure_ad_token_provider=token_provider,
+    # Retries on 429 are left to the scheduler, which moves them to another deployment
+    max_retries=0,
 )
 
+# Routes requests across the embedding deployments within their limits; AZURE_OPENAI_EMBEDDING_DEPLOYMENTS
+# ("name:weight:requests/min:tokens/min,...") overrides the two deployments above
+scheduler = RateLimitScheduler(parse_deployments(os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENTS"), (deployment, deployment2)))
+
+# Re-indexing runs and duplicate descriptions are served from here instead of the embeddings API
+embedding_cache = EmbeddingCache(os.getenv("EMBEDDING_CACHE_PATH", "indexing/output_csv/embedding_cache.sqlite3"))
+
 def embed_text(text: str) -> list[float]:
-    attempt = 0
-    deployments = [deployment, deployment2]
-    current_deployment_index = 0
-
-    while True:
-        try:
-            embedding_response = openai_client.embeddings.create(
-                input=text,
-                model=deployments[current_deployment_index],
-            )
-            return embedding_response.data[0].embedding
-        except RateLimitError as e:
-            print(f"Rate limit exceeded on model {deployments[current_deployment_index]}, switching to next model... (Attempt {attempt + 1})")
-            current_deployment_index = (current_deployment_index + 1) % len(deployments)
-            attempt += 1
-        except Exception as e:
-            print(f"Error occurred: {e}. Text: {text}")
-            return []
\ No newline at end of file
+    # Both deployments serve the same model, so the cache is keyed by the primary one
+    cached_embedding = embedding_cache.get(deployment, text)
+    if cached_embedding is not None:
+        return cached_embedding
+
+    try:
+        embedding_response = scheduler.call(
+            lambda model: openai_client.embeddings.create(input=text, model=model),
+            estimated_tokens=len(get_encoding("cl100k_base").encode_ordinary(text)),
+        )
+        embedding = embedding_response.data[0].embedding
+        embedding_cache.put(deployment, text, embedding)
+        return embedding
+    except RETRYABLE_ERRORS:
+        # Still throttled after the scheduler's retries: stop the run so the record is embedded on the next one
+        raise
+    except Exception as e:
+        print(f"Error occurred: {e}. Text: {text}")
+        return []
+
+def embed_texts(texts: list[str]) -> list[list[float]]:
+    """
+    Embeds many texts with as few requests as possible and returns the embeddings in input order.
+    Cached and repeated texts are embedded once; the rest is packed into requests bounded by
+    EMBEDDING_BATCH_MAX_INPUTS and EMBEDDING_BATCH_MAX_TOKENS, which are sent concurrently.
+    A text that cannot be embedded gets [] like embed_text; rate limit and transient errors that outlast the
+    scheduler's retries are raised.
+    """
+    embeddings: dict[str, list[float]] = {}
+    pending: list[str] = []
+    for text in dict.fromkeys(texts):
+        cached_embedding = embedding_cache.get(deployment, text)
+        if cached_embedding is not None:
+            embeddings[text] = cached_embedding
+        else:
+            pending.append(text)
+
+    batches = pack_batches(pending)
+    if batches:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=batch_concurrency) as executor:
+            for batch, batch_embeddings in zip(batches, executor.map(embed_batch, batches)):
+                embedded = dict(zip(batch, batch_embeddings))
+                embedding_cache.put_many(deployment, embedded)
+                embeddings.update(embedded)
+    return [embeddings[text] for text in texts]
+
+def pack_batches(texts: list[str]) -> list[list[str]]:
+    encoding = get_encoding("cl100k_base")
+    batches: list[list[str]] = []
+    batch: list[str] = []
+    batch_tokens = 0
+    for text, tokens in zip(texts, encoding.encode_ordinary_batch(texts)):
+        if batch and (len(batch) == batch_max_inputs or batch_tokens + len(tokens) > batch_max_tokens):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(text)
+        batch_tokens += len(tokens)
+    if batch:
+        batches.append(batch)
+    return batches
+
+def embed_batch(texts: list[str]) -> list[list[float]]:
+    try:
+        embedding_response = scheduler.call(
+            lambda model: openai_client.embeddings.create(input=texts, model=model),
+            estimated_tokens=sum(len(tokens) for tokens in get_encoding("cl100k_base").encode_ordinary_batch(texts)),
+        )
+        # Results carry the index of their input and are mapped back by it, not by response order
+        embeddings: list[list[float]] = [[] for _ in texts]
+        for item in embedding_response.data:
+            embeddings[item.index] = item.embedding
+        return embeddings
+    except RETRYABLE_ERRORS:
+        # RateLimitError and InternalServerError are APIStatusErrors too, but must not turn into [] below
+        raise
+    except APIStatusError as e:
+        if e.status_code not in (400, 413) or len(texts) == 1:
+            print(f"Error occurred: {e}. Text: {texts[0]}")
+            return [[] for _ in texts]
+        # The request is too large for the service (inputs, tokens or payload): retry it as two halves
+        middle = len(texts) // 2
+        print(f"Embedding request of {len(texts)} texts rejected, splitting it: {e}")
+        return embed_batch(texts[:middle]) + embed_batch(texts[middle:])
+    except Exception as e:
+        print(f"Error occurred: {e}. Texts: {len(texts)}")
+        return [[] for _ in texts]
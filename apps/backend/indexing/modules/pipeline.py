@@ -0,0 +1,280 @@
+import json
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Iterable, Optional
+
+from modules.record import Record
+
+# Tells the next worker of a stage that its input is exhausted
+_DONE = object()
+
+
+def estimate_document_bytes(document: dict) -> int:
+    """Approximate JSON size of a document; vectors are counted at about 20 bytes per float instead of serializing them."""
+    size = 0
+    for key, value in document.items():
+        if isinstance(value, list) and value and isinstance(value[0], float):
+            size += len(key) + 20 * len(value)
+        else:
+            size += len(key) + len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+    return size + 2 * len(document)
+
+
+class PipelineStats:
+    """Counters shared by the stages, and the resume line of an interrupted run."""
+
+    def __init__(self, chunk_lines: int):
+        self.chunk_lines = chunk_lines
+        self.lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.read = 0
+        self.skipped_existing = 0
+        self.embedded = 0
+        self.uploaded = 0
+        self.upload_batches = 0
+        self.next_unread_chunk = 0
+        # Documents of each started chunk that still have to be uploaded
+        self.pending_by_chunk: dict[int, int] = {}
+
+    def chunk_started(self, chunk: int, records: int) -> None:
+        with self.lock:
+            self.read += records
+            self.pending_by_chunk[chunk] = records
+            self.next_unread_chunk = chunk + 1
+
+    def chunk_done(self, chunk: int, count: int) -> None:
+        with self.lock:
+            self.pending_by_chunk[chunk] -= count
+            if self.pending_by_chunk[chunk] == 0:
+                del self.pending_by_chunk[chunk]
+
+    def resume_line(self) -> int:
+        """First line of the oldest chunk that is not fully uploaded; every line before it is indexed."""
+        with self.lock:
+            chunk = min(self.pending_by_chunk, default=self.next_unread_chunk)
+        return chunk * self.chunk_lines + 1
+
+    def summary(self) -> str:
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        return (
+            f"read {self.read}, existing {self.skipped_existing}, embedded {self.embedded}, uploaded {self.uploaded} "
+            f"in {self.upload_batches} batches ({self.uploaded / elapsed:.1f} docs/s)"
+        )
+
+
+class IndexingPipeline:
+    """
+    Streams CSV records through dedup, embedding and upload stages that run concurrently, joined by bounded queues.
+    A stage only waits for its own input, so a slow embedding request no longer holds back the reading and uploading
+    of other records, and the bounded queues keep memory flat when a stage falls behind.
+    Records travel in chunks of `chunk_lines` CSV lines so that an interrupted run can be resumed at a chunk boundary.
+    Uploads are batched by estimated payload size rather than by record count.
+    Attributes:
+        find_existing_keys, create_documents, upload, document_key: The stage functions (see modules.search).
+        dedup_concurrency, embed_concurrency, upload_concurrency (int): Worker threads per stage.
+        queue_size (int): Capacity of each queue between stages, in chunks or upload batches.
+        upload_batch_max_bytes, upload_batch_max_documents (int): Limits of one upload request.
+        report_interval (float): Seconds between progress lines.
+    Methods:
+        run(self, rows): Indexes (line number, record) pairs and returns the stats; raises the first stage error.
+    """
+
+    def __init__(
+        self,
+        find_existing_keys: Callable[[list[str]], set[str]],
+        create_documents: Callable[[list[Record]], list[dict]],
+        upload: Callable[[list[dict]], None],
+        document_key: Callable[[Record], str],
+        chunk_lines: int = 100,
+        dedup_concurrency: int = 2,
+        embed_concurrency: int = 4,
+        upload_concurrency: int = 2,
+        queue_size: int = 8,
+        upload_batch_max_bytes: int = 8 * 1024 * 1024,
+        upload_batch_max_documents: int = 1000,
+        report_interval: float = 10.0,
+    ):
+        self.find_existing_keys = find_existing_keys
+        self.create_documents = create_documents
+        self.upload = upload
+        self.document_key = document_key
+        self.chunk_lines = chunk_lines
+        self.dedup_concurrency = dedup_concurrency
+        self.embed_concurrency = embed_concurrency
+        self.upload_concurrency = upload_concurrency
+        self.queue_size = queue_size
+        self.upload_batch_max_bytes = upload_batch_max_bytes
+        self.upload_batch_max_documents = upload_batch_max_documents
+        self.report_interval = report_interval
+        self.stats = PipelineStats(chunk_lines)
+        self.error: Optional[BaseException] = None
+        self._stop = threading.Event()
+
+    def run(self, rows: Iterable[tuple[int, Record]]) -> PipelineStats:
+        self.stats = PipelineStats(self.chunk_lines)
+        self.error = None
+        self._stop.clear()
+        self.dedup_queue: queue.Queue = queue.Queue(self.queue_size)
+        self.embed_queue: queue.Queue = queue.Queue(self.queue_size)
+        self.documents_queue: queue.Queue = queue.Queue(self.queue_size)
+        self.upload_queue: queue.Queue = queue.Queue(self.queue_size)
+
+        # (worker, its concurrency, input queue, output queue, concurrency of the stage reading the output)
+        stages = [
+            (self._dedup_worker, self.dedup_concurrency, self.dedup_queue, self.embed_queue, self.embed_concurrency),
+            (self._embed_worker, self.embed_concurrency, self.embed_queue, self.documents_queue, 1),
+            (self._batch_worker, 1, self.documents_queue, self.upload_queue, self.upload_concurrency),
+            (self._upload_worker, self.upload_concurrency, self.upload_queue, None, 0),
+        ]
+        threads = []
+        for worker, concurrency, input_queue, output_queue, next_concurrency in stages:
+            remaining = [concurrency]
+            for _ in range(concurrency):
+                thread = threading.Thread(
+                    target=self._run_worker,
+                    args=(worker, input_queue, output_queue, remaining, next_concurrency),
+                    daemon=True,
+                )
+                thread.start()
+                threads.append(thread)
+        reporter = threading.Thread(target=self._report, daemon=True)
+        reporter.start()
+
+        try:
+            self._read(rows)
+        except BaseException as e:
+            self._fail(e)
+        for _ in range(self.dedup_concurrency):
+            self._put(self.dedup_queue, _DONE)
+        for thread in threads:
+            thread.join()
+        self._stop.set()
+        reporter.join()
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] {self.stats.summary()}")
+        if self.error is not None:
+            raise self.error
+        return self.stats
+
+    def _read(self, rows: Iterable[tuple[int, Record]]) -> None:
+        chunk, records = None, []
+        for line_number, record in rows:
+            if self._stop.is_set():
+                return
+            line_chunk = (line_number - 1) // self.chunk_lines
+            if chunk is not None and line_chunk != chunk and records:
+                self._put_chunk(chunk, records)
+                records = []
+            chunk = line_chunk
+            records.append(record)
+        if records:
+            self._put_chunk(chunk, records)
+
+    def _put_chunk(self, chunk: int, records: list[Record]) -> None:
+        self.stats.chunk_started(chunk, len(records))
+        self._put(self.dedup_queue, (chunk, records))
+
+    def _run_worker(self, worker, input_queue: queue.Queue, output_queue: Optional[queue.Queue], remaining: list[int], next_concurrency: int) -> None:
+        try:
+            worker(input_queue, output_queue)
+        except BaseException as e:
+            self._fail(e)
+        with self.stats.lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last and output_queue is not None:
+            # The last worker of a stage tells every worker of the next stage that no more input will come
+            for _ in range(next_concurrency):
+                self._put(output_queue, _DONE)
+
+    def _items(self, input_queue: queue.Queue):
+        # Ends at the end-of-input marker, or as soon as any stage failed
+        while not self._stop.is_set():
+            try:
+                item = input_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                return
+            yield item
+
+    def _dedup_worker(self, input_queue: queue.Queue, output_queue: queue.Queue) -> None:
+        for chunk, records in self._items(input_queue):
+            document_keys = [self.document_key(record) for record in records]
+            existing_keys = self.find_existing_keys(document_keys)
+            new_records, new_keys = [], set()
+            for record, document_key in zip(records, document_keys):
+                if document_key not in existing_keys and document_key not in new_keys:
+                    new_keys.add(document_key)
+                    new_records.append(record)
+            with self.stats.lock:
+                self.stats.skipped_existing += len(records) - len(new_records)
+            self.stats.chunk_done(chunk, len(records) - len(new_records))
+            if new_records:
+                self._put(output_queue, (chunk, new_records))
+
+    def _embed_worker(self, input_queue: queue.Queue, output_queue: queue.Queue) -> None:
+        for chunk, records in self._items(input_queue):
+            documents = self.create_documents(records)
+            with self.stats.lock:
+                self.stats.embedded += len(documents)
+            self._put(output_queue, (chunk, documents))
+
+    def _batch_worker(self, input_queue: queue.Queue, output_queue: queue.Queue) -> None:
+        batch: list[tuple[int, dict]] = []
+        batch_bytes = 0
+        for chunk, documents in self._items(input_queue):
+            for document in documents:
+                document_bytes = estimate_document_bytes(document)
+                if batch and (
+                    batch_bytes + document_bytes > self.upload_batch_max_bytes
+                    or len(batch) == self.upload_batch_max_documents
+                ):
+                    self._put(output_queue, batch)
+                    batch, batch_bytes = [], 0
+                batch.append((chunk, document))
+                batch_bytes += document_bytes
+            # A batch is not held back waiting for more documents when the embedding stage is idle
+            if batch and input_queue.empty():
+                self._put(output_queue, batch)
+                batch, batch_bytes = [], 0
+        if batch and not self._stop.is_set():
+            self._put(output_queue, batch)
+
+    def _upload_worker(self, input_queue: queue.Queue, output_queue: None) -> None:
+        for batch in self._items(input_queue):
+            self.upload([document for _, document in batch])
+            with self.stats.lock:
+                self.stats.uploaded += len(batch)
+                self.stats.upload_batches += 1
+            counts: dict[int, int] = {}
+            for chunk, _ in batch:
+                counts[chunk] = counts.get(chunk, 0) + 1
+            for chunk, count in counts.items():
+                self.stats.chunk_done(chunk, count)
+
+    def _put(self, output_queue: queue.Queue, item) -> None:
+        # Waits for room in the queue, but gives up once a stage failed since nothing reads the queue any more
+        while not self._stop.is_set():
+            try:
+                output_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _fail(self, error: BaseException) -> None:
+        with self.stats.lock:
+            if self.error is None:
+                self.error = error
+        self._stop.set()
+
+    def queue_depths(self) -> str:
+        return (
+            f"dedup {self.dedup_queue.qsize()}/{self.queue_size}, embed {self.embed_queue.qsize()}/{self.queue_size}, "
+            f"batch {self.documents_queue.qsize()}/{self.queue_size}, upload {self.upload_queue.qsize()}/{self.queue_size}"
+        )
+
+    def _report(self) -> None:
+        while not self._stop.wait(self.report_interval):
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] {self.stats.summary()}; queues: {self.queue_depths()}")
@@ -1,9 +1,13 @@
+import asyncio
 import os
 
 from azure.identity import DefaultAzureCredential, get_bearer_token_provider
-from openai import AzureOpenAI, RateLimitError
+from openai import AsyncAzureOpenAI
 from dotenv import load_dotenv
 
+from core.modelhelper import num_tokens_from_messages_batch
+from core.ratelimit import RETRYABLE_ERRORS, RateLimitScheduler, parse_deployments
+from modules.cleansecache import CleanseCache, hash_text
 from modules.record import Record
 
 load_dotenv()
@@ -16,12 +20,25 @@ token_provider = get_bearer_token_provider(
     DefaultAzureCredential(),
     'https://cognitiveservices.azure.com/.default',
 )
-client = AzureOpenAI(
+# Cleansing runs every record's completions concurrently on one event loop (see cleansing.py)
+client = AsyncAzureOpenAI(
     azure_endpoint=endpoint,
     # azure_ad_token_provider=token_provider, 
     api_key=os.getenv("AZURE_OPENAI_API_KEY"), # マネージド ID 認証が失敗する場合はこちらのコメントアウトを解除して DefaultAzureCredentialを使用する引数をコメントアウト
     api_version=api_version,
+    # Retries on 429 are left to the scheduler, which moves them to another deployment
+    max_retries=0,
 )
+# Routes requests across the chat deployments within their limits; AZURE_OPENAI_CHATGPT_DEPLOYMENTS
+# ("name:weight:requests/min:tokens/min,...") overrides the two deployments above
+scheduler = RateLimitScheduler(parse_deployments(os.getenv("AZURE_OPENAI_CHATGPT_DEPLOYMENTS"), (deployment, deployment2)))
+
+# Cleansed outputs of texts seen before, in this export or an earlier one; the deployments serve the same model, so
+# entries are keyed by the primary one
+cleanse_cache = CleanseCache(os.getenv("CLEANSE_CACHE_PATH", "indexing/output_csv/cleanse_cache.sqlite3"))
+cache_deployment = scheduler.deployments[0].name
+# Completions in flight by cache key, so a text repeated across records cleansed at the same time is sent once
+in_flight_completions: dict[str, asyncio.Future] = {}
 
 with open('indexing/prompts_txt/for_comments_and_work_notes.txt', 'r') as f:
     sys_prompt_comments_and_work_notes = f.read()
@@ -29,7 +46,18 @@ with open('indexing/prompts_txt/for_comments_and_work_notes.txt', 'r') as f:
 with open('indexing/prompts_txt/for_description.txt', 'r') as f:
     sys_prompt_description = f.read()
 
-def send_chat_completion(system_prompt: str, user_prompt: str)-> str:
+async def send_chat_completion(system_prompt: str, user_prompt: str)-> str:
+    # SQLite blocks on disk I/O, so the cache is used from a worker thread rather than the event loop
+    cached_output = await asyncio.to_thread(cleanse_cache.get, system_prompt, cache_deployment, user_prompt)
+    if cached_output is not None:
+        return cached_output
+    key = CleanseCache.key(hash_text(system_prompt), cache_deployment, user_prompt)
+    if key not in in_flight_completions:
+        in_flight_completions[key] = asyncio.ensure_future(request_chat_completion(system_prompt, user_prompt))
+        in_flight_completions[key].add_done_callback(lambda _: in_flight_completions.pop(key, None))
+    return await asyncio.shield(in_flight_completions[key])
+
+async def request_chat_completion(system_prompt: str, user_prompt: str)-> str:
     chat_prompt = [
         {
             "role": "system",
@@ -52,45 +80,55 @@ def send_chat_completion(system_prompt: str, user_prompt: str)-> str:
     ]
 
     messages = chat_prompt
-    attempt = 0
-    deployments = [deployment, deployment2]
-    current_deployment_index = 0
+    max_completion_tokens = 4096
+    # Rate limits count the prompt plus the most tokens the completion may use
+    prompt_tokens = num_tokens_from_messages_batch(
+        [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}],
+        deployment,
+    )
+    estimated_tokens = sum(prompt_tokens) + max_completion_tokens
 
-    # Infinite retries until successful completion
-    while True:
-        try:
-            completion = client.chat.completions.create(
-                model=deployments[current_deployment_index],
+    try:
+        completion = await scheduler.acall(
+            lambda model: client.chat.completions.create(
+                model=model,
                 messages=messages,
-                max_completion_tokens=4096,
+                max_completion_tokens=max_completion_tokens,
                 temperature=0.7,
                 top_p=0.95,
                 frequency_penalty=0,
                 presence_penalty=0,
                 stop=None,
                 stream=False
-            )
-            return completion.choices[0].message.content
-        except RateLimitError as e:
-            print(f"Rate limit exceeded on model {deployments[current_deployment_index]}, switching to next model... (Attempt {attempt + 1})")
-            current_deployment_index = (current_deployment_index + 1) % len(deployments)
-            attempt += 1
-        except Exception as e:
-            print(f"Error occurred: {e}. User prompt: {user_prompt}")
-            return "SKIPPED"
+            ),
+            estimated_tokens=estimated_tokens,
+        )
+        output = completion.choices[0].message.content
+    except RETRYABLE_ERRORS:
+        # Still throttled after the scheduler's retries: interrupt the run at its checkpoint rather than write SKIPPED
+        raise
+    except Exception as e:
+        print(f"Error occurred: {e}. User prompt: {user_prompt}")
+        return "SKIPPED"
+    # Failed requests are not cached, so they are tried again on the next run
+    if output is not None:
+        await asyncio.to_thread(cleanse_cache.put, system_prompt, cache_deployment, user_prompt, output)
+    return output
 
-def cleanse_record(record: Record)-> dict:
-    response_description = send_chat_completion(
-        system_prompt=sys_prompt_description,
-        user_prompt=record.description
+async def cleanse_record(record: Record)-> Record:
+    # The two fields are cleansed independently, so both completions are in flight at once
+    response_description, response_comments_and_work_notes = await asyncio.gather(
+        send_chat_completion(
+            system_prompt=sys_prompt_description,
+            user_prompt=record.description
+        ),
+        send_chat_completion(
+            system_prompt=sys_prompt_comments_and_work_notes,
+            user_prompt=record.comments_and_work_notes
+        ),
     )
-    
-    response_comments_and_work_notes = send_chat_completion(
-        system_prompt=sys_prompt_comments_and_work_notes,
-        user_prompt=record.comments_and_work_notes
-    )
-    
+
     updated_record = record
     updated_record.description = response_description
     updated_record.comments_and_work_notes = response_comments_and_work_notes
-    return updated_record
\ No newline at end of file
+    return updated_record
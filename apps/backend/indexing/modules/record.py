@@ -1,10 +1,52 @@
 from datetime import datetime
+import hashlib
+from operator import itemgetter
+from typing import Iterable, Iterator, Optional
 import csv
 
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Columns of the incident export, in the order of the Record constructor
+RECORD_FIELDS = (
+    'number', 'start_date', 'tag', 'urgency', 'status', 'watchlist', 'service', 'service2', 'service3',
+    'service_offering', 'service_offering_display_name', 'short_description', 'user', 'priority', 'assigned_group',
+    'assigned_to', 'update_date', 'updater', 'work_start_date', 'work_end_date', 'close_date', 'department_category1',
+    'description', 'comments_and_work_notes', 'hold_reason',
+)
+DATE_FIELDS = ('start_date', 'update_date', 'work_start_date', 'work_end_date', 'close_date')
+# The only columns indexing reads (see modules/search.py)
+INDEXING_FIELDS = ('description', 'comments_and_work_notes', 'service', 'service2', 'service3', 'tag')
+
+def parse_date(date_str: Optional[str]) -> Optional[datetime]:
+    if not date_str:
+        return None
+    # fromisoformat parses the fixed export format several times faster than strptime
+    if len(date_str) == 19 and date_str[4] == '-' and date_str[10] == ' ':
+        return datetime.fromisoformat(date_str)
+    return datetime.strptime(date_str, DATE_FORMAT)
+
+def _date_property(field: str) -> property:
+    # Dates are kept as read and parsed on access, since most runs never look at them
+    raw_field = '_' + field
+
+    def get(self) -> Optional[datetime]:
+        return parse_date(getattr(self, raw_field))
+
+    def set(self, value) -> None:
+        setattr(self, raw_field, value.strftime(DATE_FORMAT) if isinstance(value, datetime) else value)
+
+    return property(get, set)
+
 class Record:
+    """
+    One incident of the export. Attributes are kept in __slots__, and the five date columns are stored as their
+    strings and parsed when read, so millions of records stay cheap to create and to hold.
+    Records built by read_records with a subset of fields raise AttributeError for the fields that were not read.
+    """
+    __slots__ = tuple('_' + field if field in DATE_FIELDS else field for field in RECORD_FIELDS)
+
     def __init__(self, number, start_date, tag, urgency, status, watchlist, service, service2, service3, service_offering, service_offering_display_name, short_description, user, priority, assigned_group, assigned_to, update_date, updater, work_start_date, work_end_date, close_date, department_category1, description, comments_and_work_notes, hold_reason):
         self.number = number
-        self.start_date = self.parse_date(start_date)
+        self.start_date = start_date
         self.tag = tag
         self.urgency = urgency
         self.status = status
@@ -19,23 +61,64 @@ class Record:
         self.priority = priority
         self.assigned_group = assigned_group
         self.assigned_to = assigned_to
-        self.update_date = self.parse_date(update_date)
+        self.update_date = update_date
         self.updater = updater
-        self.work_start_date = self.parse_date(work_start_date)
-        self.work_end_date = self.parse_date(work_end_date)
-        self.close_date = self.parse_date(close_date)
+        self.work_start_date = work_start_date
+        self.work_end_date = work_end_date
+        self.close_date = close_date
         self.department_category1 = department_category1
         self.description = description
         self.comments_and_work_notes = comments_and_work_notes
         self.hold_reason = hold_reason
 
-    def parse_date(self, date_str):
-        if date_str:
-            return datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
-        return None
+    start_date = _date_property('start_date')
+    update_date = _date_property('update_date')
+    work_start_date = _date_property('work_start_date')
+    work_end_date = _date_property('work_end_date')
+    close_date = _date_property('close_date')
+
+    @staticmethod
+    def parse_date(date_str):
+        return parse_date(date_str)
+
+    def to_dict(self, keys: Iterable[str] = RECORD_FIELDS):
+        """Returns the columns as they are written to CSV; dates keep their original strings."""
+        return {key: getattr(self, '_' + key if key in DATE_FIELDS else key) for key in keys}
+
+def compute_document_key(record: Record) -> str:
+    """The search index key of a record: a hash of its question, answer and services."""
+    unique_string = record.description + record.comments_and_work_notes + ''.join([record.service, record.service2, record.service3])
+    return hashlib.md5(unique_string.encode()).hexdigest()
+
+def create_record_from_row(row: dict):
+    """Builds a record from a csv.DictReader row by column name; columns missing from the row are empty."""
+    return Record(*(row.get(field, '') for field in RECORD_FIELDS))
 
-    def to_dict(self, keys: list[str]):
-        return {key: getattr(self, key) for key in keys}
-        
-def create_record_from_row(row: dict, keys: list[str]):
-    return Record(*(row[key] for key in keys))
+def read_records(file, fields: Iterable[str] = RECORD_FIELDS) -> Iterator[tuple[int, Record]]:
+    """
+    Yields (line number, record) for every row of a CSV file with a header, materializing only the given fields.
+    Line numbers count data rows like csv.DictReader does, so they match cleansing's and indexing's -s option.
+    """
+    reader = csv.reader(file)
+    header = next(reader)
+    fields = tuple(fields)
+    missing = [field for field in fields if field not in header]
+    if missing:
+        raise ValueError(f"Columns missing from the CSV header: {missing}")
+    get_values = itemgetter(*(header.index(field) for field in fields))
+    # Slot descriptors set the attributes without going through __init__ and the date properties
+    setters = [getattr(Record, '_' + field if field in DATE_FIELDS else field).__set__ for field in fields]
+    line_number = 0
+    for values in reader:
+        if not values:
+            continue
+        line_number += 1
+        if len(values) < len(header):
+            values += [''] * (len(header) - len(values))
+        record = Record.__new__(Record)
+        selected = get_values(values)
+        if len(fields) == 1:
+            selected = (selected,)
+        for setter, value in zip(setters, selected):
+            setter(record, value)
+        yield line_number, record
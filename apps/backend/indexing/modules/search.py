@@ -1,8 +1,10 @@
+import json
 import os
-import hashlib
+import threading
 
 from azure.search.documents.indexes import SearchIndexClient
 from azure.search.documents import SearchClient
+from azure.search.documents.aio import SearchClient as AsyncSearchClient
 from azure.search.documents.indexes.models import (
     SearchField,
     SearchFieldDataType,
@@ -10,20 +12,31 @@ from azure.search.documents.indexes.models import (
     VectorSearchAlgorithmConfiguration,
     VectorSearchProfile,
     SearchIndex,
-    VectorSearchAlgorithmKind
+    VectorSearchAlgorithmKind,
+    ScalarQuantizationCompression,
+    ScalarQuantizationParameters,
+    BinaryQuantizationCompression,
 )
 from azure.identity import DefaultAzureCredential
 from azure.core.credentials import AzureKeyCredential
 from azure.core.exceptions import ResourceNotFoundError
 from dotenv import load_dotenv
 
-from modules.record import Record
-from modules.embed import embed_text
+from core.vectorsettings import VectorSettings
+from core.vectorstore import VECTOR_FIELDS, LocalVectorStore
+from modules.record import Record, compute_document_key
+from modules.embed import embed_text, embed_texts
+from modules.uploader import BulkUploader, UploadError
 
 load_dotenv()
 AZURE_AI_SEARCH_ENDPOINT = os.getenv("AZURE_AI_SEARCH_ENDPOINT")
 AZURE_AI_SEARCH_INDEX_NAME = os.getenv("AZURE_AI_SEARCH_INDEX_NAME")
 AZURE_AI_SEARCH_API_KEY = os.getenv("AZURE_AI_SEARCH_API_KEY")
+LOCAL_VECTOR_STORE_DIR = os.getenv("LOCAL_VECTOR_STORE_DIR")
+# Vector fields, dimensions and quantization of the index; the chat backend queries with the same settings
+vector_settings = VectorSettings.from_env()
+# Text embedded into each vector field
+VECTOR_SOURCE_ATTRIBUTES = {"question_vector": "description", "answer_vector": "comments_and_work_notes"}
 
 credential = DefaultAzureCredential()
 key_credential = AzureKeyCredential(AZURE_AI_SEARCH_API_KEY) # マネージド ID 認証が失敗する場合はこちらのコメントアウトを解除して DefaultAzureCredentialを使用する引数をコメントアウト
@@ -39,6 +52,27 @@ search_client = SearchClient(
     credential=key_credential # マネージド ID 認証が失敗する場合はこちらのコメントアウトを解除して DefaultAzureCredentialを使用する引数をコメントアウト
     # credential=credential
 )
+# Uploads go through the async client, several requests at a time, retrying the documents the service rejected
+bulk_uploader = BulkUploader(
+    AsyncSearchClient(
+        endpoint=AZURE_AI_SEARCH_ENDPOINT,
+        index_name=AZURE_AI_SEARCH_INDEX_NAME,
+        credential=key_credential # マネージド ID 認証が失敗する場合はこちらのコメントアウトを解除して DefaultAzureCredentialを使用する引数をコメントアウト
+        # credential=credential (the async client needs DefaultAzureCredential from azure.identity.aio)
+    ),
+    concurrency=int(os.getenv("INDEXING_UPLOAD_CONCURRENCY", "2")),
+    max_attempts=int(os.getenv("INDEXING_UPLOAD_MAX_ATTEMPTS", "5")),
+)
+# Uploaded documents are also written to the local vector store used by RETRIEVAL_BACKEND=local, when it is configured
+if LOCAL_VECTOR_STORE_DIR and vector_settings.fields != VECTOR_FIELDS:
+    raise ValueError("The local vector store needs both vector fields; unset LOCAL_VECTOR_STORE_DIR or AZURE_AI_SEARCH_VECTOR_FIELDS")
+local_vector_store = LocalVectorStore(LOCAL_VECTOR_STORE_DIR) if LOCAL_VECTOR_STORE_DIR else None
+# Upload batches are sent from several threads, but the local store appends one batch at a time
+local_vector_store_lock = threading.Lock()
+# Documents with an empty vector (from a failed embedding) or rejected for good by the index are listed here and
+# skipped; they are not in the index, so the next run embeds and uploads them again
+REJECTED_DOCUMENTS_PATH = os.getenv("INDEXING_REJECTED_DOCUMENTS_PATH", "indexing/output_csv/rejected_documents.jsonl")
+rejected_documents_lock = threading.Lock()
 
 def initialize_index():
     try:
@@ -56,32 +90,46 @@ def initialize_index():
         SearchField(name="answer", type=SearchFieldDataType.String, searchable=True),
         SearchField(name="services", type=SearchFieldDataType.Collection(SearchFieldDataType.String), searchable=True, filterable=True, facetable=True),
         SearchField(name="tag", type=SearchFieldDataType.Collection(SearchFieldDataType.String), searchable=True, filterable=True, facetable=True),
+    ]
+    # The vectors are only searched, never returned, so no retrievable copy of them is stored
+    fields += [
         SearchField(
-            name="question_vector",
-            type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
-            searchable=True,
-            vector_search_dimensions=3072,
-            vector_search_profile_name="myProfile",
-        ),
-        SearchField(
-            name="answer_vector",
+            name=field,
             type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
             searchable=True,
-            vector_search_dimensions=3072,
+            hidden=True,
+            stored=False,
+            vector_search_dimensions=vector_settings.dimensions,
             vector_search_profile_name="myProfile",
-        ),
+        )
+        for field in vector_settings.fields
     ]
 
+    compressions = []
+    if vector_settings.compression != "none":
+        # The quantized vectors are searched; with rescoring, `oversampling` times as many candidates are reranked
+        # with the full-precision vectors
+        options = dict(
+            compression_name="myCompression",
+            rerank_with_original_vectors=vector_settings.rescore,
+            default_oversampling=vector_settings.oversampling if vector_settings.rescore else None,
+        )
+        if vector_settings.compression == "scalar":
+            compressions.append(ScalarQuantizationCompression(parameters=ScalarQuantizationParameters(quantized_data_type="int8"), **options))
+        else:
+            compressions.append(BinaryQuantizationCompression(**options))
+
     profile = VectorSearchProfile(
         name="myProfile",
         algorithm_configuration_name="myHnsw",
+        compression_name="myCompression" if compressions else None,
     )
     algorithm = VectorSearchAlgorithmConfiguration(
         name="myHnsw",
     )
     algorithm.kind = VectorSearchAlgorithmKind.HNSW
 
-    vector_search = VectorSearch(profiles=[profile], algorithms=[algorithm])
+    vector_search = VectorSearch(profiles=[profile], algorithms=[algorithm], compressions=compressions)
     index = SearchIndex(name=AZURE_AI_SEARCH_INDEX_NAME, fields=fields, vector_search=vector_search)
 
     search_index_client.create_or_update_index(index)
@@ -109,25 +157,100 @@ def check_document_exists(record: Record) -> bool:
         else:
             raise Exception(f"Error checking if document exists: {e}")
 
+def find_existing_document_keys(document_keys: list[str]) -> set[str]:
+    """
+    Returns the keys that are already in the index, looked up with one filtered search per 500 keys
+    instead of one get_document request per key.
+    """
+    existing_keys: set[str] = set()
+    unique_keys = list(dict.fromkeys(document_keys))
+    for start in range(0, len(unique_keys), 500):
+        chunk = unique_keys[start:start + 500]
+        # Keys are MD5 hex digests, so they never contain the "," delimiter or quotes
+        results = search_client.search(
+            search_text="*",
+            filter=f"search.in(id, '{','.join(chunk)}', ',')",
+            select=["id"],
+            top=len(chunk),
+        )
+        existing_keys.update(result["id"] for result in results)
+    return existing_keys
+
 def generate_document_key(record: Record) -> str:
-    unique_string = record.description + record.comments_and_work_notes + ''.join([record.service, record.service2, record.service3])
-    return hashlib.md5(unique_string.encode()).hexdigest()
+    # Records read from a columnar file carry the key computed when the file was written
+    return getattr(record, 'document_key', None) or compute_document_key(record)
 
 def create_document_from_record(record: Record) -> dict:
-    question_vector = embed_text(record.description)
-    answer_vector = embed_text(record.comments_and_work_notes)
-    
     document_id = generate_document_key(record)
 
-    return {
+    document = {
         "id": document_id,
         "question": record.description,
         "answer": record.comments_and_work_notes,
         "services": [record.service, record.service2, record.service3], 
         "tag": record.tag.split(','),
-        "question_vector": question_vector,
-        "answer_vector": answer_vector,
     }
+    for field in vector_settings.fields:
+        document[field] = vector_settings.truncate(embed_text(getattr(record, VECTOR_SOURCE_ATTRIBUTES[field])))
+    return document
+
+def create_documents_from_records(records: list[Record]) -> list[dict]:
+    """
+    Same documents as create_document_from_record, with the texts of all records embedded in batched requests
+    instead of one request per text and vector field.
+    Records read from a columnar file with stored vectors (see modules/columnar.py) are not embedded again.
+    """
+    stored = [all(getattr(record, field, None) is not None for field in VECTOR_FIELDS) for record in records]
+    missing = [record for record, has_vectors in zip(records, stored) if not has_vectors]
+    embeddings = iter(embed_texts([getattr(record, VECTOR_SOURCE_ATTRIBUTES[field]) for field in vector_settings.fields for record in missing]))
+    vectors = {field: {id(record): next(embeddings) for record in missing} for field in vector_settings.fields}
+    documents = []
+    for record, has_vectors in zip(records, stored):
+        document = {
+            "id": generate_document_key(record),
+            "question": record.description,
+            "answer": record.comments_and_work_notes,
+            "services": [record.service, record.service2, record.service3],
+            "tag": record.tag.split(','),
+        }
+        for field in vector_settings.fields:
+            vector = getattr(record, field).tolist() if has_vectors else vectors[field][id(record)]
+            document[field] = vector_settings.truncate(vector)
+        documents.append(document)
+    return documents
+
+def upload_documents(records: list[dict]) -> None:
+    # Called from the upload threads of the pipeline; raises UploadError if documents are still failing with a
+    # transient status, after the uploaded ones are added to the local store (a resumed run skips them, see
+    # find_existing_document_keys).
+    # The service refuses an empty vector (a text embed_texts could not embed), so those are not sent at all; a
+    # document the service rejects alone is then really a bad document
+    unembedded = {
+        record["id"]: "empty vector" for record in records if any(not record[field] for field in vector_settings.fields)
+    }
+    record_rejected_documents(records, unembedded)
+    try:
+        rejected = bulk_uploader.upload_from_thread([record for record in records if record["id"] not in unembedded])
+    except UploadError as e:
+        record_rejected_documents(records, e.rejected)
+        uploaded = set(e.uploaded)
+        append_to_local_vector_store([record for record in records if record["id"] in uploaded])
+        raise
+    record_rejected_documents(records, rejected)
+    rejected = {**unembedded, **rejected}
+    append_to_local_vector_store([record for record in records if record["id"] not in rejected])
+
+def append_to_local_vector_store(records: list[dict]) -> None:
+    if local_vector_store is not None and records:
+        with local_vector_store_lock:
+            local_vector_store.append(records)
+
+def record_rejected_documents(records: list[dict], rejected: dict[str, str]) -> None:
+    if not rejected:
+        return
+    with rejected_documents_lock, open(REJECTED_DOCUMENTS_PATH, "a", encoding="utf-8") as f:
+        for record in records:
+            if record["id"] in rejected:
+                f.write(json.dumps({"id": record["id"], "error": rejected[record["id"]], "question": record["question"]}, ensure_ascii=False) + "\n")
+    print(f"{len(rejected)} documents rejected and skipped, see {REJECTED_DOCUMENTS_PATH}")
 
-def upload_documents(records: list[Record]) -> None:
-    search_client.upload_documents(records)
@@ -0,0 +1,230 @@
+import asyncio
+import json
+import threading
+import time
+from typing import Optional
+
+from azure.core.exceptions import HttpResponseError
+from azure.core.rest import AsyncHttpResponse, HttpRequest
+from azure.search.documents.aio import SearchClient
+
+# Limits of one index request of Azure AI Search
+MAX_REQUEST_BYTES = 16 * 1024 * 1024
+MAX_REQUEST_DOCUMENTS = 1000
+# Per-document status codes that succeed when the document is sent again: version conflict, index not ready, busy
+RETRYABLE_STATUS_CODES = frozenset({409, 422, 429, 503})
+API_VERSION = "2024-07-01"
+
+# Parts of a 400 error message that blame the request rather than one of its documents
+REQUEST_ERROR_PATTERNS = ("api-version", "does not exist on type", "dimensionality", "dimensions")
+
+def is_request_error(message: str) -> bool:
+    return any(pattern in message for pattern in REQUEST_ERROR_PATTERNS)
+
+def serialize_upload_action(document: dict) -> bytes:
+    return json.dumps({"@search.action": "upload", **document}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class UploadError(Exception):
+    """
+    Raised when documents were still failing with a transient status after the last attempt.
+    Attributes:
+        failed (dict): Error per key of the documents that were not uploaded and may succeed on a later run.
+        uploaded (list): Keys of the documents of the same call that were uploaded.
+        rejected (dict): Error per key of the documents of the same call that the service rejected for good.
+    """
+
+    def __init__(self, failed: dict[str, str], uploaded: Optional[list[str]] = None, rejected: Optional[dict[str, str]] = None):
+        self.failed = failed
+        self.uploaded = uploaded or []
+        self.rejected = rejected or {}
+        examples = "; ".join(f"{key}: {message}" for key, message in list(failed.items())[:3])
+        super().__init__(f"{len(failed)} documents could not be uploaded ({examples})")
+
+class UploadStats:
+    """Counters of a BulkUploader. They are only updated on the uploader's event loop."""
+
+    def __init__(self):
+        self.documents = 0
+        self.bytes = 0
+        self.requests = 0
+        self.retries = 0
+        self.rejected = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def summary(self) -> str:
+        elapsed = max((self.finished_at or 0) - (self.started_at or 0), 1e-9)
+        return (
+            f"uploaded {self.documents} documents in {self.requests} requests, {self.bytes / 1e6:.1f} MB "
+            f"({self.documents / elapsed:.1f} docs/s, {self.bytes / 1e6 / elapsed:.1f} MB/s), {self.retries} retried, "
+            f"{self.rejected} rejected"
+        )
+
+class BulkUploader:
+    """
+    Uploads documents to an Azure AI Search index with the async client.
+    Every document is serialized once, requests are cut at their exact payload size, several requests are in flight at
+    once, and the per-document results of each request are checked so that only the documents the service rejected
+    with a transient status are sent again. Documents rejected for good (e.g. a value that does not fit the schema) are
+    returned to the caller instead of failing the other documents of the call: a request refused with 400 is split
+    down to the documents that still fail alone. HttpResponseError is raised instead when the error blames the request
+    itself (vector dimensions, schema, API version) or when every document of the request fails alone.
+    Attributes:
+        client (SearchClient): Async client of the index; its pipeline still retries whole requests on 429 and 503.
+        key_field (str): Name of the key field of the index.
+        concurrency (int): Index requests in flight at once.
+        max_request_bytes, max_request_documents (int): Limits of one index request.
+        max_attempts (int): Attempts per document, including the first.
+        retry_delay (float): Seconds before the first retry; doubled for every further one.
+        stats (UploadStats): Documents, bytes, requests and retries so far.
+    Methods:
+        upload(self, documents): Uploads documents and returns the error per key of those rejected for good; raises
+            UploadError when some are still failing with a transient status after the last attempt, and
+            HttpResponseError when the service refuses the requests themselves.
+        upload_from_thread(self, documents): Same, from a worker thread, on an event loop owned by the uploader.
+        close(self): Closes the client and stops the uploader's event loop.
+    """
+
+    def __init__(
+        self,
+        client: SearchClient,
+        key_field: str = "id",
+        concurrency: int = 4,
+        max_request_bytes: int = MAX_REQUEST_BYTES,
+        max_request_documents: int = MAX_REQUEST_DOCUMENTS,
+        max_attempts: int = 5,
+        retry_delay: float = 1.0,
+    ):
+        self.client = client
+        self.key_field = key_field
+        self.concurrency = concurrency
+        self.max_request_bytes = max_request_bytes
+        self.max_request_documents = max_request_documents
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.stats = UploadStats()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+
+    async def upload(self, documents: list[dict]) -> dict[str, str]:
+        return await self._upload(self._serialize(documents))
+
+    def _serialize(self, documents: list[dict]) -> dict[str, bytes]:
+        # Vectors make this the costly part of an upload (milliseconds per document), so it runs in the caller's thread
+        return {document[self.key_field]: serialize_upload_action(document) for document in documents}
+
+    async def _upload(self, pending: dict[str, bytes]) -> dict[str, str]:
+        if self.stats.started_at is None:
+            self.stats.started_at = time.monotonic()
+        uploaded: list[str] = []
+        rejected: dict[str, str] = {}
+        errors: dict[str, str] = {}
+        for attempt in range(self.max_attempts):
+            if attempt:
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+                self.stats.retries += len(pending)
+            results = await asyncio.gather(*(self._send(actions) for actions in self._split(list(pending.items()))))
+            retry: dict[str, bytes] = {}
+            for key, succeeded, status_code, message in (result for request in results for result in request):
+                if succeeded:
+                    self.stats.documents += 1
+                    uploaded.append(key)
+                elif status_code in RETRYABLE_STATUS_CODES:
+                    retry[key] = pending[key]
+                    errors[key] = f"{status_code} {message}"
+                else:
+                    rejected[key] = f"{status_code} {message}"
+            pending = retry
+            if not pending:
+                break
+        self.stats.rejected += len(rejected)
+        if pending:
+            # Still failing after the last attempt
+            raise UploadError({key: errors[key] for key in pending}, uploaded, rejected)
+        return rejected
+
+    def _split(self, actions: list[tuple[str, bytes]]) -> list[list[tuple[str, bytes]]]:
+        requests: list[list[tuple[str, bytes]]] = []
+        request: list[tuple[str, bytes]] = []
+        size = len(b'{"value":[]}')
+        for key, action in actions:
+            if request and (size + len(action) + 1 > self.max_request_bytes or len(request) == self.max_request_documents):
+                requests.append(request)
+                request, size = [], len(b'{"value":[]}')
+            request.append((key, action))
+            size += len(action) + 1
+        if request:
+            requests.append(request)
+        return requests
+
+    async def _send(self, actions: list[tuple[str, bytes]]) -> list[tuple[str, bool, int, Optional[str]]]:
+        return await self._check(actions, await self._post(actions))
+
+    async def _post(self, actions: list[tuple[str, bytes]]) -> AsyncHttpResponse:
+        body = b'{"value":[' + b",".join(action for _, action in actions) + b"]}"
+        request = HttpRequest(
+            "POST",
+            "/docs/search.index",
+            params={"api-version": API_VERSION},
+            headers={"Content-Type": "application/json", "Accept": "application/json"},
+            content=body,
+        )
+        async with self._semaphore:
+            response = await self.client.send_request(request)
+        self.stats.requests += 1
+        self.stats.finished_at = time.monotonic()
+        if response.status_code in (200, 207):
+            self.stats.bytes += len(body)
+        return response
+
+    async def _check(self, actions: list[tuple[str, bytes]], response: AsyncHttpResponse) -> list[tuple[str, bool, int, Optional[str]]]:
+        if response.status_code == 413 and len(actions) > 1:
+            # The service accepts less than max_request_bytes; both halves are sent again
+            half = len(actions) // 2
+            first, second = await asyncio.gather(self._send(actions[:half]), self._send(actions[half:]))
+            return first + second
+        if response.status_code == 400:
+            if is_request_error(response.text()):
+                raise HttpResponseError(response=response)
+            results = await self._isolate(actions, response)
+            if len(actions) > 1 and all(not succeeded and status_code == 400 for _, succeeded, status_code, _ in results):
+                # Every document fails alone as well: the request is wrong rather than the documents
+                raise HttpResponseError(response=response)
+            return results
+        if response.status_code not in (200, 207):
+            raise HttpResponseError(response=response)
+        return [(item["key"], item["status"], item["statusCode"], item.get("errorMessage")) for item in response.json()["value"]]
+
+    async def _isolate(self, actions: list[tuple[str, bytes]], response: AsyncHttpResponse) -> list[tuple[str, bool, int, Optional[str]]]:
+        # A document the service cannot take fails the whole request with 400. Both halves are sent again, and every
+        # half that still fails is split further, down to the offending documents, which are rejected
+        if len(actions) == 1:
+            return [(actions[0][0], False, 400, response.text()[:500])]
+        halves = [actions[: len(actions) // 2], actions[len(actions) // 2 :]]
+        responses = await asyncio.gather(*(self._post(half) for half in halves))
+        for half_response in responses:
+            if half_response.status_code == 400 and is_request_error(half_response.text()):
+                raise HttpResponseError(response=half_response)
+        first, second = await asyncio.gather(
+            *(
+                self._isolate(half, half_response) if half_response.status_code == 400 else self._check(half, half_response)
+                for half, half_response in zip(halves, responses)
+            )
+        )
+        return first + second
+
+    def upload_from_thread(self, documents: list[dict]) -> dict[str, str]:
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(self._upload(self._serialize(documents)), self._loop).result()
+
+    def close(self) -> None:
+        with self._loop_lock:
+            if self._loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self.client.close(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
@@ -0,0 +1,88 @@
+import os
+import sys
+import json
+import itertools
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+# The local retriever and keyword extraction are the ones of the chat backend in apps/backend/core
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.keywords import KeywordExtractor
+from core.retrievers import DEFAULT_FIELD_WEIGHTS, LocalVectorRetriever
+
+load_dotenv()
+
+def load_queries(file_path: str) -> list[dict]:
+    """
+    Reads the fixed query set: one JSON object per line with "query", "relevant_ids" (ids of the documents that answer
+    it) and optionally "embedding". Missing embeddings are requested once and kept in the embedding cache.
+    """
+    with open(file_path, 'r', encoding='utf-8') as file:
+        queries = [json.loads(line) for line in file if line.strip()]
+    if any("embedding" not in query for query in queries):
+        from modules.embed import embed_text
+        for query in queries:
+            if "embedding" not in query:
+                query["embedding"] = embed_text(query["query"])
+    return queries
+
+def evaluate(retriever: LocalVectorRetriever, ranked_lists: list[dict], queries: list[dict], field_weights: dict) -> tuple[float, float]:
+    """Returns (hit rate of the top result, MRR@10) of one weight setting. The chat answers from the top result only."""
+    hits = 0
+    reciprocal_ranks = 0.0
+    for lists, query in zip(ranked_lists, queries):
+        rows, _ = retriever.rank(lists, 10, field_weights)
+        ids = [retriever.store.documents[row]["id"] for row in rows.tolist()]
+        relevant = set(query["relevant_ids"])
+        ranks = [rank for rank, document_id in enumerate(ids, start=1) if document_id in relevant]
+        if ranks:
+            hits += ranks[0] == 1
+            reciprocal_ranks += 1 / ranks[0]
+    return hits / len(queries), reciprocal_ranks / len(queries)
+
+def main():
+    """
+    CLI Usage:
+    python indexing/tune_hybrid_weights.py -d <store_dir> -q <queries_path> -g <grid>
+    -d: Directory of the local vector store with its BM25 index (build_local_index.py).
+    -q: Query set in JSON Lines (see load_queries).
+    -g: Comma-separated weights tried for every field (default: 0,0.5,1,2).
+    Prints the best settings; copy the first one to LOCAL_HYBRID_FIELD_WEIGHTS in .env.
+    """
+    start_time = datetime.now()
+
+    store_dir = sys.argv[2].strip()
+    queries_path = sys.argv[4].strip()
+    grid = [float(value) for value in sys.argv[6].split(",")] if len(sys.argv) > 6 else [0, 0.5, 1, 2]
+
+    retriever = LocalVectorRetriever.from_path(store_dir, nprobe=int(os.getenv("LOCAL_VECTOR_STORE_NPROBE", "0")) or None)
+    if retriever.store.bm25 is None:
+        print("Warning: the store has no BM25 index, only the vector fields are tuned. Run build_local_index.py first.")
+    keyword_extractor = KeywordExtractor.from_path(os.getenv("KEYWORD_IDF_PATH"))
+    queries = load_queries(queries_path)
+    print(f"Queries: {len(queries)}, documents: {len(retriever.store)}")
+
+    # The ranked lists do not depend on the weights, so they are computed once and only the fusion is repeated
+    ranked_lists = [
+        retriever.ranked_lists(query["embedding"], keyword_extractor.extract(query["query"]), retriever.candidates)
+        for query in queries
+    ]
+    fields = list(DEFAULT_FIELD_WEIGHTS)
+    results = []
+    for weights in itertools.product(grid, repeat=len(fields)):
+        if not any(weights):
+            continue
+        field_weights = dict(zip(fields, weights))
+        results.append((*evaluate(retriever, ranked_lists, queries, field_weights), field_weights))
+    results.sort(key=lambda result: (result[0], result[1]), reverse=True)
+
+    print(f"{'hit@1':>6} {'MRR@10':>7}  weights")
+    baseline = evaluate(retriever, ranked_lists, queries, DEFAULT_FIELD_WEIGHTS)
+    print(f"{baseline[0]:>6.3f} {baseline[1]:>7.3f}  (default)")
+    for hit_rate, mrr, field_weights in results[:10]:
+        print(f"{hit_rate:>6.3f} {mrr:>7.3f}  " + ",".join(f"{field}={weight:g}" for field, weight in field_weights.items()))
+    print(f"Elapsed time: {datetime.now() - start_time}")
+
+if __name__ == '__main__':
+    main()
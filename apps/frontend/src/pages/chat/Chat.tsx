@@ -80,7 +80,7 @@ const Chat = () => {
         } finally {
             setIsStreaming(false);
         }
-        const fullResponse: ChatAppResponse = { ...JSON.parse(String(askResponse)),
+        const fullResponse: ChatAppResponse = { ...askResponse,
             choices: [{ ...askResponse.choices[0],
                         message: { content: answer,
                             role: askResponse.choices[0].message.role